@@ -1,14 +1,63 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from .agent import Agent
-from .async_communication import AsyncCommunication
-from .async_udp_communication import AsyncUdp
-from .controller import PIController
-from .defs import Allocation, EventId, Packet
-from .deploy import SmartGridSimulation #, runpp, optimize_network_opf, optimize_network_pi#, live_plot_voltage
-from .network_allocator import NetworkAllocator
-from .network_load import NetworkLoad
-
-__all__ = ['Agent', 'AsyncCommunication', 'AsyncUdp', 'Allocation', 'EventId', 'Packet', 'SmartGridSimulation',
-           'NetworkAllocator', 'NetworkLoad'] #,'live_plot', 'PIController', 'runpp', 'optimize_network_opf', 'optimize_network_pi']
+import importlib
+import sys
+
+# Public names and the module defining them.
+# Modules are only imported on first access (PEP 562), so that hosting agents
+# doesn't pull in deployment and power flow dependencies (rpyc, plumbum, pandapower, zmq).
+_exports = {
+    'Agent': '.agent',
+    'ErrorModel': '.agent',
+    'AnalysisCache': '.analysis',
+    'RunAnalysis': '.analysis',
+    'analyze_log': '.analysis',
+    'analyze_runs': '.analysis',
+    'AsyncCommunication': '.async_communication',
+    'AsyncUdp': '.async_udp_communication',
+    'ChannelModel': '.channel',
+    'Link': '.channel',
+    'GridStateBus': '.bus',
+    'PowerFlowTrigger': '.bus',
+    'PIController': '.controller',
+    'GridPlant': '.tuning',
+    'TuningCache': '.tuning',
+    'VoltageTrajectories': '.tuning',
+    'tune': '.tuning',
+    'Allocation': '.defs',
+    'EventId': '.defs',
+    'HashRing': '.defs',
+    'Packet': '.defs',
+    'Metrics': '.metrics',
+    'OfflineSimulation': '.offline',
+    'CompiledGrid': '.powerflow',
+    'PowerFlow': '.powerflow',
+    'VoltageSensitivity': '.powerflow',
+    'SmartGridSimulation': '.deploy',
+    'NetworkAggregator': '.network_aggregator',
+    'NetworkAllocator': '.network_allocator',
+    'ShardedAllocator': '.network_allocator',
+    'NetworkLoad': '.network_load',
+    'RemoteBatch': '.remote',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ is not supported before Python 3.7
+    for _name in _exports:
+        __getattr__(_name)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import queue
 from time import monotonic as time
@@ -10,7 +11,6 @@ from threading import Thread, Event
 
 import asyncio
 from .async_udp_communication import AsyncUdp
-from .async_communication import AsyncCommunication
 from .defs import Packet
 
 logger = logging.getLogger(__name__)
@@ -23,15 +23,33 @@ logger.addHandler(ch)
 # logger.setLevel(logging.INFO)
 # ch.setLevel(logging.INFO)
 
+# modes using the zmq transport, each being the scheme of the endpoints of 'ip:port' addresses
+ZMQ_MODES = ('tcp', 'ipc', 'inproc')
+
 
 class ErrorModel(object):
+    """ Packets pass with probability rate, drawn once per packet when it is sent.
+    NetworkLoads handle packets without Agent.receive, so drops on receive would only
+    hit the packets to the allocator: received packets always pass.
+    """
     def __init__(self, rate=1.0, seed=None):
         self.rate = rate
         self.ran = Random(seed)
 
     def corrupt(self, packet):
-        return self.ran.random() >= self.rate
+        return False
+
+    def on_send(self, packet, src, dst):
+        """ Fate of packet sent from src to dst
+
+        :returns: whether the packet is dropped, and the delay (s) before sending it
+        :rtype: tuple
+        """
+        return self.ran.random() >= self.rate, 0
 
+    def on_receive(self, packet):
+        """ Whether received packet is dropped """
+        return self.corrupt(packet)
 
 
 # A generic Network Agent.
@@ -47,17 +65,28 @@ class Agent(object, metaclass=ABCMeta):
         self._local = None
         if mode == 'udp':
             self.comm = AsyncUdp()
-        elif mode == 'tcp':
-            self.comm = AsyncCommunication()
+        elif mode in ZMQ_MODES:
+            # zmq is only imported when needed
+            from .async_communication import AsyncCommunication
+            self.comm = AsyncCommunication(scheme=mode)
         else:
             raise ValueError(mode)
         self.comm._callback = self.receive
+        # groups whose packets are handled, see join_group
+        self.groups = set()
+        # metrics registry shared with the communication layer
+        self.metrics = self.comm.metrics
+        # if set, log a metrics snapshot every metrics_period seconds
+        self.metrics_period = None
+        self.metrics_event = None
         self._error_model = None
         self._sim_thread = Thread(target=self._run)
         self.logger = None
         self.loop = None
         self.event = None
         self.is_running = Event()
+        # maximum time run() waits for the communication layer to be ready
+        self.ready_timeout = 5
 
     @property
     def error_model(self):
@@ -80,6 +109,31 @@ class Agent(object, metaclass=ABCMeta):
         #     self.comm._local_address = value
         #     self.comm.start()
 
+    def join_group(self, group):
+        """ Receive the packets sent to group, a multicast 'ip:port' address in udp mode,
+        the address its publisher binds to with zmq. Must be called before run().
+        Without multicast (see AsyncUdp.multicast), group packets are sent to each member.
+
+        :param group: address of the group
+        :returns:
+        :rtype:
+
+        """
+        self.groups.add(group)
+        if self.comm.multicast:
+            self.comm.groups.append(group)
+
+    def host_group(self, group):
+        """ Publish packets to group from this agent. Called before run(), members subscribe
+        to it before the first packet is published, otherwise the publisher is set up on the first one.
+
+        :param group: address of the group
+        :returns:
+        :rtype:
+
+        """
+        self.comm.hosted.append(group)
+
     @property
     def callback(self):
         return self.comm._callback
@@ -101,7 +155,17 @@ class Agent(object, metaclass=ABCMeta):
             '{}.{}.{}'.format(__name__, self.type, self.local))
         self.comm.start()
         self._sim_thread.start()
-        
+        # Packets sent before the socket is bound would be silently lost
+        if not self.comm.ready.wait(self.ready_timeout):
+            self.logger.warning("communication layer not ready after {}s".format(self.ready_timeout))
+        if self.metrics_period:
+            self.metrics_event = self.schedule(self.dump_metrics, delay=self.metrics_period)
+
+    def dump_metrics(self):
+        """ Log a snapshot of the agent's metrics and schedule the next one """
+        self.logger.info("METRICS {}".format(json.dumps(self.metrics.snapshot(), default=str)))
+        if self.metrics_period:
+            self.metrics_event = self.schedule(self.dump_metrics, delay=self.metrics_period)
 
     def _run(self):
         self.logger.info("started {} agent's infinite loop".format(self.type))
@@ -148,6 +212,7 @@ class Agent(object, metaclass=ABCMeta):
     def stop(self):
         """ stop the Agent by interrupted the loop"""
         # Schedule None to trigger Agent's loop termination
+        self.interrupt_event(self.metrics_event)
         try:
             self.loop.call_soon_threadsafe(self.event.set)
         except Exception as e:
@@ -163,20 +228,58 @@ class Agent(object, metaclass=ABCMeta):
             self.logger.warning(f"interrupt_event failed: {e!r}")
 
     def send(self, packet: Packet, remote: str):
+        self._transmit(self.comm.send, packet, remote)
+
+    def publish(self, packet: Packet, group: str):
+        """ Send packet once to all the members of group, see join_group
+        The error model is applied by each member on receipt, see deliver.
+        """
+        self.comm.publish(packet, group)
+
+    def _transmit(self, transmit, packet, remote):
         if isinstance(self._error_model, ErrorModel):
-            if not self._error_model.corrupt(packet):
-                self.comm.send(packet, remote)
-            else:
+            drop, delay = self._error_model.on_send(packet, self.local, remote)
+            if drop:
+                self.metrics.count('dropped_send', packet.ptype)
                 self.logger.info("packet error occurred at Agent.send")
+            elif delay > 0:
+                self.metrics.count('delayed_send', packet.ptype)
+                self.schedule(transmit, args=[packet, remote], delay=delay)
+            else:
+                transmit(packet, remote)
         else:
-            self.comm.send(packet, remote)
+            transmit(packet, remote)
+
+    def deliver(self, handle, packet, src=None):
+        """ Handle a packet published to one of the agent's groups
+        A group packet is sent once, so each member draws its fate on the
+        (packet.src, local) link of the error model, as for a packet sent to it.
+
+        :param handle: handler called with packet and src unless it is dropped
+        :param packet: packet received
+        :param src: source of packet
+        """
+        if isinstance(self._error_model, ErrorModel):
+            drop, delay = self._error_model.on_send(packet, packet.src, self.local)
+            if drop:
+                self.metrics.count('dropped_group', packet.ptype)
+                self.logger.info("packet error occurred at Agent.deliver")
+                return
+            if delay > 0:
+                self.metrics.count('delayed_group', packet.ptype)
+                self.schedule(handle, args=[packet, src], delay=delay)
+                return
+        handle(packet, src)
 
     def receive(self, packet, src=None):
         self.logger.info("receiving {}".format(packet))
-        if isinstance(self._error_model, ErrorModel):
-            if not self._error_model.corrupt(packet):
+        if packet.dst in self.groups:
+            self.deliver(self.receive_handle, packet, src)
+        elif isinstance(self._error_model, ErrorModel):
+            if not self._error_model.on_receive(packet):
                 self.receive_handle(packet, src)
             else:
+                self.metrics.count('dropped_receive', packet.ptype)
                 self.logger.info("packet error occurred at Agent.receive")
         else:
             self.receive_handle(packet, src)
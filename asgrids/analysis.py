@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming post-processing of the simulation logs written by SmartGridSimulation.runpp:
+
+    LOAD <time>\t<load name>\t<p_kw>
+    VOLTAGE <time>\t<bus name>\t<vm_pu>
+
+Logs are read in chunks of lines and metrics are accumulated as records come,
+so each run is parsed once whatever its size. Per-run summaries can be kept in
+a small JSON index (AnalysisCache) so that re-plotting doesn't re-read the logs.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Production (kW) of the PV over the horizon without any control, reference of production losses
+NO_CONTROL_PRODUCTION = 35970.01922997645
+CHUNK_SIZE = 1 << 20
+
+
+class RunAnalysis(object):
+    """ Incremental metrics of one run.
+
+    - violation rate: share of voltage records at or above max_vm
+    - time above limit: per bus integral (trapezoidal) of the voltage over time, with
+      voltages below max_vm counted as 0
+    - production: sum of the generators' (non positive) load records during the first
+      horizon seconds of LOAD records, and its loss relative to reference
+
+    Times are relative to the first record of each kind, voltage metrics only consider
+    records in tslice.
+    """
+    def __init__(self, max_vm=1.05, horizon=200, reference=NO_CONTROL_PRODUCTION, tslice=None):
+        self.max_vm = max_vm
+        self.horizon = horizon
+        self.reference = reference
+        self.tslice = (0, float("inf")) if tslice is None else tuple(tslice)
+        self.voltage_t0 = None
+        self.load_t0 = None
+        self.samples = 0
+        self.violations = 0
+        # bus -> integral, and last (time, clipped voltage) of the bus
+        self.time_above = {}
+        self._last = {}
+        # load -> sum of p_kw
+        self.loads = {}
+        self.malformed = 0
+
+    def feed(self, lines):
+        """ Account for a chunk of log lines """
+        self.feed_records(self._parse(lines))
+
+    def _parse(self, lines):
+        for line in lines:
+            kind, _, record = line.partition(' ')
+            try:
+                t, name, value = record.rstrip('\n').split('\t')
+                t = float(t)
+                value = float(value)
+            except ValueError:
+                self.malformed += 1
+                continue
+            yield kind, t, name, value
+
+    def feed_records(self, records):
+        """ Account for (kind, time, name, value) records, kind being 'VOLTAGE' or 'LOAD' """
+        max_vm = self.max_vm
+        start, end = self.tslice
+        time_above = self.time_above
+        last = self._last
+        loads = self.loads
+        for kind, t, name, value in records:
+            if kind == 'VOLTAGE':
+                if self.voltage_t0 is None:
+                    self.voltage_t0 = t
+                if not start <= t - self.voltage_t0 <= end:
+                    continue
+                self.samples += 1
+                if value >= max_vm:
+                    self.violations += 1
+                else:
+                    value = 0.0
+                previous = last.get(name)
+                if previous is None:
+                    time_above[name] = 0.0
+                else:
+                    time_above[name] += 0.5 * (previous[1] + value) * (t - previous[0])
+                last[name] = (t, value)
+            elif kind == 'LOAD':
+                if self.load_t0 is None:
+                    self.load_t0 = t
+                if t - self.load_t0 > self.horizon:
+                    continue
+                loads[name] = loads.get(name, 0.0) + value
+            else:
+                self.malformed += 1
+
+    @property
+    def production(self):
+        return sum(value for value in self.loads.values() if value <= 0)
+
+    def summary(self):
+        """ Metrics of the records fed so far as a plain (json serializable) dict """
+        above = {bus: value for bus, value in self.time_above.items() if value > 0}
+        production = self.production
+        return {
+            'samples': self.samples,
+            'violations': self.violations,
+            'violation_rate': self.violations / self.samples if self.samples else None,
+            'time_above': above,
+            'time_above_mean': sum(above.values()) / len(above) if above else None,
+            'production': production,
+            'production_loss': 1 - abs(production) / self.reference if self.reference else None,
+            'malformed': self.malformed,
+        }
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """ Lines of the file at path, in lists of about chunk_size bytes """
+    with open(path) as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                return
+            yield lines
+
+
+def analyze_log(path, max_vm=1.05, horizon=200, reference=NO_CONTROL_PRODUCTION, tslice=None,
+                chunk_size=CHUNK_SIZE):
+    """ Stream the log at path through a RunAnalysis
+
+    :returns: the run summary, see RunAnalysis.summary
+    :rtype: dict
+    """
+    analysis = RunAnalysis(max_vm=max_vm, horizon=horizon, reference=reference, tslice=tslice)
+    for lines in read_chunks(path, chunk_size):
+        analysis.feed(lines)
+    return analysis.summary()
+
+
+class AnalysisCache(object):
+    """ JSON index of run summaries, keyed by log path and analysis parameters.
+    An entry is valid as long as the log's size and modification time are unchanged.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(log, params):
+        return '{}?{}'.format(os.path.abspath(log), json.dumps(params, sort_keys=True))
+
+    def get(self, log, params):
+        entry = self.entries.get(self.key(log, params))
+        if entry is None:
+            return None
+        stat = os.stat(log)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            return None
+        return entry['summary']
+
+    def put(self, log, params, summary):
+        stat = os.stat(log)
+        self.entries[self.key(log, params)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'summary': summary}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+def analyze_runs(logs, index=None, workers=1, **params):
+    """ Summaries of several runs, parsing only the logs missing from the index.
+
+    :param logs: paths of the run logs
+    :param index: path of the AnalysisCache JSON index, None to disable caching
+    :param workers: number of processes parsing logs in parallel
+    :param params: RunAnalysis parameters (max_vm, horizon, reference, tslice)
+    :returns: summary of each log, by path. Logs that can't be read are left out.
+    :rtype: dict
+    """
+    if params.get('tslice') is not None:
+        params['tslice'] = list(params['tslice'])
+    cache = AnalysisCache(index) if index is not None else None
+    summaries = {}
+    missing = []
+    for log in logs:
+        summary = None
+        if cache is not None:
+            try:
+                summary = cache.get(log, params)
+            except OSError:
+                continue
+        if summary is None:
+            missing.append(log)
+        else:
+            summaries[log] = summary
+
+    def done(log, summary):
+        summaries[log] = summary
+        if cache is not None:
+            cache.put(log, params, summary)
+
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(log, executor.submit(analyze_log, log, **params)) for log in missing]
+            for log, future in futures:
+                try:
+                    done(log, future.result())
+                except OSError:
+                    pass
+    else:
+        for log in missing:
+            try:
+                done(log, analyze_log(log, **params))
+            except OSError:
+                pass
+    if cache is not None:
+        cache.save()
+    return summaries
@@ -3,14 +3,18 @@
 
 import asyncio
 import logging
+import os
+import tempfile
 import threading
 from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import msgpack
 import zmq
 import zmq.asyncio
 
 from .defs import ext_pack, ext_unpack, Packet
+from .metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
@@ -22,12 +26,39 @@ logger = logging.getLogger(__name__)
 # ch.setFormatter(formatter)
 # logger.addHandler(ch)
 
+SCHEMES = ('tcp', 'ipc', 'inproc')
+
+
+def endpoint(address, scheme='tcp'):
+    """ ZMQ endpoint of an agent or group address
+
+    :param address: 'ip:port' address, or endpoint with its scheme (tcp://, ipc:// or inproc://)
+    :param scheme: scheme of the addresses without one, ipc endpoints being files of the temporary directory
+    :returns: the endpoint to bind or connect to
+    :rtype: str
+    """
+    prefix, sep, _ = address.partition('://')
+    if sep:
+        if prefix not in SCHEMES:
+            raise ValueError('Unsupported endpoint {}'.format(address))
+        return address
+    if scheme == 'ipc':
+        return 'ipc://{}'.format(os.path.join(tempfile.gettempdir(), 'asgrids-{}'.format(address)))
+    return '{}://{}'.format(scheme, address)
+
+
 class AsyncCommunication(threading.Thread):
-    def __init__(self, local_address=None, callback=None, identity=None):
+    # packets to a group of nodes are published once to its subscribers, see groups
+    multicast = True
 
+    def __init__(self, local_address=None, callback=None, identity=None, scheme='tcp'):
+        if scheme not in SCHEMES:
+            raise ValueError(scheme)
         self._identity = identity
         self._callback = callback
         self._local_address = local_address
+        # scheme of the addresses without one, see endpoint
+        self.scheme = scheme
         self._timeout = 1000
         self.running = False
         self._loop = asyncio.new_event_loop()
@@ -38,10 +69,20 @@ class AsyncCommunication(threading.Thread):
             self._executor = ThreadPoolExecutor(max_workers=10)
         self._loop.set_default_executor(self._executor)
         asyncio.set_event_loop(self._loop)
-        self._context = zmq.asyncio.Context()
+        # inproc endpoints only connect sockets of the same context
+        self._context = zmq.asyncio.Context.instance()
         self._poller = zmq.asyncio.Poller()
         self._clients = {}
+        # group addresses subscribed to, and those whose PUB socket is bound, to be set before start()
+        self.groups = []
+        self.hosted = []
+        self._publishers = {}
+        self._subscribers = []
         self.event = asyncio.Event(loop=self._loop)
+        # set once the server socket is bound
+        self.ready = threading.Event()
+        self.metrics = Metrics()
+        self.metrics.gauge('executor_queue', lambda: self._executor._work_queue.qsize())
         name = 'AsyncCommThread'
         threading.Thread.__init__(self, name=name)
 
@@ -52,33 +93,88 @@ class AsyncCommunication(threading.Thread):
         finally:
             self._loop.close()
 
+    def _pack(self, request):
+        ptype = getattr(request, 'ptype', None)
+        t = perf_counter()
+        try:
+            p = msgpack.packb(request, default=ext_pack, strict_types=True, encoding='utf-8')
+        except Exception as e:
+            self.metrics.count('encode_errors', ptype)
+            logger.error("Error packing {}".format(e))
+            raise e
+        self.metrics.observe('encode_time', perf_counter() - t)
+        return p
+
     async def _send(self, request: Packet, remote):
         if remote not in self._clients:
+            socket_address = endpoint(remote, self.scheme)
             try:
-                self._clients[remote] = self._context.socket(zmq.DEALER)
+                client = self._context.socket(zmq.DEALER)
                 # No lingering after socket is closed.
                 # This has proven to cause problems terminating asyncio when lingering infinitely
-                self._clients[remote].setsockopt(zmq.LINGER, 0)
+                client.setsockopt(zmq.LINGER, 0)
                 # self._poller.register(self._client, zmq.POLLIN)
+                # Connect once, zmq reconnects by itself. Connecting on every send opens a new connection each time.
+                logger.info("{} connecting to {}".format(self._local_address, socket_address))
+                client.connect(socket_address)
+                self._clients[remote] = client
+            except zmq.ZMQError as zmqerror:
+                self.metrics.count('send_errors', getattr(request, 'ptype', None))
+                logger.error("Error connecting client socket to address {}. {}".format(socket_address, zmqerror))
+                return
             except Exception as e:
                 logger.error(e)
                 raise e
 
+        ptype = getattr(request, 'ptype', None)
+        p = self._pack(request)
         try:
-            p = msgpack.packb(request, default=ext_pack, strict_types=True, encoding='utf-8')
-        except Exception as e:
-            logger.error("Error packing {}".format(e))
-            raise e
+            logger.info('{} sending {} to {}'.format(self._local_address, request, remote))
+            await self._clients[remote].send_multipart([p])
+            self.metrics.count('sent', ptype)
+        except zmq.ZMQError as zmqerror:
+            self.metrics.count('send_errors', ptype)
+            logger.error("Error sending to address {}. {}".format(remote, zmqerror))
+            return
 
+    def _bind_publisher(self, group):
+        """ PUB socket of group, bound to its address """
+        publisher = self._context.socket(zmq.PUB)
+        publisher.setsockopt(zmq.LINGER, 0)
+        publisher.bind(endpoint(group, self.scheme))
+        self._publishers[group] = publisher
+        return publisher
+
+    async def _publish(self, request: Packet, group):
+        ptype = getattr(request, 'ptype', None)
         try:
-            socket_address = 'tcp://{}'.format(remote)
-            logger.info("{} connecting to {}".format(self._local_address, socket_address))
-            self._clients[remote].connect(socket_address)
-            logger.info('{} sending {} to {}'.format(self._local_address, request, socket_address))
-            await self._clients[remote].send_multipart([p])
+            # Packets published before the members subscribed are lost, see hosted
+            publisher = self._publishers.get(group) or self._bind_publisher(group)
         except zmq.ZMQError as zmqerror:
-            logger.error("Error connecting client socket to address {}. {}".format(socket_address, zmqerror))
+            self.metrics.count('send_errors', ptype)
+            logger.error("Error binding publisher of group {}. {}".format(group, zmqerror))
             return
+        p = self._pack(request)
+        try:
+            logger.info('{} publishing {} to {}'.format(self._local_address, request, group))
+            await publisher.send(p)
+            self.metrics.count('sent', ptype)
+        except zmq.ZMQError as zmqerror:
+            self.metrics.count('send_errors', ptype)
+            logger.error("Error publishing to group {}. {}".format(group, zmqerror))
+
+    async def _handle(self, msg):
+        t = perf_counter()
+        try:
+            p = msgpack.unpackb(msg, ext_hook=ext_unpack, encoding='utf-8')
+            # ident = msgpack.unpackb(ident, encoding='utf-8')
+        except Exception as e:
+            self.metrics.count('decode_errors')
+            raise e
+        self.metrics.observe('decode_time', perf_counter() - t)
+        self.metrics.count('received', getattr(p, 'ptype', None))
+        logger.debug('server received {}'.format(p))
+        await self._loop.run_in_executor(self._executor, self._callback, p)
 
     async def _run_server(self):
         if self._local_address is None:
@@ -87,27 +183,38 @@ class AsyncCommunication(threading.Thread):
         if self._callback is None:
             logger.warning('callback is not set')
             raise ValueError(self._callback)
-        logger.warning('Server listening on address tcp://{}.'.format(self._local_address))
+        local_endpoint = endpoint(self._local_address, self.scheme)
+        logger.warning('Server listening on address {}.'.format(local_endpoint))
 
         self._server = self._context.socket(zmq.ROUTER)
-        self._server.bind('tcp://{}'.format(self._local_address))
+        self._server.bind(local_endpoint)
         self._poller.register(self._server, zmq.POLLIN)
-        logger.info('running server on tcp://{}.'.format(self._local_address))
+        for group in self.hosted:
+            self._bind_publisher(group)
+        for group in self.groups:
+            subscriber = self._context.socket(zmq.SUB)
+            subscriber.setsockopt(zmq.LINGER, 0)
+            subscriber.connect(endpoint(group, self.scheme))
+            subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+            self._poller.register(subscriber, zmq.POLLIN)
+            self._subscribers.append(subscriber)
+        self.ready.set()
+        logger.info('running server on {}.'.format(local_endpoint))
         while not self.event.is_set():
             items = dict(await self._poller.poll(self._timeout))
             if self._server in items and items[self._server] == zmq.POLLIN:
                 logger.info("receiving at server {}".format(self._local_address))
                 _, msg = await self._server.recv_multipart()
-                try:
-                    p = msgpack.unpackb(msg, ext_hook=ext_unpack, encoding='utf-8')
-                    # ident = msgpack.unpackb(ident, encoding='utf-8')
-                except Exception as e:
-                    raise e
-                logger.debug('server received {}'.format(p))
-                await self._loop.run_in_executor(self._executor, self._callback, p)
+                await self._handle(msg)
+            for subscriber in self._subscribers:
+                if items.get(subscriber) == zmq.POLLIN:
+                    await self._handle(await subscriber.recv())
         logger.info("stopping server")
-        self._poller.unregister(self._server)
-        self._server.close()
+        for sock in [self._server] + self._subscribers:
+            self._poller.unregister(sock)
+            sock.close()
+        for publisher in self._publishers.values():
+            publisher.close()
 
     def send(self, request, remote):
         logger.debug("send {} to {}".format(request, remote))
@@ -117,6 +224,14 @@ class AsyncCommunication(threading.Thread):
         except Exception as e:
             logger.warning(e)
 
+    def publish(self, request, group):
+        logger.debug("publish {} to {}".format(request, group))
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._publish(request=request, group=group), self._loop)
+        except Exception as e:
+            logger.warning(e)
+
     def stop(self):
         logger.info("Stopping AsyncCommThread")
         try:
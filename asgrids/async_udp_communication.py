@@ -3,12 +3,17 @@
 
 import asyncio
 import logging
+import os
+import select
+import socket
 import threading
 from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import msgpack
 
 from .defs import ext_pack, ext_unpack, Packet
+from .metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +25,29 @@ logger = logging.getLogger(__name__)
 # ch.setFormatter(formatter)
 # logger.addHandler(ch)
 
+# Linux only, missing from the socket module on older Pythons
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+MAX_DATAGRAM = 65535
+
+
+def kernel_drops(sock):
+    """ Datagrams dropped by the kernel on sock because its receive buffer was full.
+    Read from /proc/net/udp, returns None where it is not available.
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        for path in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
 class AsyncUdpProtocol:
     def __init__(self, callback, loop):
         self.loop = loop
@@ -51,9 +79,62 @@ class AsyncUdp(threading.Thread):
         self.protocol = None
         self.transport = None
         self.event = None
+        # Socket tuning, to be set before start()
+        # kernel receive/send buffer sizes in bytes, None keeps the system default
+        self.rcvbuf = None
+        self.sndbuf = None
+        # number of sockets bound to local_address with SO_REUSEPORT, each extra one served by its own thread
+        self.receivers = 1
+        # drain up to batch_size datagrams per wakeup and hand them to the callback as a batch
+        self.bulk = False
+        self.batch_size = 64
+        # packets to a group of nodes are sent once to its multicast address, see groups.
+        # Set to False where multicast isn't routed between the agents' hosts, before joining groups:
+        # group packets are then sent to each member
+        self.multicast = True
+        # multicast 'ip:port' addresses also received from, on the interface of local_address
+        self.groups = []
+        # groups published to, nothing to bind to send to a multicast address
+        self.hosted = []
+        self._socks = []
+        self._group_socks = []
+        # whether published datagrams leave through the interface of the local address
+        self._multicast_interface = False
+        self._receiver_threads = []
+        self._stopping = threading.Event()
+        # set once the sockets are bound (or failed to)
+        self.ready = threading.Event()
+        self.metrics = Metrics()
+        self.metrics.gauge('executor_queue', lambda: self._executor._work_queue.qsize())
         name = 'AsyncUdpThread'
         threading.Thread.__init__(self, name=name)
 
+    def _make_socket(self, addr):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.receivers > 1:
+            sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        sock.bind(addr)
+        sock.setblocking(False)
+        return sock
+
+    def _make_group_socket(self, group, interface):
+        """ Socket receiving the datagrams sent to multicast address group ('ip:port') on interface """
+        ipaddr, port = group.split(':')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # every node of the host joining the group gets its own copy
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        sock.bind((ipaddr, int(port)))
+        membership = socket.inet_aton(ipaddr) + socket.inet_aton(socket.gethostbyname(interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setblocking(False)
+        return sock
+
     async def udp_loop(self):
         self._loop = asyncio.get_event_loop()
         self._loop.set_default_executor(self._executor)
@@ -62,16 +143,38 @@ class AsyncUdp(threading.Thread):
         ipaddr, port = self._local_address.split(':')
         port = int(port)
         try:
-            self.transport, self.protocol = await self._loop.create_datagram_endpoint(
-                lambda: AsyncUdpProtocol(self._receive, self._loop), local_addr=(ipaddr, port))
+            self._socks = [self._make_socket((ipaddr, port)) for _ in range(self.receivers)]
+            if self.bulk:
+                self._loop.add_reader(self._socks[0].fileno(), self._drain_ready, self._socks[0])
+            else:
+                self.transport, self.protocol = await self._loop.create_datagram_endpoint(
+                    lambda: AsyncUdpProtocol(self._receive, self._loop), sock=self._socks[0])
+            for group in self.groups:
+                sock = self._make_group_socket(group, ipaddr)
+                self._loop.add_reader(sock.fileno(), self._drain_ready, sock)
+                self._group_socks.append(sock)
+            for sock in self._socks[1:]:
+                thread = threading.Thread(target=self._receiver, args=[sock], name='AsyncUdpReceiver', daemon=True)
+                thread.start()
+                self._receiver_threads.append(thread)
         except Exception as e:
             logger.warning(e)
+        self.ready.set()
 
         await self.event.wait()
         logger.debug("Closing udp loop")
+        self._stopping.set()
         try:
-            self.transport.abort()
-            self.transport.close()
+            if self.bulk:
+                self._loop.remove_reader(self._socks[0].fileno())
+            else:
+                self.transport.abort()
+                self.transport.close()
+            for sock in self._group_socks:
+                self._loop.remove_reader(sock.fileno())
+                sock.close()
+            for sock in self._socks:
+                sock.close()
         except Exception as e:
             logger.warning(e)
         logger.debug("Closed udp loop")
@@ -80,26 +183,134 @@ class AsyncUdp(threading.Thread):
         asyncio.run(self.udp_loop())
         logger.debug("Closing asyncio")
 
+    def drop_counters(self):
+        """ Drops caused by this transport, as opposed to losses injected in the network.
+
+        :returns: decode/send errors, packets received while not running, and kernel
+            receive buffer overflows summed over the receiver sockets (None if unknown).
+        :rtype: dict
+        """
+        drops = [kernel_drops(sock) for sock in self._socks]
+        counters = {key: self.metrics.get(key) for key in ('decode_errors', 'send_errors', 'not_running')}
+        counters['kernel_drops'] = None if None in drops or not drops else sum(drops)
+        return counters
+
     def send(self, request, remote):
+        ptype = getattr(request, 'ptype', None)
+        t = perf_counter()
         p = msgpack.packb(request, default=ext_pack, strict_types=True, encoding='utf-8')
+        self.metrics.observe('encode_time', perf_counter() - t)
         ipaddr, port = remote.split(':')
         port = int(port)
-        if self.transport:
+        if self.bulk and self._socks:
+            try:
+                self._socks[0].sendto(p, (ipaddr, port))
+                self.metrics.count('sent', ptype)
+            except Exception as e:
+                self.metrics.count('send_errors', ptype)
+                logger.warning(e)
+        elif self.transport:
             try:
                 self.transport.sendto(p, (ipaddr, port))
+                self.metrics.count('sent', ptype)
             except Exception as e:
+                self.metrics.count('send_errors', ptype)
                 logger.warning(e)
 
+    def publish(self, request, group):
+        # a datagram sent to the multicast address reaches every member of the group
+        if not self._multicast_interface and self._socks:
+            # only resolved by publishers, the local address of the others may not be an IPv4 address
+            try:
+                interface = socket.inet_aton(socket.gethostbyname(self._local_address.split(':')[0]))
+                self._socks[0].setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+            except OSError as e:
+                logger.warning("Can't publish from the interface of {}: {}".format(self._local_address, e))
+            self._multicast_interface = True
+        self.send(request, group)
+
     async def _receive(self, data, addr):
         if not self.running:
+            self.metrics.count('not_running')
             return
-        p = msgpack.unpackb(data, ext_hook=ext_unpack, encoding='utf-8')
+        t = perf_counter()
+        try:
+            p = msgpack.unpackb(data, ext_hook=ext_unpack, encoding='utf-8')
+        except Exception as e:
+            self.metrics.count('decode_errors')
+            logger.warning("Error unpacking datagram from {}: {}".format(addr, e))
+            return
+        self.metrics.observe('decode_time', perf_counter() - t)
+        self.metrics.count('received', getattr(p, 'ptype', None))
         await self._loop.run_in_executor(self._executor, self._callback, p)
 
+    def _drain(self, sock, batch):
+        """ Read pending datagrams from sock without blocking until it is empty or batch is full """
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(sock.recvfrom(MAX_DATAGRAM, socket.MSG_DONTWAIT))
+            except (BlockingIOError, InterruptedError):
+                break
+        return batch
+
+    def _drain_ready(self, sock):
+        try:
+            batch = self._drain(sock, [])
+        except OSError as e:
+            logger.warning(e)
+            return
+        self._dispatch(batch)
+
+    def _receiver(self, sock):
+        """ Serve an extra SO_REUSEPORT socket from a dedicated thread """
+        while not self._stopping.is_set():
+            try:
+                readable, _, _ = select.select([sock], [], [], 0.5)
+                if readable:
+                    self._dispatch(self._drain(sock, []))
+            except (OSError, ValueError):
+                # socket closed by udp_loop
+                break
+
+    def decode_batch(self, batch):
+        """ Decode a batch of (data, addr) datagrams, counting those that can't be decoded """
+        packets = []
+        for data, addr in batch:
+            t = perf_counter()
+            try:
+                p = msgpack.unpackb(data, ext_hook=ext_unpack, encoding='utf-8')
+            except Exception as e:
+                self.metrics.count('decode_errors')
+                logger.warning("Error unpacking datagram from {}: {}".format(addr, e))
+                continue
+            self.metrics.observe('decode_time', perf_counter() - t)
+            self.metrics.count('received', getattr(p, 'ptype', None))
+            packets.append(p)
+        return packets
+
+    def _dispatch(self, batch):
+        if not batch:
+            return
+        if not self.running:
+            self.metrics.count('not_running', n=len(batch))
+            return
+        self.metrics.count('batches')
+        packets = self.decode_batch(batch)
+        if packets:
+            self._executor.submit(self._handle_batch, packets)
+
+    def _handle_batch(self, packets):
+        for p in packets:
+            try:
+                self._callback(p)
+            except Exception as e:
+                logger.warning(e)
+
     def stop(self):
         logger.debug("Stopping AsyncUdpThread")
         # self._poller.unregister(self._client)
+        self._stopping.set()
         try:
             self._loop.call_soon_threadsafe(self.event.set)
         except Exception as e:
-            logger.warning(e)
\ No newline at end of file
+            logger.warning(e)
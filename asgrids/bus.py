@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Grid state bus shared by the power flow and the loads.
+
+Each load owns a slot holding its (p, q) setpoint and the voltage at its bus, with
+sequence counters telling readers whether a slot changed since they last looked.
+Loads only write their own setpoint slot and the power flow is the only writer of
+voltages, so slots are read and written without locks: writers make the counter odd
+while writing and even once done (seqlock), readers retry torn reads.
+The solver consumes whole arrays instead of per load queue entries.
+
+Arrays can live in shared memory to be used across processes: multiprocessing.shared_memory
+(attach by name), or a RawArray inherited by child processes before Python 3.8.
+"""
+
+import multiprocessing
+from threading import Condition
+from time import monotonic as time
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# float64 setpoints (p, q), voltages, then int64 setpoint and voltage sequence counters
+FIELDS = 5
+
+
+class GridStateBus(object):
+    """ Setpoints and voltages of the loads named names, slot i being names[i]
+
+    :param names: names (addresses) of the loads
+    :param shared: allocate arrays in shared memory
+    :param name: shared memory block to attach to instead of creating one
+    """
+    def __init__(self, names, shared=False, name=None):
+        self.names = list(names)
+        self.slots = {n: i for i, n in enumerate(self.names)}
+        n = len(self.names)
+        self.shm = None
+        self.raw = None
+        size = FIELDS * n * 8
+        if name is not None or (shared and shared_memory is not None):
+            self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+            buffer = self.shm.buf
+        elif shared:
+            self.raw = multiprocessing.RawArray('b', max(size, 1))
+            buffer = self.raw
+        else:
+            buffer = bytearray(max(size, 1))
+        self._map(buffer, n)
+        # PowerFlowTrigger notified of setpoint changes, in this process
+        self.trigger = None
+        # Reader side state, local to each process
+        self.consumed = np.zeros(n, dtype=np.int64)
+        self.seen = np.zeros(n, dtype=np.int64)
+
+    def _map(self, buffer, n):
+        self.setpoints = np.frombuffer(buffer, dtype=np.float64, count=2 * n).reshape(n, 2)
+        self.voltages = np.frombuffer(buffer, dtype=np.float64, count=n, offset=16 * n)
+        self.setpoint_seq = np.frombuffer(buffer, dtype=np.int64, count=n, offset=24 * n)
+        self.voltage_seq = np.frombuffer(buffer, dtype=np.int64, count=n, offset=32 * n)
+
+    @property
+    def name(self):
+        """ Shared memory block name, for GridStateBus(names, name=...) in another process """
+        return None if self.shm is None else self.shm.name
+
+    def __getstate__(self):
+        if self.shm is None and self.raw is None:
+            raise TypeError("GridStateBus is only shared across processes when created with shared=True")
+        return {'names': self.names, 'name': self.name, 'raw': self.raw}
+
+    def __setstate__(self, state):
+        self.names = state['names']
+        self.slots = {n: i for i, n in enumerate(self.names)}
+        self.shm = shared_memory.SharedMemory(name=state['name']) if state['name'] else None
+        self.raw = state['raw']
+        self._map(self.shm.buf if self.shm is not None else self.raw, len(self.names))
+        self.trigger = None
+        self.consumed = np.zeros(len(self.names), dtype=np.int64)
+        self.seen = np.zeros(len(self.names), dtype=np.int64)
+
+    def slot(self, name):
+        return self.slots[name]
+
+    def write_setpoint(self, slot, p, q):
+        """ Write the setpoint of slot, from its load only """
+        old_p, old_q = self.setpoints[slot]
+        self.setpoint_seq[slot] += 1
+        self.setpoints[slot] = (p, q)
+        self.setpoint_seq[slot] += 1
+        if self.trigger is not None:
+            change = abs(p - old_p) + abs(q - old_q)
+            if change > 0:
+                self.trigger.notify(change)
+
+    def read_setpoint(self, slot):
+        while True:
+            seq = self.setpoint_seq[slot]
+            p, q = self.setpoints[slot]
+            if seq % 2 == 0 and seq == self.setpoint_seq[slot]:
+                return p, q
+
+    def changed(self):
+        """ Mask of the slots whose setpoint changed since the last consume_setpoints """
+        return self.setpoint_seq != self.consumed
+
+    def consume_setpoints(self):
+        """ Copy of all the setpoints (p, q arrays) and the mask of those changed since the last call """
+        while True:
+            seq = self.setpoint_seq.copy()
+            setpoints = self.setpoints.copy()
+            # slots being written are read again
+            if not (seq % 2).any() and (seq == self.setpoint_seq).all():
+                break
+        changed = seq != self.consumed
+        self.consumed = seq
+        return setpoints[:, 0], setpoints[:, 1], changed
+
+    def publish_voltages(self, voltages):
+        """ Write the voltage of all slots, from the power flow only """
+        self.voltage_seq += 1
+        self.voltages[:] = voltages
+        self.voltage_seq += 1
+
+    def read_voltage(self, slot):
+        """ Latest voltage of slot and its sequence number, 0 if never published """
+        while True:
+            seq = self.voltage_seq[slot]
+            v = self.voltages[slot]
+            if seq % 2 == 0 and seq == self.voltage_seq[slot]:
+                return v, seq
+
+    def new_voltage(self, slot):
+        """ Voltage of slot if it was published since the last call for slot in this process, else None """
+        v, seq = self.read_voltage(slot)
+        if seq == 0 or seq == self.seen[slot]:
+            return None
+        self.seen[slot] = seq
+        return float(v)
+
+    def close(self, unlink=False):
+        if self.shm is not None:
+            # views must be released before the block is closed
+            self.setpoints = self.voltages = self.setpoint_seq = self.voltage_seq = None
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+
+
+class PowerFlowTrigger(object):
+    """ Adaptive power flow scheduling: rather than solving every cycle or on every change,
+    the solver blocks in wait() until a solve is due, that is when either
+    - the aggregated setpoint change (sum of |dp| + |dq|, kW) since the last solve reaches threshold,
+      and coalesce seconds passed since the first of these changes, to solve bursts at once
+    - max_staleness seconds passed since the first unsolved change, however small
+
+    :param threshold: aggregated change (kW) triggering a solve
+    :param max_staleness: maximum age (s) of an unsolved change
+    :param coalesce: time (s) to wait for more changes once threshold is reached
+    """
+    def __init__(self, threshold=1.0, max_staleness=1.0, coalesce=0.05):
+        self.threshold = threshold
+        self.max_staleness = max_staleness
+        self.coalesce = coalesce
+        self.pending = 0.0
+        self.first_change = None
+        self.stopped = False
+        # number of solves due to each reason
+        self.solves = {'threshold': 0, 'staleness': 0}
+        self._condition = Condition()
+
+    def notify(self, change):
+        """ Account for a setpoint change of magnitude change """
+        with self._condition:
+            self.pending += change
+            if self.first_change is None:
+                self.first_change = time()
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """ Block until a solve is due, and start a new accounting period.
+
+        :param timeout: maximum time (s) to wait for a change, None to wait for ever
+        :returns: False if stopped or no change happened before timeout
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self._condition:
+            while not self.stopped:
+                now = time()
+                if self.first_change is None:
+                    if deadline is not None and now >= deadline:
+                        return False
+                    self._condition.wait(None if deadline is None else deadline - now)
+                    continue
+                age = now - self.first_change
+                if self.pending >= self.threshold and age >= self.coalesce:
+                    reason = 'threshold'
+                elif age >= self.max_staleness:
+                    reason = 'staleness'
+                else:
+                    due = self.coalesce if self.pending >= self.threshold else self.max_staleness
+                    self._condition.wait(due - age)
+                    continue
+                self.solves[reason] += 1
+                self.pending = 0.0
+                self.first_change = None
+                return True
+            return False
+
+    def stop(self):
+        """ Release the solver blocked in wait() """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Seeded channel model emulating lossy links between agents, in place of tc/netem.
+
+Each (src, dst) link has its own random stream, drawn with numpy by blocks and consumed
+one packet at a time, so that a run is reproducible for a given seed and per packet
+decisions are an index lookup. Delayed packets are sent later on the agent's timer.
+"""
+
+import zlib
+from threading import Lock
+
+import numpy as np
+
+from .agent import ErrorModel
+
+
+class Link(object):
+    """ Properties of a link.
+
+    :param loss: loss probability (of the good state, with bursts)
+    :param delay: mean one way delay (s)
+    :param jitter: delay variation (s), half width of the uniform distribution,
+        or standard deviation (normal) or mean (exponential) of the added delay
+    :param distribution: 'uniform', 'normal' or 'exponential' jitter
+    :param reorder: probability of holding back a packet by reorder_delay, letting the next ones overtake it
+    :param reorder_delay: extra delay (s) of reordered packets
+    :param burst_enter: Gilbert-Elliott probability of moving from the good to the bad state, 0 disables bursts
+    :param burst_exit: Gilbert-Elliott probability of moving from the bad to the good state
+    :param burst_loss: loss probability in the bad state
+    """
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, distribution='uniform', reorder=0.0, reorder_delay=0.01,
+                 burst_enter=0.0, burst_exit=1.0, burst_loss=1.0):
+        if distribution not in ('uniform', 'normal', 'exponential'):
+            raise ValueError(distribution)
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.burst_enter = burst_enter
+        self.burst_exit = burst_exit
+        self.burst_loss = burst_loss
+
+    def __repr__(self):
+        return "Link({})".format(', '.join('{}={}'.format(k, v) for k, v in self.__dict__.items()))
+
+
+class LinkStream(object):
+    """ Drop decisions and delays of the successive packets on a link """
+    def __init__(self, link, seed, block=1024):
+        self.link = link
+        self.random = np.random.RandomState(seed)
+        self.block = block
+        self.bad = False
+        self.drops = None
+        self.delays = None
+        self.index = block
+        self._lock = Lock()
+
+    def refill(self):
+        link = self.link
+        n = self.block
+        uniform = self.random.random_sample((2, n))
+        if link.burst_enter > 0:
+            # Gilbert-Elliott chain, sequential by nature
+            loss = np.empty(n)
+            bad = self.bad
+            for i, u in enumerate(uniform[0]):
+                bad = u >= link.burst_exit if bad else u < link.burst_enter
+                loss[i] = link.burst_loss if bad else link.loss
+            self.bad = bad
+            self.drops = uniform[1] < loss
+        else:
+            self.drops = uniform[1] < link.loss
+        delays = np.full(n, float(link.delay))
+        if link.jitter > 0:
+            if link.distribution == 'uniform':
+                delays += self.random.uniform(-link.jitter, link.jitter, n)
+            elif link.distribution == 'normal':
+                delays += self.random.normal(0, link.jitter, n)
+            else:
+                delays += self.random.exponential(link.jitter, n)
+        if link.reorder > 0:
+            delays += (self.random.random_sample(n) < link.reorder) * link.reorder_delay
+        self.delays = np.maximum(delays, 0).tolist()
+        self.drops = self.drops.tolist()
+        self.index = 0
+
+    def next(self):
+        """ (drop, delay) of the next packet """
+        with self._lock:
+            if self.index >= self.block:
+                self.refill()
+            i = self.index
+            self.index += 1
+            return self.drops[i], self.delays[i]
+
+
+class ChannelModel(ErrorModel):
+    """ Per link losses, bursts, delays and reordering applied to sent packets.
+
+    Links are looked up as (src, dst), then (None, dst), (src, None) and finally default,
+    e.g. set_link(None, allocator, Link(loss=0.1)) for 10% losses of all packets to the allocator.
+    A model can be shared by all the agents of a simulation.
+
+    :param default: Link of pairs without a specific one, None for a perfect channel
+    :param seed: seed of the links' random streams
+    :param block: number of packets drawn at a time for each link
+    """
+    def __init__(self, default=None, seed=None, block=1024):
+        super(ChannelModel, self).__init__(rate=1.0, seed=seed)
+        self.default = default
+        self.seed = seed
+        self.block = block
+        self.links = {}
+        self.streams = {}
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # copies start the links' streams over from the seed
+        state = dict(self.__dict__)
+        state['streams'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def set_link(self, src, dst, link):
+        with self._lock:
+            self.links[(src, dst)] = link
+            self.streams.pop((src, dst), None)
+            if src is None or dst is None:
+                # streams of covered pairs are recreated with the new link
+                self.streams = {k: s for k, s in self.streams.items()
+                                if not ((src is None or k[0] == src) and (dst is None or k[1] == dst))}
+
+    def link(self, src, dst):
+        for key in ((src, dst), (None, dst), (src, None)):
+            if key in self.links:
+                return self.links[key]
+        return self.default
+
+    def stream(self, src, dst):
+        stream = self.streams.get((src, dst))
+        if stream is None:
+            with self._lock:
+                stream = self.streams.get((src, dst))
+                if stream is None:
+                    link = self.link(src, dst)
+                    if link is None:
+                        return None
+                    seed = None if self.seed is None else [self.seed, zlib.crc32('{}>{}'.format(src, dst).encode())]
+                    stream = self.streams[(src, dst)] = LinkStream(link, seed, self.block)
+        return stream
+
+    def on_send(self, packet, src, dst):
+        stream = self.stream(src, dst)
+        if stream is None:
+            return False, 0
+        return stream.next()
+
+    def on_receive(self, packet):
+        # Everything happens on the sending side of the link
+        return False
@@ -82,6 +82,39 @@ class PIController(object):
         assert len(load_voltages) == len(load_maximum_powers)
         assert len(generator_voltages) == len(generator_maximum_powers)
 
+        mu = self._scale(load_voltages, generator_voltages)
+        # Create the allocations objects
+        # No control on the load ie. they consume what they want
+        load_allocations = [Allocation(aid=next(self._count), p_value=p_max, q_value=0, duration=self.duration) for
+                            p_max in load_maximum_powers]
+        # We use the mu float to control the maximum production of the generators
+        generator_allocations = [Allocation(aid=next(self._count), p_value=mu * p_max, q_value=0,
+                                            duration=self.duration) for p_max in generator_maximum_powers]
+
+        return load_allocations, generator_allocations
+
+    def generate_group_allocation(self, load_voltages, generator_voltages):
+        """A method to generate a single allocation for all the generators of the network, to be sent to them as a
+        group.
+
+        Args:
+            load_voltages (List[float]):
+                The list of voltages values (norms) for all load nodes (in volts).
+
+            generator_voltages (List[float]):
+                The list of voltages values (norms) for all generator nodes (in volts).
+
+        Returns:
+            Allocation:
+                An allocation whose p_value is the scale factor (mu, in [0,1]) each generator applies to its own maximum
+                production, with no control on the reactive power (q_value of 0).
+        """
+        mu = self._scale(load_voltages, generator_voltages)
+        return Allocation(aid=next(self._count), p_value=mu, q_value=0, duration=self.duration)
+
+    def _scale(self, load_voltages, generator_voltages):
+        """Update the integral error with the voltages and return mu, the scale factor of the generators' maximum
+        productions."""
         if len(load_voltages) > 0:
             # Manipulate numpy arrays
             load_voltages = np.array(load_voltages, dtype=np.float_)
@@ -105,13 +138,4 @@ class PIController(object):
 
         # Compute mu (hte p_max scale factor)
         mu = np.clip(a=1 - self.sigma * epsilon_error - self.tau * self._lambda_error, a_min=0, a_max=1)
-        mu = mu.item()
-        # Create the allocations objects
-        # No control on the load ie. they consume what they want
-        load_allocations = [Allocation(aid=next(self._count), p_value=p_max, q_value=0, duration=self.duration) for
-                            p_max in load_maximum_powers]
-        # We use the mu float to control the maximum production of the generators
-        generator_allocations = [Allocation(aid=next(self._count), p_value=mu * p_max, q_value=0,
-                                            duration=self.duration) for p_max in generator_maximum_powers]
-
-        return load_allocations, generator_allocations
+        return mu.item()
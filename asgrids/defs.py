@@ -2,17 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+from bisect import bisect, insort
 from collections import namedtuple
 from queue import Queue
 from random import Random
 from typing import Callable
-import numpy as np
 import msgpack
 
 packet_types = [
     'allocation',
+    'group_allocation',
     'curr_allocation',
+    'curr_allocations',
     'join',
+    'joins',
     'join_ack',
     'allocation_ack',
     'stop',
@@ -40,10 +43,17 @@ class Packet(namedtuple('Packet', ['ptype', 'payload', 'src', 'dst'])):
         if ptype is 'allocation':
             assert isinstance(payload, Allocation), 'Packet type "allocation" needs an allocation payload not a ' \
                                                     '{}'.format(type(payload))
+        if ptype == 'group_allocation':
+            assert isinstance(payload, list) and len(payload) == 2 and isinstance(payload[1], Allocation), \
+                'Packet type "group_allocation" needs a [group, allocation] payload {}'.format(payload)
         if ptype in ['curr_allocation', 'join']:
             assert isinstance(
                 payload, list), 'Packet type "curr_allocation" needs a list containing current allocation and' \
                 ' current measure {}'.format(type(payload))
+        if ptype in ['curr_allocations', 'joins']:
+            assert isinstance(
+                payload, list), 'Packet type "{}" needs a list of [nid, payload] entries {}'.format(
+                ptype, type(payload))
         return super(Packet, cls).__new__(cls, ptype, payload, src, dst)
 
 
@@ -93,6 +103,49 @@ def EventId(p, nid=0) -> str:
         raise ValueError('EventId not implemented for {}'.format(p))
 
 
+class HashRing(object):
+    """ Consistent hashing of node addresses over a set of allocator shards.
+
+    Each shard is placed `replicas` times on the ring so that nodes spread evenly,
+    and adding or removing a shard only moves the nodes of that shard.
+    """
+    def __init__(self, shards=None, replicas=100):
+        self.replicas = replicas
+        self._keys: list = []
+        self._ring: dict = {}
+        for shard in shards or []:
+            self.add(shard)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int(hashlib.md5(str(key).encode()).hexdigest()[:16], 16)
+
+    @property
+    def shards(self):
+        return sorted(set(self._ring.values()))
+
+    def add(self, shard):
+        for i in range(self.replicas):
+            h = self._hash('{}#{}'.format(shard, i))
+            if h not in self._ring:
+                insort(self._keys, h)
+            self._ring[h] = shard
+
+    def remove(self, shard):
+        for i in range(self.replicas):
+            h = self._hash('{}#{}'.format(shard, i))
+            if self._ring.get(h) == shard:
+                del self._ring[h]
+                self._keys.remove(h)
+
+    def get(self, key):
+        """ Shard owning key, None if the ring is empty """
+        if not self._keys:
+            return None
+        i = bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[self._keys[i]]
+
+
 class AllocationGenerator(object):
     def __init__(self):
         self._random = Random()
@@ -11,14 +11,22 @@ from plumbum import SshMachine
 from rpyc.utils.classic import deliver, teleport_function
 from rpyc.utils.helpers import BgServingThread
 from rpyc.utils.zerodeploy import DeployedServer
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue, Full, Empty
+from threading import Lock
 from time import monotonic as time, sleep
 from pandapower import pp, OPFNotConverged, LoadflowNotConverged
-from .network_allocator import NetworkAllocator
+from .network_aggregator import NetworkAggregator
+from .network_allocator import NetworkAllocator, ShardedAllocator
 from .network_load import NetworkLoad
-from .defs import Allocation
+from .defs import Allocation, Packet
+from .remote import NODE_CLASSES, RemoteBatch
 from .controller import PIController
+from .powerflow import PowerFlow
+import hashlib
 import logging
+import os
+import pickle
 import sys, traceback
 # logging.basicConfig(filename='simulation.log',
 #                             filemode='a',
@@ -31,6 +39,9 @@ import sys, traceback
 # fh.setLevel(logging.INFO)
 # logger.addHandler(fh)
 
+# Left in the remote package by check_remote
+PACKAGE_HASH_FILE = '.package_hash'
+
 
 class SmartGridSimulation(object):
     def __init__(self):
@@ -39,6 +50,22 @@ class SmartGridSimulation(object):
         self.remote_machines = []
         self.remote_servers = []
         self.server_threads = []
+        # rpyc connection of each remote host, by (hostname, username)
+        self.hosts = {}
+        # NodeController.handle of each remote host connection
+        self.controllers = {}
+        self._package_hash = None
+        # PowerFlow of each network, by id
+        self.power_flows = {}
+        self._power_flow_lock = Lock()
+        # Solve radial networks by backward/forward sweep rather than pp.runpp
+        self.radial_power_flow = True
+        # optimize_network_pi acts on voltages estimated from the setpoints given to estimate_voltage
+        # since the last solve, rather than on the last solve's
+        self.estimate_voltages = False
+        # if set, optimize_network_pi sends a single allocation to this group of the generators
+        # (see NetworkAllocator.send_group_allocation) rather than one to each of them
+        self.pi_group = None
 
         # provide rpyc's deliver as a local function
         # This function allows deliver objects to remote machines
@@ -53,68 +80,136 @@ class SmartGridSimulation(object):
         self.shutdown = False
 
     """
-    Make sure 'asgrids' library is available remotely
+    Content hash of the local 'asgrids' package, compiled files excluded
     """
 
     @staticmethod
-    def check_remote(remote_server, python_pkg_path):
-        conn = remote_server.classic_connect()
-        import os
-        # import site
+    def package_hash():
+        import asgrids
+        path = os.path.dirname(os.path.abspath(asgrids.__file__))
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            for name in sorted(files):
+                if name.endswith(('.pyc', '.pyo')) or name == PACKAGE_HASH_FILE:
+                    continue
+                full_path = os.path.join(root, name)
+                digest.update(os.path.relpath(full_path, path).encode())
+                with open(full_path, 'rb') as f:
+                    digest.update(f.read())
+        return digest.hexdigest()
+
+    """
+    Make sure 'asgrids' library is available remotely.
+    The package is only uploaded when the hash left by the last upload differs from the local one.
+    Returns True if the remote package was already up to date.
+    """
+
+    @staticmethod
+    def check_remote(conn, python_pkg_path, package_hash=None):
         import asgrids
-        # python_pkg_path=site.getsitepackages()[0]
-        rpyc.classic.upload_package(
-            conn, asgrids, os.path.join(python_pkg_path, "asgrids"))
+        if package_hash is None:
+            package_hash = SmartGridSimulation.package_hash()
+        remote_path = "{}/asgrids".format(python_pkg_path)
+        hash_file = "{}/{}".format(remote_path, PACKAGE_HASH_FILE)
+        try:
+            remote_hash = conn.eval("open({!r}).read()".format(hash_file))
+        except Exception:
+            remote_hash = None
+        if remote_hash == package_hash:
+            return True
+        rpyc.classic.upload_package(conn, asgrids, remote_path)
+        conn.execute("with open({!r}, 'w') as f: f.write({!r})".format(hash_file, package_hash))
+        # the package directory may be new to the remote import system
+        conn.modules.importlib.invalidate_caches()
         return False
 
     """
-    Create node with type 'ntype' on the remote machine `hostname`
-    Returns a rpyc object wrapper, that enables handling the remote object
-    as if it was created locally.
+    Connection to the remote machine `hostname`, deployed once per host and reused by all its nodes:
+    one ssh connection, one rpyc server and one namespace where remote nodes are kept in `nodes`.
+    A closed connection is dropped and the host deployed again.
     """
 
-    def create_remote_node(self, hostname, username, keyfile, ntype, addr, config=None):
-        if config is None:
-            config = {}
+    def remote_host(self, hostname, username, keyfile):
+        key = (hostname, username)
+        conn = self.hosts.get(key)
+        if conn is not None:
+            if not conn.closed:
+                return conn
+            del self.hosts[key]
+            self.controllers.pop(conn, None)
         remote_machine = SshMachine(
             host=hostname, user=username, keyfile=keyfile)
         remote_server = DeployedServer(remote_machine)
         conn = remote_server.classic_connect()
-        site = conn.modules.site
-        python_pkg_path=site.getsitepackages()[0]
-        # if `asgrids` wasn't available remotely, now we installed it
-        # but we need to reconnect to get an updated conn.modules
-        # TODO Might not be needed if using execute/eval
-        if not self.check_remote(remote_server, python_pkg_path):
-            remote_server.close()
-            remote_server = DeployedServer(remote_machine)
-
+        python_pkg_path = conn.modules.site.getsitepackages()[0]
+        if self._package_hash is None:
+            self._package_hash = self.package_hash()
+        # asgrids isn't imported remotely yet, so an upload doesn't require to redeploy
+        self.check_remote(conn, python_pkg_path, self._package_hash)
+        # Using execute/eval allows working on a remote single namespace
+        # useful when teleporting functions that need using remote object names
+        # as using conn.modules create a locate but not a remote namespace member
+        conn.execute("from asgrids import NetworkAggregator, NetworkAllocator, NetworkLoad\n"
+                     "from asgrids.remote import NodeController\n"
+                     "nodes = {}\n"
+                     "controller = NodeController(nodes)")
+        self.controllers[conn] = conn.eval("controller.handle")
+        serving_thread = BgServingThread(conn)
         self.remote_machines.append(remote_machine)
         self.remote_servers.append(remote_server)
-        conn = remote_server.classic_connect()
-        serving_thread = BgServingThread(conn)
         self.server_threads.append(serving_thread)
-        self.conns[addr] = conn
+        self.hosts[key] = conn
+        return conn
 
-        # Using execute/eval allows working on a remote single namespace
-        # useful when teleporting functions that need using remote object names
-        # as using conn.modules create a locate but not a remote namespace member
-        if ntype is 'load':
-            conn.execute("from asgrids import NetworkLoad")
-            conn.execute("node=NetworkLoad()")
-            conn.execute("node.local='{}'".format(addr))
-            node = conn.namespace['node']
-        elif ntype is 'allocator':
-            conn.execute("from asgrids import NetworkAllocator")
-            conn.execute("node=NetworkAllocator()")
-            node = conn.namespace['node']
-        else:
+    """
+    Create node with type 'ntype' on the remote machine `hostname`
+    Returns a rpyc object wrapper, that enables handling the remote object
+    as if it was created locally.
+    The node is also bound to "node" in the host's remote namespace.
+    """
+
+    def create_remote_node(self, hostname, username, keyfile, ntype, addr, config=None):
+        if config is None:
+            config = {}
+        if ntype not in NODE_CLASSES:
             raise ValueError("Can't handle ntype == {}".format(ntype))
+        conn = self.remote_host(hostname, username, keyfile)
+        self.conns[addr] = conn
+        conn.execute("node = nodes[{addr!r}] = {cls}()\nnode.local = {addr!r}".format(
+            addr=addr, cls=NODE_CLASSES[ntype]))
+        node = conn.namespace['node']
         self.nodes[addr] = node
 
         # Return node netref object and rpyc connection
         return node, conn
 
+    """
+    Applies a RemoteBatch (or a list of its commands) to the nodes of a remote host in one round trip.
+    Returns the [ok, result] pair of each command, ok is False and result the error if it failed.
+    """
+
+    def run_batch(self, conn, batch):
+        commands = batch.commands if isinstance(batch, RemoteBatch) else batch
+        return pickle.loads(self.controllers[conn](pickle.dumps(commands)))
+
+    """
+    Creates, configures and runs many nodes of type 'ntype' on the remote machine `hostname`
+    with a single batch. Loads join `join` if given.
+    Returns the batch results.
+    """
+
+    def create_remote_nodes(self, hostname, username, keyfile, ntype, addrs, mode='udp', join=None, **config):
+        conn = self.remote_host(hostname, username, keyfile)
+        batch = RemoteBatch()
+        for addr in addrs:
+            batch.create(ntype, addr, mode=mode, **config)
+            batch.call(addr, 'run')
+            if join is not None:
+                batch.call(addr, 'send_join', join)
+            self.conns[addr] = conn
+        return self.run_batch(conn, batch)
+
     """
     Creates a local node
     """
@@ -130,6 +225,57 @@ class SmartGridSimulation(object):
             node.local = addr
             self.nodes[addr] = node
             return node
+        elif ntype == 'aggregator':
+            node = NetworkAggregator(mode=mode)
+            node.local = addr
+            self.nodes[addr] = node
+            return node
+
+    """
+    Creates and runs many local nodes of type `ntype` in parallel.
+    If `join` is given, loads join this allocator with batched join requests.
+    """
+
+    def create_nodes(self, ntype, addrs, mode='udp', join=None, timeout=10, workers=32):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            nodes = list(executor.map(lambda addr: self.create_node(ntype, addr, mode=mode), addrs))
+            # run() starts the node threads and waits for its socket to be bound
+            list(executor.map(lambda node: node.run(), nodes))
+        if join is not None:
+            self.join_nodes(nodes, join, timeout=timeout)
+        return nodes
+
+    """
+    Joins `nodes` to the allocator `dst` with one `joins` packet per `batch` nodes
+    instead of one join handshake and retry timer per node.
+    Retries every `retry` seconds for nodes not acknowledged yet.
+    Returns the nodes that didn't join before `timeout`.
+    """
+
+    def join_nodes(self, nodes, dst, timeout=10, retry=1, batch=200):
+        pending = [node for node in nodes if node.remote is None]
+        deadline = time() + timeout
+        while pending and time() < deadline:
+            # Batches are sent on behalf of the nodes by the transport of any of them, bypassing
+            # its channel model, join_acks being sent to each node
+            comm = pending[0].comm
+            for i in range(0, len(pending), batch):
+                entries = [[node.local, [node.curr_allocation, None]] for node in pending[i:i + batch]]
+                comm.send(Packet('joins', entries, dst=dst), dst)
+            retry_time = min(time() + retry, deadline)
+            for node in pending:
+                if not node.joined.wait(max(retry_time - time(), 0)):
+                    break
+            pending = [node for node in pending if node.remote is None]
+        return pending
+
+    """
+    Creates local allocator shards partitioning nodes by consistent hashing of their address
+    """
+
+    def create_allocator_shards(self, addrs, mode='udp'):
+        shards = [self.create_node('allocator', addr, mode=mode) for addr in addrs]
+        return ShardedAllocator(shards)
 
     """
     Runs the created remote objects
@@ -147,17 +293,91 @@ class SmartGridSimulation(object):
     """
 
     def stop(self):
-        for _, node in self.nodes.items():
-            node.stop()
+        for addr, node in self.nodes.items():
+            # remote nodes are stopped by batch below
+            if addr not in self.conns:
+                node.stop()
+        for conn in self.hosts.values():
+            try:
+                self.run_batch(conn, RemoteBatch().call(None, 'stop'))
+            except Exception as e:
+                logging.warning(e)
+        for thread in self.server_threads:
+            try:
+                thread.stop()
+            except Exception as e:
+                logging.warning(e)
         for server in self.remote_servers:
             server.close()
+        for machine in self.remote_machines:
+            machine.close()
         self.nodes = {}
+        self.conns = {}
+        self.hosts = {}
+        self.controllers = {}
         self.remote_machines = []
         self.remote_servers = []
         self.server_threads = []
         self.shutdown = True
 
 
+    def power_flow(self, net):
+        """PowerFlow of net, compiled at its first solve. The topology of net mustn't change afterwards"""
+        with self._power_flow_lock:
+            power_flow = self.power_flows.get(id(net))
+            if power_flow is None or power_flow.net is not net:
+                power_flow = self.power_flows[id(net)] = PowerFlow(net, radial=self.radial_power_flow)
+        return power_flow
+
+    def estimate_voltage(self, net, name, p_kw, q_kvar):
+        """Voltage at load name of net after its setpoint changed to p_kw, q_kvar, estimated from
+        the last power flow solution without solving (see VoltageSensitivity)
+
+        Returns:
+            float: voltage magnitude (p.u.), None if net wasn't solved yet
+        """
+        power_flow = self.power_flows.get(id(net))
+        if power_flow is None:
+            return None
+        agents = power_flow.agents
+        if agents is not None and name in agents.slots:
+            return power_flow.sensitivity.shift_load(*agents.estimate(name, p_kw, q_kvar))
+        return power_flow.sensitivity.set_load(name, p_kw, q_kvar)
+
+    def add_agents(self, net, names, rows, weights=1.0):
+        """Map agents onto existing net.load rows rather than creating a load per agent, so that
+        the size of net and the cost of its power flow don't grow with the number of agents.
+        Before each solve, rows with agents get the weighted sum of their agents' setpoints
+
+        Args:
+            net ([type]): pandapower network
+            names (list): names (addresses) of the agents, used instead of net.load names
+            rows (list): net.load row (position) of each agent
+            weights (optional): Defaults to 1.0. Multiplicity of each agent's setpoint in its row
+        Returns:
+            AgentLoads: agents of net, their setpoints starting from their row's
+        """
+        return self.power_flow(net).add_agents(names, rows, weights)
+
+    def run_scenarios(self, net, p_kw, q_kvar=None, workers=1):
+        """Solve the power flow of many load scenarios of net at once, e.g. for Monte Carlo studies,
+        sharing net's compiled grid. Neither net nor the simulation's last solution are changed
+
+        Args:
+            net ([type]): pandapower network
+            p_kw: load setpoints, scenarios x net.load rows
+            q_kvar (optional): same for reactive power, net.load's q_kvar if None
+            workers (int, optional): Defaults to 1. Number of worker processes
+        Returns:
+            numpy.ndarray: voltage magnitudes (p.u.), scenarios x net.bus rows, NaN for scenarios not converging
+        """
+        return self.power_flow(net).run_scenarios(p_kw, q_kvar, workers=workers)
+
+    @staticmethod
+    def log_voltages(logger, T, grid):
+        for name, vm_pu in zip(grid.bus_names, grid.vm_pu):
+            logger.info('VOLTAGE {}\t{}\t{}'.format(T, name, vm_pu))
+
     def runpp(self, net, allocations_queue: Queue, measure_queues: dict, plot_queue: Queue, with_plot=False, initial_time=0, logger=None):
         """Perform power flow analysis to collect voltage values of all the buses
         
@@ -175,27 +395,34 @@ class SmartGridSimulation(object):
             return
             # print("runpp: updating {} new allocations".format(qsize))
         try:
+            power_flow = self.power_flow(net)
+            grid = power_flow.grid
+            agents = power_flow.agents
+            p_col, q_col = net.load.columns.get_loc('p_kw'), net.load.columns.get_loc('q_kvar')
             for i in range(qsize):
                 timestamp, name, p_kw, q_kw = allocations_queue.get_nowait()
                 if timestamp == name == p_kw == q_kw == 0:
                     print("Terminating runpp")
                     return
-                if net.load.loc[net.load['name'] == name, 'p_kw'].item() != p_kw:
-                    net.load.loc[net.load['name'] == name, 'p_kw'] = p_kw
-                    changed = True
-                if net.load.loc[net.load['name'] == name, 'q_kvar'].item() != q_kw:
-                    net.load.loc[net.load['name'] == name, 'q_kvar'] = q_kw
-                    changed = True
+                if agents is not None and name in agents.slots:
+                    # summed into the agent's row by power_flow.run()
+                    changed = agents.set(name, p_kw, q_kw) or changed
+                else:
+                    row = grid.load_rows[name]
+                    if net.load.iat[row, p_col] != p_kw:
+                        net.load.iat[row, p_col] = p_kw
+                        changed = True
+                    if net.load.iat[row, q_col] != q_kw:
+                        net.load.iat[row, q_col] = q_kw
+                        changed = True
 
                 if changed:
-                    pp.runpp(net, init='results', verbose=True)
+                    power_flow.run()
                     if logger is not None and changed:
                         T = time()
                         logger.info('LOAD {}\t{}\t{}'.format(
                                 T, name, p_kw))
-                        for i in net.bus.index:
-                            logger.info('VOLTAGE {}\t{}\t{}'.format(
-                                T, net.bus.loc[i, 'name'], net.res_bus.loc[i, 'vm_pu']))
+                        self.log_voltages(logger, T, power_flow.grid)
                 # else:
                 #     return
         except LoadflowNotConverged as e:
@@ -209,20 +436,81 @@ class SmartGridSimulation(object):
 
         # Updating voltage measures for clients
         if changed:
+            grid = power_flow.grid
+            load_vm_pu = grid.load_vm_pu
             for node in measure_queues:
-                bus_ind = 0
-                try:
-                    bus_ind = net.load['bus'][net.load['name'] == node].item()
-                except Exception as e:
-                    raise(e)
-                # print("bus_ind: {}".format(bus_ind))
-                # print("net.res_bus: {}".format(net.res_bus))
-                vm_pu = net.res_bus['vm_pu'][bus_ind].item()
+                if agents is not None and node in agents.slots:
+                    vm_pu = load_vm_pu[agents.row(node)].item()
+                else:
+                    vm_pu = load_vm_pu[grid.load_rows[node]].item()
                 try:
                     measure_queues[node].get_nowait()
                 except Empty:
                     measure_queues[node].put(vm_pu)
 
+    def runpp_bus(self, net, bus, logger=None):
+        """Perform power flow analysis with the setpoints changed on a GridStateBus,
+        and publish the resulting voltage of every load to the bus
+
+        Args:
+            net ([type]): pandapower network
+            bus (GridStateBus): slots in the same order as net.load rows, or as the agents of net (see add_agents)
+            logger (optional): logs LOAD records of changed loads and VOLTAGE records of all buses
+        Returns:
+            bool: whether a power flow was solved
+        """
+        p, q, changed = bus.consume_setpoints()
+        if not changed.any():
+            return False
+        power_flow = self.power_flow(net)
+        agents = power_flow.agents
+        if agents is not None:
+            changed &= (agents.p_kw != p) | (agents.q_kvar != q)
+            if not changed.any():
+                return False
+            agents.set_all(p, q)
+        else:
+            p_kw = net.load['p_kw'].values.copy()
+            q_kvar = net.load['q_kvar'].values.copy()
+            changed &= (p_kw != p) | (q_kvar != q)
+            if not changed.any():
+                return False
+            p_kw[changed] = p[changed]
+            q_kvar[changed] = q[changed]
+            net.load['p_kw'] = p_kw
+            net.load['q_kvar'] = q_kvar
+        try:
+            power_flow.run()
+        except LoadflowNotConverged as e:
+            print("runpp failed miserably: {}".format(e))
+            return False
+        bus.publish_voltages(power_flow.grid.load_vm_pu if agents is None else agents.vm_pu(power_flow.grid))
+        if logger is not None:
+            T = time()
+            for i in changed.nonzero()[0]:
+                logger.info('LOAD {}\t{}\t{}'.format(T, bus.names[i], p[i]))
+            self.log_voltages(logger, T, power_flow.grid)
+        return True
+
+    def runpp_adaptive(self, net, bus, trigger, logger=None, lock=None):
+        """Perform power flow analysis with runpp_bus only when trigger says a solve is due,
+        blocking in between, until trigger is stopped
+
+        Args:
+            net ([type]): pandapower network
+            bus (GridStateBus): its trigger is set to trigger
+            trigger (PowerFlowTrigger): solve policy
+            logger (optional): see runpp_bus
+            lock (optional): held while solving, e.g. to copy net consistently
+        """
+        bus.trigger = trigger
+        while trigger.wait():
+            if lock is None:
+                self.runpp_bus(net, bus, logger)
+            else:
+                with lock:
+                    self.runpp_bus(net, bus, logger)
+
     def optimize_network_opf(self, net, allocator, voltage_values, duty_cycle=10, max_vm=1.05, forecast=True, check_limit=True):
         qsize = voltage_values.qsize()  # Getting all measurements from the queue at once
         optimize = False
@@ -317,29 +605,42 @@ class SmartGridSimulation(object):
 
         if not optimize and check_limit:
             return
+        if not values:
+            # No measures since the last cycle
+            return
         print("Optimizing")
-        for name in net.load['name']:
-            bus_id = net.load.loc[net.load['name']==name, 'bus'].item()
-            try:
-                if not hasattr(net, 'res_bus'):
-                    return
-                v = net.res_bus.loc[bus_id]['vm_pu']*net.bus.loc[bus_id]['vn_kv']*1000 # converting nominal value to V
-            except Exception as e:
-                print(e)
-                return
-            if net.load.loc[net.load['name']==name, 'controllable'].item() == True:
+        power_flow = self.power_flow(net)
+        grid = power_flow.grid
+        load_vm_pu = power_flow.sensitivity.load_vm_pu if self.estimate_voltages else grid.load_vm_pu
+        voltages = load_vm_pu*grid.load_vn_kv*1000 # converting nominal value to V
+        controllable = net.load['controllable'].values == True
+        agents = power_flow.agents
+        for row, (name, v, generator, p_kw) in enumerate(zip(grid.load_names, voltages, controllable,
+                                                             net.load['p_kw'].values)):
+            members = agents.members(row) if agents is not None else ()
+            if generator and len(members):
+                # each agent of the row is a generator
+                nids.extend(agents.names[i] for i in members)
+                gen_vs.extend([v]*len(members))
+            elif generator:
                 nids.append(name)
                 gen_vs.append(v)
             else:
-                try:
-                    load_vs.append(v)
-                    # Using loads (non-generators) allocations from net as their maximum allocations (shouldn't have big effect)
-                    # Maximum allocation for generators are -30kW
-                    load_max_as.append(
-                        net.load.loc[net.load['name'] == nid, 'p_kw'].item()*1e3)
-                except Exception as e:
-                    print(e)
-                    return
+                load_vs.append(v)
+                # Using loads (non-generators) allocations from net as their maximum allocations (shouldn't have big effect)
+                # Maximum allocation for generators are -30kW
+                load_max_as.append(p_kw*1e3)
+        if self.pi_group is not None:
+            # generators scale their own rated allocation by mu
+            try:
+                a = self.controller.generate_group_allocation(load_vs, gen_vs)
+                allocation = Allocation(a.aid, a.p_value, a.q_value, duty_cycle)
+                print("{}: {}".format(self.pi_group, allocation))
+                allocator.send_group_allocation(self.pi_group, allocation, nids)
+            except Exception as e:
+                print(e)
+                print("Terminating PI controller")
+            return
         try:
             _, pv_a = self.controller.generate_allocations(
                 load_vs, gen_vs, load_max_as, [-30e3]*len(gen_vs))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Lightweight metrics registry shared by an Agent and its communication layer.
+Counters are keyed by name and label (usually a packet type), histograms use
+fixed log-spaced buckets so that observing a value is a bisect and an increment.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+
+
+# 1us to ~67s, doubling
+DEFAULT_BOUNDS = [1e-6 * 2 ** i for i in range(27)]
+
+
+class Histogram(object):
+    def __init__(self, bounds=None):
+        self.bounds = DEFAULT_BOUNDS if bounds is None else bounds
+        # last bucket collects values above the highest bound
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q-quantile """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': [[b, n] for b, n in zip(self.bounds + [float("inf")], self.buckets) if n > 0],
+        }
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = Lock()
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.histograms = defaultdict(dict)
+        self.gauges = {}
+
+    def count(self, name, label=None, n=1):
+        """ Increment counter name for label (e.g. 'sent' for packet type 'allocation') """
+        with self._lock:
+            self.counters[name][label] += n
+
+    def get(self, name, label=None):
+        with self._lock:
+            if name not in self.counters:
+                return 0
+            if label is None:
+                return sum(self.counters[name].values())
+            return self.counters[name].get(label, 0)
+
+    def observe(self, name, value, label=None):
+        """ Record value in histogram name """
+        with self._lock:
+            histogram = self.histograms[name].get(label)
+            if histogram is None:
+                histogram = self.histograms[name][label] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, fn):
+        """ Register fn, evaluated at snapshot time, as gauge name (e.g. a queue depth) """
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        """ Copy of all metrics as plain dicts, counters and histograms keyed by label """
+        with self._lock:
+            snapshot = {
+                'counters': {name: {str(label): n for label, n in labels.items()}
+                             for name, labels in self.counters.items()},
+                'histograms': {name: {str(label): h.snapshot() for label, h in labels.items()}
+                               for name, labels in self.histograms.items()},
+            }
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                gauges[name] = None
+        snapshot['gauges'] = gauges
+        return snapshot
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from .agent import Agent
+from .defs import Packet
+
+
+class NetworkAggregator(Agent):
+    # Relay between a subset of NetworkLoads and the NetworkAllocator
+    def __init__(self, local=None, remote=None, mode='udp'):
+        super(NetworkAggregator, self).__init__(mode=mode)
+        self.nid = local
+        self.local = local
+        # upstream allocator (or aggregator) address
+        self.remote = remote
+        self.type = "NetworkAggregator"
+        # known downstream nodes
+        self.nodes = set()
+        # latest curr_allocation report of each node since last forward
+        self.pending = {}
+        self.forward_period = 1
+        # maximum number of reports per curr_allocations packet
+        self.max_batch = 200
+        self.forward_event = None
+
+    def run(self):
+        super(NetworkAggregator, self).run()
+        try:
+            self.forward_event = self.schedule(action=self.forward_reports, delay=self.forward_period)
+        except Exception as e:
+            self.logger.warning("network aggregator run: {}".format(e))
+
+    def receive_handle(self, p: Packet, src=None):
+        """ Handle packets received and decoded at the AsyncCommunication layer.
+        Packets addressed to other nodes are relayed to their destination.
+
+        :param p: received packet
+        :param src: source of packet
+        :returns:
+        :rtype:
+        """
+        assert isinstance(p, Packet)
+        self.logger.info("handling {} from {}".format(p, p.src))
+        msg_type = p.ptype
+        if p.dst is not None and p.dst != self.local:
+            # Allocations, stops, ... from the allocator to downstream nodes
+            self.logger.info("relaying {} to {}".format(msg_type, p.dst))
+            self.send(p, p.dst)
+        elif msg_type == 'join':
+            self.add_node(nid=p.src, report=p.payload)
+            self.send(Packet('join_ack', src=self.local, dst=p.src), p.src)
+        elif msg_type == 'curr_allocation':
+            self.add_node(nid=p.src, report=p.payload)
+        elif msg_type == 'curr_allocations':
+            # Reports from a lower level aggregator
+            for nid, report in p.payload:
+                self.add_node(nid=nid, report=report)
+        elif msg_type == 'leave':
+            self.nodes.discard(p.src)
+            self.pending.pop(p.src, None)
+            if self.remote is not None:
+                self.send(p, self.remote)
+        elif msg_type == 'stop':
+            self.logger.info("Received Stop from {}".format(p.src))
+            self.send(Packet(ptype='stop_ack', src=self.local), p.src)
+            self.schedule(self.stop)
+
+    def add_node(self, nid, report):
+        """ Register a downstream node and keep its latest report for forwarding.
+        Joins are acknowledged here and forwarded upstream as the node's first report:
+        a join without allocation (report[0] None) isn't forwarded, the node stays
+        unknown to the allocator until it reports.
+
+        :param nid: id of the reporting node
+        :param report: the node's [allocation, max_allocation, measure] report, or its join payload
+        :returns:
+        :rtype:
+
+        """
+        self.nodes.add(nid)
+        if report is not None and report[0] is not None:
+            self.pending[nid] = report
+
+    def forward_reports(self):
+        """ Forward pending reports upstream as batched curr_allocations packets.
+        """
+        if self.remote is not None and self.pending:
+            pending, self.pending = self.pending, {}
+            reports = [[nid, report] for nid, report in pending.items()]
+            for i in range(0, len(reports), self.max_batch):
+                packet = Packet('curr_allocations', reports[i:i + self.max_batch], src=self.local, dst=self.remote)
+                self.logger.info("forwarding {} reports to {}".format(len(packet.payload), self.remote))
+                self.send(packet, self.remote)
+        self.forward_event = self.schedule(action=self.forward_reports, delay=self.forward_period)
+
+    def stop(self):
+        self.logger.info("Stopping aggregator")
+        self.remote = None
+        self.interrupt_event(self.forward_event)
+        super(NetworkAggregator, self).stop()
@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 
 from .agent import Agent
-from .defs import EventId, Packet, Allocation
+from .defs import EventId, HashRing, Packet, Allocation
 from itertools import count
+from threading import Lock
+from time import monotonic as time
 
 class NetworkAllocator(Agent):
     # Simulate a communicating policy allocator
@@ -11,12 +13,19 @@ class NetworkAllocator(Agent):
         super(NetworkAllocator, self).__init__(mode=mode)
         self.nid = local
         self.nodes = {}
+        # nodes reporting through a NetworkAggregator: nid -> aggregator address
+        self.routes = {}
+        # HashRing shared by all allocator shards, None when running a single allocator
+        self.ring = None
         self.alloc_ack_timeout = 3
         self.stop_ack_timeout = 5
         self.local = local
         self.identity = self.nid
         self.type = "NetworkAllocator"
         self.alloc_timeouts = {}
+        # send time of allocations waiting for an allocation_ack, by aid
+        self.alloc_sent = {}
+        self._alloc_lock = Lock()
         self.stop_timeouts = {}
         self.aid_count = count()
         # various callbacks
@@ -37,10 +46,17 @@ class NetworkAllocator(Agent):
         self.logger.info("handling {} from {}".format(p, src))
         msg_type = p.ptype
         if msg_type == 'join':
-            self.add_node(nid=p.src, allocation=p.payload)
-            self.schedule(self.send_join_ack, {'dst': p.src})
+            self.handle_join(nid=p.src, allocation=p.payload)
+        elif msg_type == 'joins':
+            # Batched join on behalf of many nodes
+            for nid, allocation in p.payload:
+                self.handle_join(nid=nid, allocation=allocation)
         elif msg_type == 'allocation_ack':
             self.logger.info("received allocation_ack from {} for allocation {}".format(p.src, p.payload[0].aid))
+            with self._alloc_lock:
+                sent = self.alloc_sent.pop(p.payload[0].aid, None)
+            if sent is not None:
+                self.metrics.observe('allocation_latency', time() - sent)
             # self.add_node(nid=p.src, allocation=p.payload)
             # Interrupting ack timeout event for this allocation
             # try:
@@ -67,7 +83,30 @@ class NetworkAllocator(Agent):
                 self.logger.warning(e)
             self.remove_node(nid=src)
         elif msg_type == 'curr_allocation':
+            self.routes.pop(p.src, None)
             self.add_node(nid=p.src, allocation=p.payload)
+        elif msg_type == 'curr_allocations':
+            # Batched reports forwarded by a NetworkAggregator
+            for nid, allocation in p.payload:
+                self.routes[nid] = p.src
+                self.add_node(nid=nid, allocation=allocation)
+
+    def handle_join(self, nid, allocation):
+        """ Add a joining node and acknowledge it, or redirect it to the shard owning it.
+
+        :param nid: id of the joining node
+        :param allocation: the node's join payload
+        :returns:
+        :rtype:
+
+        """
+        owner = self.owner(nid)
+        if owner != self.local:
+            self.logger.info("redirecting {} to shard {}".format(nid, owner))
+            self.send_join_ack(nid, owner)
+        else:
+            self.add_node(nid=nid, allocation=allocation)
+            self.send_join_ack(nid)
 
     def add_node(self, nid, allocation):
         """ Add a network node to Allocator's known nodes list.
@@ -104,8 +143,31 @@ class NetworkAllocator(Agent):
 
         """
         self.logger.info("Removing node {}".format(nid))
+        self.routes.pop(nid, None)
         return self.nodes.pop(nid, None)
 
+    def owner(self, nid):
+        """ Address of the allocator shard in charge of node nid.
+
+        :param nid: id of node
+        :returns: the owning shard address, self.local when not sharded.
+        :rtype: str
+
+        """
+        if self.ring is None:
+            return self.local
+        return self.ring.get(nid)
+
+    def route(self, nid):
+        """ Address to send packets destined to node nid to.
+
+        :param nid: id of destination node
+        :returns: the node's aggregator address if it reports through one, nid otherwise.
+        :rtype: str
+
+        """
+        return self.routes.get(nid, nid)
+
     def send_allocation(self, nid, allocation):
         """ Send an allocation to a Network's node
 
@@ -118,6 +180,7 @@ class NetworkAllocator(Agent):
         a = Allocation(next(self.aid_count), allocation.p_value, allocation.q_value, allocation.duration)
         self.logger.info("sending allocation {} to {}".format(a.aid, nid))
         packet = Packet(ptype='allocation', payload=a, src=self.local, dst=nid)
+        self.track_allocation(a.aid)
 
         # Creating Event that is triggered if no ack is received before a timeout
         # msg='no ack from {} for allocation {}'.format(nid, a.aid)
@@ -129,17 +192,60 @@ class NetworkAllocator(Agent):
         #         callbacks=[lambda aid=a.aid: self.alloc_timeouts.pop(aid)])
         # except Exception as e:
         #     self.logger.warning(e)
-        self.send(packet, remote=nid)
+        self.send(packet, remote=self.route(nid))
+
+    def send_group_allocation(self, group, allocation, members=()):
+        """ Send an allocation to a group of the Network's nodes, each of them applying it to its
+        own rated allocation (see NetworkLoad.group_share). Sent once to the group address
+        when the transport can multicast, to each member otherwise. Not acknowledged.
+
+        :param group: address of the group, joined by its members
+        :param allocation: allocation to be sent, its p_value being a scale factor
+        :param members: ids of the group's nodes, used when the transport can't multicast
+        :returns:
+        :rtype:
+
+        """
+        a = Allocation(next(self.aid_count), allocation.p_value, allocation.q_value, allocation.duration)
+        if self.comm.multicast:
+            self.logger.info("sending group allocation {} to {}".format(a.aid, group))
+            self.publish(Packet('group_allocation', [group, a], src=self.local, dst=group), group)
+            return
+        self.logger.info("sending group allocation {} to the {} nodes of {}".format(a.aid, len(members), group))
+        for nid in members:
+            self.send(Packet('group_allocation', [group, a], src=self.local, dst=nid), remote=self.route(nid))
+
+    def track_allocation(self, aid):
+        """ Remember when allocation aid was sent, to measure its latency when acknowledged.
+        Allocations not acknowledged within alloc_ack_timeout are forgotten and counted as unacked.
+
+        :param aid: id of the sent allocation
+        :returns:
+        :rtype:
+
+        """
+        now = time()
+        with self._alloc_lock:
+            # alloc_sent is ordered by send time
+            while self.alloc_sent:
+                oldest = next(iter(self.alloc_sent))
+                if now - self.alloc_sent[oldest] < self.alloc_ack_timeout:
+                    break
+                del self.alloc_sent[oldest]
+                self.metrics.count('allocation_unacked')
+            self.alloc_sent[aid] = now
 
-    def send_join_ack(self, dst):
+    def send_join_ack(self, dst, owner=None):
         """ Acknowledge a network node has joining the network (added to known nodes list)
 
         :param dst: destination of acknowledgement, should be the same node who requested joining.
+        :param owner: if set, redirect the node to join this allocator shard instead.
         :returns:
         :rtype:
 
         """
-        packet = Packet('join_ack', src=self.local, dst=dst)
+        payload = [owner] if owner is not None else None
+        packet = Packet('join_ack', payload, src=self.local, dst=dst)
         self.logger.info("{} sending join ack to {}".format(self.local, dst))
         self.send(packet, remote=dst)
 
@@ -155,7 +261,7 @@ class NetworkAllocator(Agent):
         # Stopping register nodes
         for node in list(self.nodes):
             packet = Packet(ptype='stop', src=self.local, dst=node)
-            self.send(packet, remote=node)
+            self.send(packet, remote=self.route(node))
             self.logger.info("Sent stop to {}".format(node))
             eid = EventId(packet, node)
             event = self.create_timeout(timeout=self.stop_ack_timeout, msg="no stop_ack from {}".format(node), eid=eid)
@@ -175,3 +281,75 @@ class NetworkAllocator(Agent):
         # Stop underlying event loop
         self.logger.info("Stopping event loop")
         super(NetworkAllocator, self).stop()
+
+
+class ShardedAllocator(object):
+    """ A group of NetworkAllocator shards partitioning nodes by consistent hashing of their address.
+
+    It exposes the subset of the NetworkAllocator interface used by the optimizers,
+    so that they work on the global view gathered from all shards.
+    """
+    def __init__(self, shards: list):
+        self.shards = {shard.local: shard for shard in shards}
+        self.ring = HashRing(list(self.shards))
+        for shard in shards:
+            shard.ring = self.ring
+        self.identity = None
+        self._allocation_updated = None
+
+    @property
+    def local(self):
+        """ Any shard can be joined, nodes are redirected to their owner """
+        return next(iter(self.shards))
+
+    @property
+    def nodes(self):
+        nodes = {}
+        for shard in self.shards.values():
+            nodes.update(shard.nodes)
+        return nodes
+
+    @property
+    def allocation_updated(self):
+        return self._allocation_updated
+
+    @allocation_updated.setter
+    def allocation_updated(self, value):
+        self._allocation_updated = value
+        for shard in self.shards.values():
+            shard.allocation_updated = value
+
+    def owner(self, nid):
+        return self.ring.get(nid)
+
+    def shard(self, nid):
+        """ Shard that knows node nid, or its owner on the ring if no shard knows it yet """
+        for shard in self.shards.values():
+            if nid in shard.nodes:
+                return shard
+        return self.shards[self.owner(nid)]
+
+    def send_allocation(self, nid, allocation):
+        self.shard(nid).send_allocation(nid, allocation)
+
+    def send_group_allocation(self, group, allocation, members=()):
+        shard = self.shards[self.local]
+        if shard.comm.multicast:
+            shard.send_group_allocation(group, allocation)
+            return
+        by_shard = {}
+        for nid in members:
+            by_shard.setdefault(self.shard(nid), []).append(nid)
+        for shard, nids in by_shard.items():
+            shard.send_group_allocation(group, allocation, nids)
+
+    def schedule(self, *args, **kwargs):
+        return self.shards[self.local].schedule(*args, **kwargs)
+
+    def run(self):
+        for shard in self.shards.values():
+            shard.run()
+
+    def stop(self):
+        for shard in self.shards.values():
+            shard.stop()
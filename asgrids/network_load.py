@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from math import isfinite
+from threading import Event
 from typing import Callable
-from simpy.exceptions import Interrupt
 from time import monotonic as time
 
 from .agent import Agent
 from .defs import Allocation, Packet
 
 
+def exceeds(new, old, band):
+    """ True if new differs from old by more than band (handles infinite values) """
+    if new == old:
+        return False
+    return not abs(new - old) <= band
+
+
 class NetworkLoad(Agent):
     def __init__(self, local=None, remote=None, mode='udp'):
         super(NetworkLoad, self).__init__(mode=mode)
@@ -24,8 +32,18 @@ class NetworkLoad(Agent):
         self.update_measure_cb: Callable = None
         self.update_measure_period = 1
         self.report_measure_period = 1
+        # delta reporting: only report when allocation, max_allocation or measure
+        # move beyond their deadbands, or when report_heartbeat_period expires.
+        self.report_delta = False
+        self.report_allocation_deadband = 0
+        self.report_measure_deadband = 0
+        self.report_heartbeat_period = 30
+        self.last_report = None
+        self.last_report_time = None
         # callback to call when node received join_ack
         self.joined_callback: Callable = None
+        # set once joined to an allocator
+        self.joined = Event()
         # callback to generate allocation values for this NetworkLoad
         self.generate_allocations: Callable = None
         self.generate_allocations_period = 2
@@ -37,6 +55,8 @@ class NetworkLoad(Agent):
         self.update_measure_event = None
         self.max_allocation = Allocation(p_value=float("inf"), q_value=float("inf"))
         self.max_allocation = Allocation(p_value=float("inf"), q_value=float("inf"))
+        # allocation whose active power is scaled by group allocations, max_allocation if None
+        self.rated_allocation: Allocation = None
 
     def run(self):
         super(NetworkLoad, self).run()
@@ -59,17 +79,31 @@ class NetworkLoad(Agent):
         """
         assert isinstance(p, Packet), p
         self.logger.info("handling {} from {}".format(p, p.src))
-        if p.dst != self.local:
+        if p.dst in self.groups:
+            self.deliver(self.handle_packet, p, src)
+        elif p.dst != self.local:
             self.logger.warning("packet not not for {}; for {}".format(self.local, p.dst))
-            return
+        else:
+            self.handle_packet(p, src)
 
+    def handle_packet(self, p, src=None):
+        """ Handle a packet for this node or one of its groups
+
+        :param p: packet received
+        :param src: source of packet
+        """
         msg_type = p.ptype
 
         if msg_type == 'join_ack':
-            self.logger.info("Joined successfully allocator {}".format(p.src))
-            self.remote = p.src
             if self.join_ack_timer:
                 self.interrupt_event(self.join_ack_timer)
+            if isinstance(p.payload, list) and p.payload and p.payload[0] != p.src:
+                self.logger.info("Redirected by {} to allocator {}".format(p.src, p.payload[0]))
+                self.send_join(p.payload[0])
+                return
+            self.logger.info("Joined successfully allocator {}".format(p.src))
+            self.remote = p.src
+            self.joined.set()
             if self.joined_callback is not None:
                 self.joined_callback(self.local, self.remote)
         elif msg_type == 'allocation':
@@ -85,6 +119,18 @@ class NetworkLoad(Agent):
             self.logger.info("received allocation={}".format(allocation))
             self.send_ack([allocation, self.curr_measure], p.src)
             self.handle_allocation(allocation)
+        elif msg_type == 'group_allocation':
+            group, allocation = p.payload
+            if group not in self.groups:
+                self.logger.warning("allocation for group {} not joined by {}".format(group, self.local))
+                return
+            # not acknowledged, the following reports tell the allocator the allocation is applied
+            self.logger.info("received group allocation={} for {}".format(allocation, group))
+            share = self.group_share(allocation)
+            if share is None:
+                self.logger.warning("group allocation for {} ignored: no finite rated allocation".format(group))
+                return
+            self.handle_allocation(share)
         elif msg_type == 'stop':
             self.logger.info("Received Stop from {}".format(p.src))
             self.send(Packet(ptype='stop_ack', src=self.local), p.src)
@@ -104,6 +150,20 @@ class NetworkLoad(Agent):
         self.logger.debug("handling allocation {}".format(allocation))
         self.curr_allocation = allocation
 
+    def group_share(self, allocation):
+        """ This node's allocation from an allocation sent to one of its groups
+
+        :param allocation: group allocation, its p_value being the scale of the node's
+            rated_allocation (max_allocation if None) active power, its q_value the reactive power
+        :returns: the node's allocation, None if the rated active power is not finite
+        :rtype: Allocation
+
+        """
+        rated = self.rated_allocation if self.rated_allocation is not None else self.max_allocation
+        if not isfinite(rated.p_value):
+            return None
+        return Allocation(allocation.aid, allocation.p_value * rated.p_value, allocation.q_value, allocation.duration)
+
     def get_allocation(self):
         """ Tries to query an allocations source for a new allocation
         The new allocation will also be saved as limit for eventual orders received from an allocator
@@ -116,7 +176,8 @@ class NetworkLoad(Agent):
         else:
             self.logger.info("No source defined to generate allocations")
 
-        if self.max_allocation is not None:
+        # A zero duration (e.g. the default unbounded max_allocation) would reschedule immediately and spin
+        if self.max_allocation is not None and self.max_allocation.duration > 0:
             self.next_allocation = self.schedule(self.get_allocation, delay=self.max_allocation.duration)
         else:
             self.next_allocation = self.schedule(self.get_allocation, delay=self.generate_allocations_period)
@@ -137,15 +198,45 @@ class NetworkLoad(Agent):
         if self.remote is not None:
             # if self.curr_measure > 0:
             allocation = min(self.curr_allocation, self.max_allocation) if self.curr_allocation.p_value >=0 else max(self.curr_allocation, self.max_allocation)
-            self.logger.info("Reporting allocation {} to {}".format(allocation, self.remote))
-            # self.logger.warning("sending measure {}v".format(self.curr_measure))
-            packet = Packet('curr_allocation', [allocation, self.max_allocation, self.curr_measure], self.local)
-            self.send(packet, self.remote)
+            report = [allocation, self.max_allocation, self.curr_measure]
+            now = time()
+            if self.should_report(report, now):
+                self.logger.info("Reporting allocation {} to {}".format(allocation, self.remote))
+                # self.logger.warning("sending measure {}v".format(self.curr_measure))
+                packet = Packet('curr_allocation', report, self.local)
+                self.send(packet, self.remote)
+                self.last_report = report
+                self.last_report_time = now
+            else:
+                self.logger.debug("Skipping report, no change beyond deadbands")
             # self.curr_measure = 0
         else:
             self.logger.info("Not reporting, remote not defined yet")
         self.report_measure_event = self.schedule(action=self.report_measure, delay=self.report_measure_period)
 
+    def should_report(self, report, now):
+        """ Decide whether a report has to be sent to the allocator.
+        Always true in periodic mode. In delta mode, true when the allocation, max_allocation
+        or measure moved beyond their deadbands since the last report, or when the heartbeat expired.
+
+        :param report: [allocation, max_allocation, measure] about to be reported
+        :param now: current monotonic time
+        :returns: True if report should be sent
+        :rtype: bool
+
+        """
+        if not self.report_delta or self.last_report is None:
+            return True
+        if now - self.last_report_time >= self.report_heartbeat_period:
+            return True
+        allocation, max_allocation, measure = report
+        last_allocation, last_max_allocation, last_measure = self.last_report
+        band = self.report_allocation_deadband
+        for new, old in ((allocation, last_allocation), (max_allocation, last_max_allocation)):
+            if exceeds(new.p_value, old.p_value, band) or exceeds(new.q_value, old.q_value, band):
+                return True
+        return exceeds(measure, last_measure, self.report_measure_deadband)
+
     def send_join(self, dst):
         """ Send a join request to the allocator
 
@@ -157,15 +248,19 @@ class NetworkLoad(Agent):
         try:
             self.logger.info('{} Joining {}'.format(self.local, dst))
             packet = Packet('join', [self.curr_allocation, None], src=self.local, dst=dst)
+            # Retry joining if no join_ack is received before join_ack_timeout
             self.join_ack_timer = self.schedule(
-                    action=lambda msg: self.logger.info(msg),
-                    args=['no join ack from {}'.format(dst)],
+                    action=self.join_timeout,
+                    args=[dst],
                     delay=self.join_ack_timeout)
-            self.join_ack_timer.callbacks.append(lambda e: self.send_join(dst))
             self.send(packet, dst)
         except Exception as e:
             self.logger.warning("Error sending join: {}".format(e))
 
+    def join_timeout(self, dst):
+        self.logger.info('no join ack from {}'.format(dst))
+        self.send_join(dst)
+
     def send_ack(self, allocation, dst):
         """ Acknowledge a requested allocation to the Allocator.
 
@@ -191,6 +286,7 @@ class NetworkLoad(Agent):
         # Stop underlying simpy event loop
         self.logger.info("Stopping Simpy")
         self.remote = None
+        self.joined.clear()
         self.interrupt_event(self.join_ack_timer)
         self.interrupt_event(self.update_measure_event)
         self.interrupt_event(self.next_allocation)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline time-series simulation of the controlled grid, without agents or sockets.
+
+Load profiles (one row per step) go through the PI controller, the power flow and an
+optional ChannelModel in a plain loop, replaying what cigre_pv_example.py does in real
+time: every step the loads take their profile's setpoint, generators being capped by
+their last received allocation, the power flow gives the voltages the loads report to
+the allocator, and every cycle steps the controller sends new allocations.
+Runs are accounted for by a RunAnalysis, so metrics are the ones of the plotting scripts.
+"""
+
+import hashlib
+import heapq
+from copy import deepcopy
+
+import numpy as np
+
+from .analysis import RunAnalysis
+from .powerflow import PandapowerPowerFlow, PowerFlow, structure_signature
+
+ALLOCATOR = 'allocator'
+
+
+class OfflineSimulation(object):
+    """ Time-stepped simulation of net driven by load profiles.
+
+    :param net: pandapower network, copied, whose load names match the profiles' columns
+    :param curves: DataFrame of the profiles, one row per step: timestamp (s), then
+        <load name>_P (kW) and <load name>_Q (kvar) of each load
+    :param controller: PIController driving the generators, copied by each run, None for no control
+    :param generators: names of the controlled loads, those with 'PV' in their name if None
+    :param max_vm: measured voltage (p.u.) above which the controller acts, less 0.01 (see optimize_network_pi)
+    :param cycle: steps between two runs of the controller
+    :param check_limit: only run the controller when a measure since its last run reached the limit
+    :param channel: ChannelModel of measures (load -> 'allocator') and allocations ('allocator' -> load),
+        copied by each run, None for a perfect channel
+    :param p_factor: scale of the profiles' active powers
+    :param max_p_kw: maximum production (kW, negative) of each generator
+    """
+    def __init__(self, net, curves, controller=None, generators=None, max_vm=1.01, cycle=5, check_limit=False,
+                 channel=None, p_factor=1.0, max_p_kw=-30.0):
+        self.net = deepcopy(net)
+        names = [str(name) for name in self.net.load['name'].values]
+        missing = [name for name in names if '{}_P'.format(name) not in curves]
+        if missing:
+            raise ValueError("no profile for loads {}".format(missing))
+        self.names = names
+        self.times = curves['timestamp'].values.astype(float)
+        self.p_kw = curves[['{}_P'.format(name) for name in names]].values * p_factor
+        self.q_kvar = np.column_stack([curves['{}_Q'.format(name)].values if '{}_Q'.format(name) in curves
+                                       else np.zeros(len(curves)) for name in names])
+        if generators is None:
+            generators = [name for name in names if 'PV' in name]
+        self.generators = np.array([name in generators for name in names])
+        self.controller = controller
+        self.max_vm = max_vm
+        self.cycle = cycle
+        self.check_limit = check_limit
+        self.channel = channel
+        self.max_p_kw = max_p_kw
+        self.control_cycles = 0
+        self._power_flow = None
+
+    def __getstate__(self):
+        # compiled again in each process
+        state = dict(self.__dict__)
+        state['_power_flow'] = None
+        return state
+
+    @property
+    def key(self):
+        """ Digest of everything but the controller determining the runs, to cache their results """
+        digest = hashlib.sha1(structure_signature(self.net))
+        load = self.net.load
+        for array in (load.in_service.values, load.scaling.values, self.times, self.p_kw, self.q_kvar, self.generators):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(repr((self.max_vm, self.cycle, self.check_limit, self.max_p_kw)).encode())
+        channel = self.channel
+        if channel is not None:
+            links = sorted(channel.links.items(), key=repr)
+            digest.update(repr((channel.default, links, channel.seed, channel.block)).encode())
+        return digest.hexdigest()
+
+    @property
+    def power_flow(self):
+        if self._power_flow is None:
+            self._power_flow = PowerFlow(self.net)
+        return self._power_flow
+
+    def solve(self, p_kw, q_kvar, V=None):
+        """ Voltages of a step's setpoints, starting from V
+
+        :returns: voltage magnitude (p.u.) of each net.bus row, and the complex voltages of the ppci buses
+        """
+        power_flow = self.power_flow
+        solver = power_flow.solver
+        if isinstance(solver, PandapowerPowerFlow):
+            self.net.load['p_kw'], self.net.load['q_kvar'] = p_kw, q_kvar
+            return power_flow.run(), None
+        grid = power_flow.grid
+        V = solver.solve(grid.fixed_injection - grid.load_demand(p_kw, q_kvar), grid.V if V is None else V)
+        return grid.voltage_magnitudes(V[:, None])[0], V
+
+    def run(self, steps=None, log=None, **params):
+        """ Simulate the first steps of the profiles
+
+        :param steps: number of steps, all of them if None
+        :param log: logger receiving the LOAD and VOLTAGE records, as SmartGridSimulation.runpp
+        :param params: RunAnalysis parameters (max_vm, horizon, reference, tslice)
+        :returns: the run summary, see RunAnalysis.summary, with the number of controller runs (control_cycles)
+        :rtype: dict
+        """
+        analysis = RunAnalysis(**params)
+        for step, p_kw, vm_pu in self.simulate(steps):
+            self.record(analysis, log, self.times[step], p_kw, vm_pu)
+        summary = analysis.summary()
+        summary['control_cycles'] = self.control_cycles
+        return summary
+
+    def simulate(self, steps=None, controller=None):
+        """ Step through the first steps of the profiles
+
+        :param steps: number of steps, all of them if None
+        :param controller: PIController used instead of (a copy of) the simulation's
+        :returns: iterator of the step, the load setpoints (kW) and the voltage magnitude (p.u.) of each
+            net.bus row at each step. The number of controller runs is kept in control_cycles.
+        """
+        steps = len(self.times) if steps is None else min(steps, len(self.times))
+        self.control_cycles = 0
+        if controller is None:
+            controller = deepcopy(self.controller)
+        if controller is None:
+            vm_pu = self.power_flow.run_scenarios(self.p_kw[:steps], self.q_kvar[:steps])
+            for step in range(steps):
+                yield step, self.p_kw[step], vm_pu[step]
+            return
+
+        grid = self.power_flow.grid
+        generators = self.generators
+        names = self.names
+        channel = deepcopy(self.channel)
+        # generators' production limits (kW), measures received by the allocator since the controller's last run
+        limits = np.full(len(names), -np.inf)
+        measured = -np.inf
+        # packets in flight: (arrival, sequence, kind, load row, value)
+        in_flight = []
+        sequence = 0
+        V = None
+        for step in range(steps):
+            t = self.times[step]
+            while in_flight and in_flight[0][0] <= t:
+                _, _, kind, row, value = heapq.heappop(in_flight)
+                if kind == 'allocation':
+                    limits[row] = value
+                else:
+                    measured = max(measured, value)
+
+            p_kw = np.where(generators, np.maximum(self.p_kw[step], limits), self.p_kw[step])
+            vm_pu, V = self.solve(p_kw, self.q_kvar[step], V)
+            yield step, p_kw, vm_pu
+            load_vm_pu = vm_pu[grid.load_bus_rows]
+
+            for row, name in enumerate(names):
+                drop, delay = channel.on_send(None, name, ALLOCATOR) if channel is not None else (False, 0)
+                if not drop:
+                    sequence += 1
+                    heapq.heappush(in_flight, (t + delay, sequence, 'measure', row, load_vm_pu[row]))
+
+            if step % self.cycle:
+                continue
+            if self.check_limit and measured < self.max_vm - 0.01:
+                continue
+            measured = -np.inf
+            self.control_cycles += 1
+            voltages = load_vm_pu * grid.load_vn_kv * 1000
+            _, allocations = controller.generate_allocations(
+                voltages[~generators], voltages[generators], p_kw[~generators] * 1e3,
+                [self.max_p_kw * 1e3] * generators.sum())
+            for row, allocation in zip(np.flatnonzero(generators), allocations):
+                drop, delay = channel.on_send(None, ALLOCATOR, names[row]) if channel is not None else (False, 0)
+                if not drop:
+                    sequence += 1
+                    heapq.heappush(in_flight, (t + delay, sequence, 'allocation', row, allocation.p_value / 1e3))
+
+    def record(self, analysis, log, t, p_kw, vm_pu):
+        records = [('LOAD', t, name, p) for name, p in zip(self.names, p_kw.tolist())]
+        records.extend(('VOLTAGE', t, name, vm) for name, vm in zip(self.power_flow.grid.bus_names, vm_pu.tolist()))
+        analysis.feed_records(records)
+        if log is not None:
+            for kind, t, name, value in records:
+                log.info('{} {}\t{}\t{}'.format(kind, t, name, value))
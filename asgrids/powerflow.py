@@ -0,0 +1,874 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fast power flow for the networks driven by SmartGridSimulation.
+
+The network is compiled once into a CompiledGrid with pandapower's own converter (same
+per unit system, switch fusion and branch models as pp.runpp): admittance matrix, bus
+types, load to bus incidence and the constant part of the injections. Each cycle only
+the load injections are refreshed from net.load and the numeric solve runs, skipping
+pandapower's DataFrame bookkeeping:
+  - radial networks are solved by a backward/forward sweep vectorized by depth level
+    of the feeder tree
+  - other networks by Newton-Raphson on the cached admittance matrix, reusing the
+    Jacobian's structure and LU factors across solves
+  - voltage dependent loads fall back to pp.runpp
+Results are arrays, pandas res_* tables are only built on request. Between solves,
+VoltageSensitivity estimates voltages from load setpoint changes.
+"""
+
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+import pandapower as pp
+from pandapower import LoadflowNotConverged
+from pandapower.idx_brch import F_BUS, T_BUS, BR_R, BR_X, BR_B, TAP, SHIFT, BR_R_ASYM, BR_X_ASYM
+from pandapower.idx_bus import GS, BS, PD, QD
+from pandapower.idx_gen import PG, QG
+from pandapower.pd2ppc import _pd2ppc
+from pandapower.pf.makeYbus_pypower import makeYbus
+from pandapower.pf.ppci_variables import _get_pf_variables_from_ppci
+from scipy.sparse import csc_matrix, csr_matrix, identity
+from scipy.sparse.linalg import splu
+
+logger = logging.getLogger(__name__)
+
+# Columns compiled into a CompiledGrid, by table: changing them requires compiling the grid again
+STRUCTURE = {
+    'bus': ['in_service'],
+    'load': ['bus'],
+    'switch': ['closed'],
+    'line': ['in_service', 'parallel', 'length_km', 'r_ohm_per_km', 'x_ohm_per_km', 'c_nf_per_km'],
+    'trafo': ['in_service', 'tp_pos'],
+    'trafo3w': ['in_service', 'tp_pos'],
+    'impedance': ['in_service'],
+    'ext_grid': ['in_service', 'vm_pu', 'va_degree'],
+    'gen': ['in_service', 'p_kw', 'vm_pu', 'scaling'],
+    'sgen': ['in_service', 'p_kw', 'q_kvar', 'scaling'],
+    'shunt': ['in_service', 'p_kw', 'q_kvar', 'step'],
+    'ward': ['in_service', 'ps_kw', 'qs_kvar', 'pz_kw', 'qz_kvar'],
+    'xward': ['in_service', 'ps_kw', 'qs_kvar', 'pz_kw', 'qz_kvar', 'vm_pu'],
+}
+
+
+class UnsupportedNetwork(ValueError):
+    """ The network can't be solved by a solver """
+    pass
+
+
+def structure_signature(net):
+    """ Digest of the STRUCTURE columns of net """
+    digest = hashlib.sha1()
+    for table, columns in STRUCTURE.items():
+        if table not in net:
+            continue
+        elements = net[table]
+        digest.update(str(len(elements)).encode())
+        for column in columns:
+            if column in elements:
+                digest.update(np.ascontiguousarray(elements[column].values).tobytes())
+    return digest.digest()
+
+
+class CompiledGrid(object):
+    """ Arrays of net needed to solve its power flow, compiled once.
+
+    Loads are read from net.load (p_kw, q_kvar, scaling, in_service) at each solve,
+    everything else (topology, parameters, other elements) is fixed at compilation,
+    see signature.
+    Results are replaced (not updated in place) by each solve, so that a reader
+    holding vm_pu gets a consistent snapshot.
+
+    :param net: pandapower network
+    """
+    def __init__(self, net):
+        self.net = net
+        self.signature = structure_signature(net)
+        # pandapower's conversion needs the options set by runpp, whose results are the initial state
+        pp.runpp(net)
+        self.options = net._options
+        _, ppci = _pd2ppc(net)
+        self.ppci = ppci
+        base_mva, bus, gen, branch, ref, pv, pq, on, gbus, _, _ = _get_pf_variables_from_ppci(ppci)
+        self.base_mva, self.bus, self.gen, self.branch = base_mva, bus, gen, branch
+        self.ref, self.pv, self.pq = ref, pv, pq
+        self.n = n = len(bus)
+        Ybus, self.Yf, self.Yt = makeYbus(base_mva, bus, branch)
+        self.Ybus = Ybus.tocsr()
+
+        # pandapower bus -> ppci bus, -1 for out of service buses
+        lookup = net._pd2ppc_lookups['bus']
+        positions = lookup[net.bus.index.values]
+        self.bus_lookup = np.where(positions < n, positions, -1)
+        self.bus_lookup[~net.bus.in_service.values] = -1
+        self.in_service = self.bus_lookup >= 0
+        self.bus_names = net.bus['name'].values
+        self.vn_kv = net.bus['vn_kv'].values
+
+        # Loads: ppci bus incidence, and net.bus row, by net.load row
+        self.load_names = net.load['name'].values
+        self.load_rows = {name: row for row, name in enumerate(self.load_names)}
+        self.load_bus = lookup[net.load.bus.values]
+        self.load_incidence = csr_matrix((np.ones(len(net.load)), (self.load_bus, np.arange(len(net.load)))),
+                                         shape=(n, len(net.load)))
+        self.load_bus_rows = net.bus.index.get_indexer(net.load.bus.values)
+        self.load_vn_kv = self.vn_kv[self.load_bus_rows]
+
+        # Injections of everything but net.load
+        generation = np.zeros(n, dtype=complex)
+        np.add.at(generation, gbus, gen[on, PG] + 1j * gen[on, QG])
+        self.fixed_injection = (generation - bus[:, PD] - 1j * bus[:, QD]) / base_mva + self.load_demand()
+
+        V = np.zeros(n, dtype=complex)
+        vm, va = net.res_bus['vm_pu'].values, net.res_bus['va_degree'].values
+        V[self.bus_lookup[self.in_service]] = (vm * np.exp(1j * np.deg2rad(va)))[self.in_service]
+        self.update(V)
+
+    def load_demand(self, p_kw=None, q_kvar=None):
+        """ Demand (p.u.) of net.load at each ppci bus
+
+        :param p_kw: setpoints of the loads instead of net.load's, or loads x scenarios
+        :param q_kvar: same for reactive power
+        """
+        load = self.net.load
+        active = load.in_service.values * load.scaling.values * (1e-3 / self.base_mva)
+        power = (load.p_kw.values if p_kw is None else p_kw) + 1j * (load.q_kvar.values if q_kvar is None else q_kvar)
+        return self.load_incidence.dot(power * active.reshape((-1,) + (1,) * (power.ndim - 1)))
+
+    def voltage_magnitudes(self, V):
+        """ Voltage magnitudes of the net.bus rows from voltages of the ppci buses x scenarios
+
+        :returns: scenarios x net.bus rows
+        """
+        vm_pu = np.full((V.shape[1], len(self.bus_lookup)), np.nan)
+        vm_pu[:, self.in_service] = np.abs(V[self.bus_lookup[self.in_service]]).T
+        return vm_pu
+
+    def injection(self):
+        """ Complex power (p.u.) injected at each ppci bus """
+        return self.fixed_injection - self.load_demand()
+
+    def update(self, V):
+        """ Set the solution V (ppci buses) """
+        self.V = V
+        vm_pu = np.full(len(self.bus_lookup), np.nan)
+        va_degree = np.full(len(self.bus_lookup), np.nan)
+        vm_pu[self.in_service] = np.abs(V[self.bus_lookup[self.in_service]])
+        va_degree[self.in_service] = np.angle(V[self.bus_lookup[self.in_service]], deg=True)
+        self.vm_pu, self.va_degree = vm_pu, va_degree
+        self._res_bus = self._res_load = None
+
+    @property
+    def load_vm_pu(self):
+        """ Voltage magnitude (p.u.) at each net.load row """
+        return self.vm_pu[self.load_bus_rows]
+
+    @property
+    def res_bus(self):
+        """ Bus voltages as a DataFrame like net.res_bus (vm_pu, va_degree), built on request """
+        if self._res_bus is None:
+            self._res_bus = pd.DataFrame({'vm_pu': self.vm_pu, 'va_degree': self.va_degree},
+                                         index=self.net.bus.index)
+        return self._res_bus
+
+    @property
+    def res_load(self):
+        """ Load powers as a DataFrame like net.res_load (p_kw, q_kvar), built on request """
+        if self._res_load is None:
+            load = self.net.load
+            active = load.in_service.values * load.scaling.values
+            self._res_load = pd.DataFrame({'p_kw': load.p_kw.values * active, 'q_kvar': load.q_kvar.values * active},
+                                          index=load.index)
+        return self._res_load
+
+    def update_net(self):
+        """ Write the results to net.res_bus and net.res_load, for code reading them from net """
+        for column in ('vm_pu', 'va_degree'):
+            self.net.res_bus[column] = self.res_bus[column]
+        for column in ('p_kw', 'q_kvar'):
+            self.net.res_load[column] = self.res_load[column]
+
+
+class RadialPowerFlow(object):
+    """ Backward/forward sweep power flow of a radial grid with a single slack bus and only PQ buses.
+
+    :param grid: CompiledGrid
+    :param tolerance: convergence threshold on voltage updates (p.u.)
+    :param max_iteration: maximum number of sweeps
+    """
+    def __init__(self, grid, tolerance=1e-8, max_iteration=100):
+        self.grid = grid
+        self.tolerance = tolerance
+        self.max_iteration = max_iteration
+        self.iterations = 0
+        n, branch = grid.n, grid.branch
+        if len(grid.ref) != 1 or len(grid.pv):
+            raise UnsupportedNetwork("{} slack buses, {} PV buses".format(len(grid.ref), len(grid.pv)))
+        if len(branch) != n - 1:
+            raise UnsupportedNetwork("meshed: {} branches for {} buses".format(len(branch), n))
+        if branch[:, BR_R_ASYM].any() or branch[:, BR_X_ASYM].any():
+            raise UnsupportedNetwork("asymmetric branch impedances")
+        self.slack = grid.ref[0]
+        self.slack_voltage = grid.V[self.slack]
+        self.shunt = (grid.bus[:, GS] + 1j * grid.bus[:, BS]) / grid.base_mva
+
+        # Feeder tree from the slack bus
+        f = np.real(branch[:, F_BUS]).astype(int)
+        t = np.real(branch[:, T_BUS]).astype(int)
+        adjacency = [[] for _ in range(n)]
+        for k in range(len(branch)):
+            adjacency[f[k]].append(k)
+            adjacency[t[k]].append(k)
+        parent = np.full(n, -1)
+        parent_branch = np.full(n, -1)
+        depth = np.full(n, -1)
+        depth[self.slack] = 0
+        order = [self.slack]
+        for b in order:
+            for k in adjacency[b]:
+                child = t[k] if f[k] == b else f[k]
+                if depth[child] >= 0:
+                    continue
+                depth[child] = depth[b] + 1
+                parent[child] = b
+                parent_branch[child] = k
+                order.append(child)
+        if len(order) != n:
+            raise UnsupportedNetwork("{} buses not connected to the slack bus".format(n - len(order)))
+
+        # Branch of each bus to its parent, as pi model with an ideal transformer on the from side
+        k = parent_branch
+        tap = np.real(branch[k, TAP])
+        tap[tap == 0] = 1
+        tap = tap * np.exp(1j * np.deg2rad(np.real(branch[k, SHIFT])))
+        z = branch[k, BR_R] + 1j * branch[k, BR_X]
+        y = 1j * branch[k, BR_B] / 2
+        # whether the branch goes from the parent to the bus
+        forward = f[k] == parent
+        # Sweeps are linear, each is folded into a matrix over the feeder tree:
+        # - series current of the branch of bus i (from its parent):
+        #   series[i] = a[i] * (drawn[i] + sum of upstream[c], children c) + b[i] * V[i]
+        #   upstream[i] = c[i] * series[i] + d[i] * V[parent[i]], current drawn from the parent
+        # - V[i] = e[i] * V[parent[i]] - g[i] * series[i]
+        a = np.where(forward, 1, np.conj(tap))
+        b = np.where(forward, y, np.conj(tap) * y / np.abs(tap) ** 2)
+        c = np.where(forward, 1 / np.conj(tap), 1)
+        d = np.where(forward, y / np.abs(tap) ** 2, y)
+        e = np.where(forward, 1 / tap, tap)
+        g = np.where(forward, z, tap * z)
+        children = np.flatnonzero(parent >= 0)
+        a[self.slack] = b[self.slack] = g[self.slack] = 0
+        np.add.at(b, parent[children], a[parent[children]] * d[children])
+        self.drawn_gain, self.voltage_gain, self.drop_gain = a, b, g
+        # (I - N)^-1 and (I - L)^-1, N and L being nilpotent (paths of the tree)
+        self.backward = self.path_inverse(csr_matrix((a[parent[children]] * c[children], (parent[children], children)),
+                                                     shape=(n, n)), depth.max())
+        self.forward = self.path_inverse(csr_matrix((e[children], (children, parent[children])), shape=(n, n)),
+                                         depth.max())
+
+    @staticmethod
+    def path_inverse(N, depth):
+        inverse = term = identity(N.shape[0], dtype=complex, format='csr')
+        for _ in range(depth):
+            term = N.dot(term)
+            inverse = inverse + term
+        return inverse.tocsr()
+
+    def solve(self, S=None, V=None):
+        """ Solve with the current loads, starting from the last solution
+
+        :param S: injections (p.u.) of the ppci buses, instead of the grid's
+        :param V: initial voltages, instead of the last solution
+        :returns: complex voltage (p.u.) of each ppci bus
+        """
+        S = self.grid.injection() if S is None else S
+        V = self.grid.V if V is None else V
+        V = self.sweep(S.reshape(self.grid.n, -1), V.reshape(self.grid.n, -1))
+        if np.isnan(V).any():
+            raise LoadflowNotConverged("Radial power flow did not converge after {} sweeps".format(self.iterations))
+        return V[:, 0]
+
+    def solve_many(self, S, V):
+        """ Solve scenarios at once, NaN voltages for those not converging
+
+        :param S: injections (p.u.), ppci buses x scenarios
+        :param V: initial voltages of the ppci buses
+        :returns: complex voltages (p.u.), ppci buses x scenarios
+        """
+        return self.sweep(S, V.reshape(self.grid.n, -1))
+
+    def sweep(self, S, V):
+        # the slack bus injection is left out by the sweep
+        demand = -S
+        V = np.broadcast_to(V, S.shape).copy()
+        drawn_gain, voltage_gain = self.drawn_gain[:, None], self.voltage_gain[:, None]
+        drop_gain, shunt = self.drop_gain[:, None], self.shunt[:, None]
+        slack = np.zeros(S.shape, dtype=complex)
+        slack[self.slack] = self.slack_voltage
+        for iteration in range(1, self.max_iteration + 1):
+            # Backward sweep: currents drawn by each subtree
+            drawn = np.conj(demand / V) + shunt * V
+            series = self.backward.dot(drawn_gain * drawn + voltage_gain * V)
+            # Forward sweep: voltage drops from the slack bus
+            previous = V
+            V = self.forward.dot(slack - drop_gain * series)
+            delta = np.abs(V - previous).max(axis=0)
+            if (delta < self.tolerance).all():
+                break
+        else:
+            V[:, ~(delta < self.tolerance)] = np.nan
+        self.iterations = iteration
+        return V
+
+
+class Jacobian(object):
+    """ Power flow Jacobian [dP/dVa dP/dVm; dQ/dVa dQ/dVm] of a grid, for the angles of PV and PQ
+    buses and the magnitudes of PQ buses (rows p_row and q_row of each bus, -1 if none).
+    Its sparsity pattern is computed once, evaluations only fill the data.
+
+    :param grid: CompiledGrid
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.pvpq = np.r_[grid.pv, grid.pq]
+        npvpq, npq = len(self.pvpq), len(grid.pq)
+        self.npvpq = npvpq
+
+        # Ybus pattern with the whole diagonal
+        Y = (grid.Ybus + csr_matrix((np.ones(grid.n), (np.arange(grid.n), np.arange(grid.n))))).tocoo()
+        rows, columns = Y.row, Y.col
+        self.rows, self.columns = rows, columns
+        self.y = np.asarray(grid.Ybus[rows, columns]).ravel()
+        self.diagonal = np.flatnonzero(rows == columns)
+        self.diagonal_bus = rows[self.diagonal]
+
+        # Entries taken from the pattern's dS/dVa and dS/dVm
+        self.p_row = np.full(grid.n, -1)
+        self.p_row[self.pvpq] = np.arange(npvpq)
+        self.q_row = np.full(grid.n, -1)
+        self.q_row[grid.pq] = npvpq + np.arange(npq)
+        self.blocks = []
+        j_rows, j_columns = [], []
+        for row, column in ((self.p_row, self.p_row), (self.p_row, self.q_row),
+                            (self.q_row, self.p_row), (self.q_row, self.q_row)):
+            entries = np.flatnonzero((row[rows] >= 0) & (column[columns] >= 0))
+            self.blocks.append(entries)
+            j_rows.append(row[rows[entries]])
+            j_columns.append(column[columns[entries]])
+        j_rows, j_columns = np.concatenate(j_rows), np.concatenate(j_columns)
+        # CSC layout, filled by permuting the entries
+        self.order = np.lexsort((j_rows, j_columns))
+        self.indices = j_rows[self.order]
+        self.indptr = np.r_[0, np.cumsum(np.bincount(j_columns, minlength=npvpq + npq))]
+        self.shape = (npvpq + npq, npvpq + npq)
+
+    def evaluate(self, V):
+        """ Jacobian at V, as a CSC matrix """
+        rows, columns, y = self.rows, self.columns, self.y
+        Vnorm = V / np.abs(V)
+        current = self.grid.Ybus.dot(V)
+        d = self.diagonal_bus
+        dS_dVa = -1j * V[rows] * np.conj(y * V[columns])
+        dS_dVa[self.diagonal] += 1j * V[d] * np.conj(current[d])
+        dS_dVm = V[rows] * np.conj(y * Vnorm[columns])
+        dS_dVm[self.diagonal] += np.conj(current[d]) * Vnorm[d]
+        b11, b12, b21, b22 = self.blocks
+        data = np.concatenate([dS_dVa[b11].real, dS_dVm[b12].real, dS_dVa[b21].imag, dS_dVm[b22].imag])
+        return csc_matrix((data[self.order], self.indices, self.indptr), shape=self.shape)
+
+
+class NewtonPowerFlow(object):
+    """ Newton-Raphson power flow on the grid's cached admittance matrix.
+
+    Only injections change between solves, so the Jacobian's sparsity pattern is
+    computed once, and its LU factors are kept across iterations and solves: steps are
+    taken with the last factors (chord method) as long as they reduce the mismatch by
+    contraction, the Jacobian being refactorized at the current voltages otherwise.
+
+    :param grid: CompiledGrid
+    :param max_iteration: maximum number of steps of a solve
+    :param contraction: minimal reduction of the mismatch by a step with reused factors
+    """
+    def __init__(self, grid, max_iteration=30, contraction=0.5):
+        self.grid = grid
+        # same convergence criterion as pp.runpp
+        self.tolerance = grid.options['tolerance_kva'] * 1e-3
+        self.max_iteration = max_iteration
+        self.contraction = contraction
+        self.iterations = 0
+        self.factorizations = 0
+        self.lu = None
+        self.jacobian = Jacobian(grid)
+        self.pvpq = self.jacobian.pvpq
+
+    def factorize(self, V):
+        self.lu = splu(self.jacobian.evaluate(V))
+        self.factorizations += 1
+
+    def invalidate(self):
+        """ Drop the LU factors """
+        self.lu = None
+
+    def mismatch(self, V, S):
+        grid = self.grid
+        mismatch = V * np.conj(grid.Ybus.dot(V)) - S
+        return np.concatenate([mismatch[self.pvpq].real, mismatch[grid.pq].imag])
+
+    def step(self, V, dx):
+        """ V updated by the Newton step dx """
+        npvpq = len(self.pvpq)
+        Va, Vm = np.angle(V), np.abs(V)
+        Va[self.pvpq] += dx[:npvpq]
+        Vm[self.grid.pq] += dx[npvpq:]
+        return Vm * np.exp(1j * Va)
+
+    def solve(self, S=None, V=None):
+        """ Solve with the current loads, starting from the last solution
+
+        :param S: injections (p.u.) of the ppci buses, instead of the grid's
+        :param V: initial voltages, instead of the last solution
+        :returns: complex voltage (p.u.) of each ppci bus
+        """
+        S = self.grid.injection() if S is None else S
+        V = (self.grid.V if V is None else V).copy()
+        F = self.mismatch(V, S)
+        norm = np.abs(F).max()
+        fresh = False
+        iteration = 0
+        while norm >= self.tolerance:
+            if iteration == self.max_iteration:
+                self.lu = None
+                raise LoadflowNotConverged("Power flow did not converge after {} iterations".format(iteration))
+            iteration += 1
+            if self.lu is None:
+                self.factorize(V)
+                fresh = True
+            step = self.step(V, self.lu.solve(-F))
+            F_step = self.mismatch(step, S)
+            norm_step = np.abs(F_step).max()
+            if not fresh and norm_step > self.contraction * norm:
+                # factors too far from the current Jacobian
+                self.lu = None
+                if norm_step >= norm:
+                    continue
+            V, F, norm = step, F_step, norm_step
+            fresh = False
+        self.iterations = iteration
+        return V
+
+    def solve_many(self, S, V):
+        """ Solve scenarios at once: chord steps with the current factors for all of them,
+        then separate solves for those the factors don't bring to convergence.
+        NaN voltages for the scenarios not converging.
+
+        :param S: injections (p.u.), ppci buses x scenarios
+        :param V: initial voltages of the ppci buses
+        :returns: complex voltages (p.u.), ppci buses x scenarios
+        """
+        if self.lu is None:
+            self.factorize(self.grid.V)
+        V = np.broadcast_to(V.reshape(self.grid.n, -1), S.shape).copy()
+        F = self.mismatch(V, S)
+        norm = np.abs(F).max(axis=0)
+        chord = np.flatnonzero(norm >= self.tolerance)
+        for _ in range(self.max_iteration):
+            if not len(chord):
+                break
+            step = self.step(V[:, chord], self.lu.solve(-F[:, chord]))
+            F_step = self.mismatch(step, S[:, chord])
+            norm_step = np.abs(F_step).max(axis=0)
+            V[:, chord], F[:, chord] = step, F_step
+            contracted = norm_step <= self.contraction * norm[chord]
+            norm[chord] = norm_step
+            chord = chord[contracted & (norm_step >= self.tolerance)]
+        for i in np.flatnonzero(norm >= self.tolerance):
+            try:
+                V[:, i] = self.solve(S[:, i], V[:, i])
+            except LoadflowNotConverged:
+                V[:, i] = np.nan
+        return V
+
+    def __getstate__(self):
+        # LU factors can't be pickled
+        return dict(self.__dict__, lu=None)
+
+
+class PandapowerPowerFlow(object):
+    """ pp.runpp, for what the other solvers don't support
+
+    :param grid: CompiledGrid
+    """
+    def __init__(self, grid):
+        self.grid = grid
+
+    def solve(self):
+        grid = self.grid
+        pp.runpp(grid.net, init='results')
+        res_bus = grid.net.res_bus
+        V = grid.V.copy()
+        vm, va = res_bus['vm_pu'].values, res_bus['va_degree'].values
+        V[grid.bus_lookup[grid.in_service]] = (vm * np.exp(1j * np.deg2rad(va)))[grid.in_service]
+        return V
+
+
+class VoltageSensitivity(object):
+    """ Voltage magnitudes estimated between solves, linearized around the last solution:
+    vm ~ vm_0 + dvm_dp (p - p_0) + dvm_dq (q - q_0), with p, q the load setpoints (kW, kvar).
+
+    The sensitivities (net.bus rows x net.load rows) come from the Jacobian at the solution
+    they were computed for, and are only computed again once a solution drifted by more than
+    drift from it. Load setpoint changes update the estimate in O(buses) each.
+
+    :param grid: CompiledGrid
+    :param drift: voltage change (p.u.) since the sensitivities' solution that makes them stale
+    """
+    def __init__(self, grid, drift=0.005):
+        self.grid = grid
+        self.drift = drift
+        self.jacobian = Jacobian(grid)
+        self.V = None
+        self.computations = 0
+        self._lock = Lock()
+        self.rebase()
+
+    def compute(self):
+        """ Sensitivities at the grid's solution """
+        grid, jacobian = self.grid, self.jacobian
+        lu = splu(jacobian.evaluate(grid.V))
+        # unit increase (kW or kvar) of the demand at each load bus
+        buses, load_bus = np.unique(grid.load_bus, return_inverse=True)
+        rhs = np.zeros((jacobian.shape[0], 2 * len(buses)))
+        columns = np.arange(len(buses))
+        rows = jacobian.p_row[buses]
+        rhs[rows[rows >= 0], columns[rows >= 0]] = -1e-3 / grid.base_mva
+        rows = jacobian.q_row[buses]
+        rhs[rows[rows >= 0], len(buses) + columns[rows >= 0]] = -1e-3 / grid.base_mva
+        dx = lu.solve(rhs)
+        # voltage magnitude changes of PQ buses, nil at PV and slack buses
+        dvm = np.zeros((grid.n, 2 * len(buses)))
+        dvm[grid.pq] = dx[jacobian.npvpq:]
+        dvm = np.where(grid.in_service[:, None], dvm[grid.bus_lookup], 0)
+        load = grid.net.load
+        active = load.in_service.values * load.scaling.values
+        self.dvm_dp = dvm[:, load_bus] * active
+        self.dvm_dq = dvm[:, len(buses) + load_bus] * active
+        self.V = grid.V
+        self.computations += 1
+
+    def rebase(self):
+        """ Start estimating from the grid's last solution and net.load's setpoints """
+        grid = self.grid
+        with self._lock:
+            if self.V is None or np.abs(np.abs(grid.V) - np.abs(self.V)).max() > self.drift:
+                self.compute()
+            self.vm_pu = grid.vm_pu.copy()
+            self.p_kw = grid.net.load['p_kw'].values.astype(float)
+            self.q_kvar = grid.net.load['q_kvar'].values.astype(float)
+
+    def set_load(self, name, p_kw, q_kvar):
+        """ Account for a new setpoint of load name
+
+        :returns: estimated voltage magnitude (p.u.) at the load
+        :rtype: float
+        """
+        row = self.grid.load_rows[name]
+        with self._lock:
+            return self._shift(row, p_kw - self.p_kw[row], q_kvar - self.q_kvar[row])
+
+    def shift_load(self, row, dp_kw, dq_kvar):
+        """ Account for a change of the setpoint of net.load row, e.g. by one of its agents
+
+        :returns: estimated voltage magnitude (p.u.) at the load
+        :rtype: float
+        """
+        with self._lock:
+            return self._shift(row, dp_kw, dq_kvar)
+
+    def _shift(self, row, dp, dq):
+        # unbounded setpoints aren't accounted for
+        if (dp or dq) and np.isfinite(dp) and np.isfinite(dq):
+            self.vm_pu += self.dvm_dp[:, row] * dp + self.dvm_dq[:, row] * dq
+            self.p_kw[row] += dp
+            self.q_kvar[row] += dq
+        return self.vm_pu[self.grid.load_bus_rows[row]].item()
+
+    @property
+    def load_vm_pu(self):
+        """ Estimated voltage magnitude (p.u.) at each net.load row """
+        with self._lock:
+            return self.vm_pu[self.grid.load_bus_rows]
+
+
+class AgentLoads(object):
+    """ Agents sharing net.load rows, so that the agent population doesn't grow the electrical model.
+
+    Each agent has a net.load row, a weight (multiplicity, e.g. the number of identical consumers
+    it stands for) and a setpoint. Before each solve, rows with agents get the weighted sum of
+    their agents' setpoints, other rows keep their own.
+
+    :param net: pandapower network
+    """
+    def __init__(self, net):
+        self.net = net
+        self.names = []
+        self.slots = {}
+        self.rows = np.zeros(0, dtype=int)
+        self.weights = np.zeros(0)
+        self.p_kw = np.zeros(0)
+        self.q_kvar = np.zeros(0)
+        # setpoints accounted for by voltage estimates since the last solve
+        self.estimated_p_kw = np.zeros(0)
+        self.estimated_q_kvar = np.zeros(0)
+        self.changed = False
+        self._members = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names, rows, weights=1.0, p_kw=None, q_kvar=None):
+        """ Add agents on net.load rows
+
+        :param names: names (addresses) of the agents
+        :param rows: net.load row (position) of each agent
+        :param weights: multiplicity of each agent's setpoint in its row
+        :param p_kw: initial setpoints, their row's p_kw if None
+        :param q_kvar: same for reactive power
+        """
+        names = list(names)
+        n = len(names)
+        duplicates = [name for name in names if name in self.slots]
+        if duplicates or len(set(names)) != n:
+            raise ValueError("agents added twice: {}".format(duplicates or names))
+        load = self.net.load
+        rows = np.broadcast_to(np.asarray(rows, dtype=int), n)
+        if n and not ((rows >= 0) & (rows < len(load))).all():
+            raise IndexError("agent rows out of net.load")
+        p_kw = load['p_kw'].values[rows] if p_kw is None else np.broadcast_to(p_kw, n)
+        q_kvar = load['q_kvar'].values[rows] if q_kvar is None else np.broadcast_to(q_kvar, n)
+        self.slots.update((name, len(self.names) + i) for i, name in enumerate(names))
+        self.names.extend(names)
+        self.rows = np.concatenate((self.rows, rows))
+        self.weights = np.concatenate((self.weights, np.broadcast_to(np.asarray(weights, dtype=float), n)))
+        self.p_kw = np.concatenate((self.p_kw, p_kw.astype(float)))
+        self.q_kvar = np.concatenate((self.q_kvar, q_kvar.astype(float)))
+        self.estimated_p_kw = self.p_kw.copy()
+        self.estimated_q_kvar = self.q_kvar.copy()
+        self.changed = True
+        self._members = None
+
+    def row(self, name):
+        """ net.load row of agent name """
+        return self.rows[self.slots[name]].item()
+
+    def members(self, row):
+        """ Slots of the agents of net.load row """
+        if self._members is None:
+            order = np.argsort(self.rows, kind='stable')
+            bounds = np.searchsorted(self.rows[order], np.arange(len(self.net.load) + 1))
+            self._members = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.net.load))]
+        return self._members[row]
+
+    def set(self, name, p_kw, q_kvar):
+        """ Setpoint of agent name
+
+        :returns: whether it changed
+        :rtype: bool
+        """
+        slot = self.slots[name]
+        if self.p_kw[slot] == p_kw and self.q_kvar[slot] == q_kvar:
+            return False
+        self.p_kw[slot], self.q_kvar[slot] = p_kw, q_kvar
+        self.changed = True
+        return True
+
+    def set_all(self, p_kw, q_kvar):
+        """ Setpoints of all the agents, in slot order """
+        self.p_kw[:], self.q_kvar[:] = p_kw, q_kvar
+        self.changed = True
+
+    def estimate(self, name, p_kw, q_kvar):
+        """ Change of its row's setpoint since the last estimate or solve when agent name
+        takes setpoint p_kw, q_kvar, which isn't applied
+
+        :returns: net.load row, p_kw and q_kvar changes
+        :rtype: tuple
+        """
+        slot = self.slots[name]
+        weight = self.weights[slot]
+        dp, dq = weight * (p_kw - self.estimated_p_kw[slot]), weight * (q_kvar - self.estimated_q_kvar[slot])
+        self.estimated_p_kw[slot], self.estimated_q_kvar[slot] = p_kw, q_kvar
+        return self.rows[slot].item(), dp, dq
+
+    def demand(self):
+        """ Weighted sums of the agents' setpoints by net.load row, and the mask of rows with agents """
+        n = len(self.net.load)
+        used = np.bincount(self.rows, minlength=n) > 0
+        return (np.bincount(self.rows, self.weights * self.p_kw, minlength=n),
+                np.bincount(self.rows, self.weights * self.q_kvar, minlength=n), used)
+
+    def apply(self):
+        """ Write the agents' setpoints into net.load, if they changed since the last call """
+        if not self.changed:
+            return
+        self.changed = False
+        load = self.net.load
+        p_kw, q_kvar, used = self.demand()
+        load['p_kw'] = np.where(used, p_kw, load['p_kw'].values)
+        load['q_kvar'] = np.where(used, q_kvar, load['q_kvar'].values)
+        self.estimated_p_kw = self.p_kw.copy()
+        self.estimated_q_kvar = self.q_kvar.copy()
+
+    def vm_pu(self, grid):
+        """ Voltage magnitude (p.u.) of each agent's load, from grid's last solution """
+        return grid.load_vm_pu[self.rows]
+
+
+# Solver of the scenario worker processes
+_scenario_solver = None
+
+
+def _init_scenario_worker(solver):
+    global _scenario_solver
+    _scenario_solver = solver
+
+
+def _solve_scenario_chunk(p_kw, q_kvar):
+    return solve_scenarios(_scenario_solver, p_kw, q_kvar)
+
+
+def solve_scenarios(solver, p_kw, q_kvar):
+    """ Voltage magnitudes of load scenarios, from the last solution of solver's grid
+
+    :param solver: RadialPowerFlow or NewtonPowerFlow
+    :param p_kw: load setpoints, scenarios x net.load rows
+    :param q_kvar: same for reactive power
+    :returns: voltage magnitudes, scenarios x net.bus rows (NaN for scenarios not converging)
+    """
+    grid = solver.grid
+    S = grid.fixed_injection[:, None] - grid.load_demand(p_kw.T, q_kvar.T)
+    return grid.voltage_magnitudes(solver.solve_many(S, grid.V))
+
+
+class PowerFlow(object):
+    """ Power flow of net with the fastest solver supporting it.
+    Results are the arrays and tables of grid (CompiledGrid), net.res_* are only updated on grid.update_net().
+    The grid is compiled again, and the solver's cached factors dropped, when the topology or
+    parameters of net change (see STRUCTURE).
+
+    :param net: pandapower network
+    :param radial: try the radial sweep
+    :param check_structure: look for changes of STRUCTURE before each solve, else call compile() after changes
+    """
+    def __init__(self, net, radial=True, check_structure=True, **kwargs):
+        self.net = net
+        self.radial = radial
+        self.check_structure = check_structure
+        self.kwargs = kwargs
+        self.compilations = 0
+        self.agents = None
+        self._sensitivity = None
+        self._lock = Lock()
+        self.compile()
+
+    def compile(self):
+        net = self.net
+        self.grid = grid = CompiledGrid(net)
+        self.compilations += 1
+        self._sensitivity = None
+        self.solver = None
+        if net.load.const_z_percent.any() or net.load.const_i_percent.any():
+            logger.info("falling back to pandapower power flow: voltage dependent loads")
+            self.solver = PandapowerPowerFlow(grid)
+        elif self.radial:
+            try:
+                self.solver = RadialPowerFlow(grid, **self.kwargs)
+            except UnsupportedNetwork as e:
+                logger.info("solving by Newton-Raphson: {}".format(e))
+        if self.solver is None:
+            self.solver = NewtonPowerFlow(grid)
+
+    def add_agents(self, names, rows, weights=1.0, p_kw=None, q_kvar=None):
+        """ Map agents onto net.load rows instead of adding rows, see AgentLoads.add
+
+        :rtype: AgentLoads
+        """
+        if self.agents is None:
+            self.agents = AgentLoads(self.net)
+        self.agents.add(names, rows, weights, p_kw, q_kvar)
+        return self.agents
+
+    def run(self):
+        """ Solve with the current loads of net, and of its agents
+
+        :returns: voltage magnitude (p.u.) of each net.bus row, NaN for out of service buses
+        :rtype: numpy.ndarray
+        """
+        if self.agents is not None:
+            self.agents.apply()
+        if self.check_structure and structure_signature(self.net) != self.grid.signature:
+            logger.info("network changed, compiling it again")
+            self.compile()
+        self.grid.update(self.solver.solve())
+        if self._sensitivity is not None:
+            self._sensitivity.rebase()
+        return self.grid.vm_pu
+
+    def run_scenarios(self, p_kw, q_kvar=None, workers=1, chunk_size=256):
+        """ Solve load scenarios at once, sharing the compiled grid, without changing net or the last solution.
+        Scenarios are solved by chunks, in worker processes if workers > 1.
+
+        :param p_kw: load setpoints, scenarios x net.load rows
+        :param q_kvar: same for reactive power, net.load's q_kvar if None
+        :param workers: number of worker processes
+        :param chunk_size: number of scenarios solved at once
+        :returns: voltage magnitudes, scenarios x net.bus rows (NaN for scenarios not converging)
+        :rtype: numpy.ndarray
+        """
+        load = self.net.load
+        p_kw = np.atleast_2d(np.asarray(p_kw, dtype=float))
+        if q_kvar is None:
+            q_kvar = np.broadcast_to(load['q_kvar'].values.astype(float), p_kw.shape)
+        q_kvar = np.atleast_2d(np.asarray(q_kvar, dtype=float))
+        if p_kw.shape != q_kvar.shape or p_kw.shape[1] != len(load):
+            raise ValueError("setpoints must be scenarios x {} loads".format(len(load)))
+        if self.check_structure and structure_signature(self.net) != self.grid.signature:
+            self.compile()
+        if isinstance(self.solver, PandapowerPowerFlow):
+            return self._run_scenarios_pandapower(p_kw, q_kvar)
+        chunks = max(workers, -(-len(p_kw) // chunk_size))
+        p_chunks, q_chunks = np.array_split(p_kw, chunks), np.array_split(q_kvar, chunks)
+        if workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_scenario_worker, initargs=(self.solver,)) as executor:
+                results = list(executor.map(_solve_scenario_chunk, p_chunks, q_chunks))
+        else:
+            results = [solve_scenarios(self.solver, p, q) for p, q in zip(p_chunks, q_chunks)]
+        return np.concatenate(results)
+
+    def _run_scenarios_pandapower(self, p_kw, q_kvar):
+        net = self.net
+        saved = net.load[['p_kw', 'q_kvar']].copy()
+        vm_pu = np.full((len(p_kw), len(net.bus)), np.nan)
+        try:
+            for i in range(len(p_kw)):
+                net.load['p_kw'], net.load['q_kvar'] = p_kw[i], q_kvar[i]
+                try:
+                    vm_pu[i] = self.grid.voltage_magnitudes(self.solver.solve()[:, None])[0]
+                except LoadflowNotConverged:
+                    pass
+        finally:
+            net.load[['p_kw', 'q_kvar']] = saved
+        return vm_pu
+
+    @property
+    def sensitivity(self):
+        """ VoltageSensitivity of the grid, created on first use and rebased after each solve """
+        if self._sensitivity is None:
+            with self._lock:
+                if self._sensitivity is None:
+                    self._sensitivity = VoltageSensitivity(self.grid)
+        return self._sensitivity
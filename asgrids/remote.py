@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batched control of remote nodes.
+
+Driving remote nodes through rpyc netrefs costs a round trip per attribute access.
+Instead, commands for all the nodes of a host are collected in a RemoteBatch,
+pickled and applied in one call by the host's NodeController, which returns all
+the results at once. Values are pickled, so callables must be importable remotely.
+"""
+
+import pickle
+
+NODE_CLASSES = {'load': 'NetworkLoad', 'allocator': 'NetworkAllocator', 'aggregator': 'NetworkAggregator'}
+
+
+class RemoteBatch(object):
+    """ Commands to apply to the nodes of a host. addr=None applies a command to all of them """
+    def __init__(self):
+        self.commands = []
+
+    def create(self, ntype, addr, mode='udp', **config):
+        """ Create a node of ntype at addr, then set its config attributes """
+        self.commands.append(('create', addr, ntype, dict(config, mode=mode)))
+        return self
+
+    def set(self, addr, **attributes):
+        self.commands.append(('set', addr, None, attributes))
+        return self
+
+    def get(self, addr, attribute):
+        self.commands.append(('get', addr, attribute, None))
+        return self
+
+    def call(self, addr, method, *args):
+        self.commands.append(('call', addr, method, list(args)))
+        return self
+
+    def schedule(self, addr, method, args=None, delay=0):
+        """ Schedule the node's method on its own loop """
+        self.commands.append(('schedule', addr, method, [args or [], delay]))
+        return self
+
+    def stats(self, addr=None):
+        """ Join state and metrics snapshot """
+        self.commands.append(('stats', addr, None, None))
+        return self
+
+    def __len__(self):
+        return len(self.commands)
+
+
+class NodeController(object):
+    """ Remote side of RemoteBatch, keeps the nodes of a host """
+    def __init__(self, nodes=None):
+        self.nodes = {} if nodes is None else nodes
+
+    def handle(self, data):
+        """ Apply a pickled list of commands and return the pickled [ok, result] of each command.
+        A failed command doesn't prevent the next ones, its result is the error's repr.
+        """
+        commands = pickle.loads(data)
+        results = [self.apply(*command) for command in commands]
+        try:
+            return pickle.dumps(results)
+        except Exception:
+            return pickle.dumps([self.picklable(result) for result in results])
+
+    @staticmethod
+    def picklable(result):
+        try:
+            pickle.dumps(result)
+            return result
+        except Exception as e:
+            return [False, "can't pickle {!r}: {!r}".format(result[1], e)]
+
+    def apply(self, op, addr, name, value):
+        try:
+            if op == 'create':
+                return [True, self.create(addr, name, value)]
+            if addr is None:
+                return [True, {a: self.apply_node(op, node, name, value) for a, node in list(self.nodes.items())}]
+            return [True, self.apply_node(op, self.nodes[addr], name, value)]
+        except Exception as e:
+            return [False, repr(e)]
+
+    def create(self, addr, ntype, config):
+        import asgrids
+        config = dict(config)
+        node = getattr(asgrids, NODE_CLASSES[ntype])(mode=config.pop('mode', 'udp'))
+        node.local = addr
+        for attribute, v in config.items():
+            setattr(node, attribute, v)
+        self.nodes[addr] = node
+        return addr
+
+    @staticmethod
+    def apply_node(op, node, name, value):
+        if op == 'set':
+            for attribute, v in value.items():
+                setattr(node, attribute, v)
+            return None
+        if op == 'get':
+            return getattr(node, name)
+        if op == 'call':
+            return getattr(node, name)(*value)
+        if op == 'schedule':
+            args, delay = value
+            node.schedule(getattr(node, name), args=args, delay=delay)
+            return None
+        if op == 'stats':
+            return {'remote': getattr(node, 'remote', None), 'running': node.is_running.is_set(),
+                    'metrics': node.metrics.snapshot()}
+        raise ValueError(op)
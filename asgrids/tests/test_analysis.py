@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from ..analysis import RunAnalysis, analyze_runs
+
+LOG = ['LOAD 100.0\tpv1\t-10\n',
+       'VOLTAGE 100.0\tbus1\t1.00\n',
+       'VOLTAGE 100.0\tbus2\t1.06\n',
+       'LOAD 101.0\tpv1\t-20\n',
+       'VOLTAGE 101.0\tbus1\t1.06\n',
+       'VOLTAGE 101.0\tbus2\t1.06\n',
+       'LOAD 102.0\tload1\t5\n',
+       'LOAD 400.0\tpv1\t-30\n',
+       'VOLTAGE 103.0\tbus1\t1.04\n']
+
+
+def test_run_analysis():
+    analysis = RunAnalysis(max_vm=1.05, horizon=200, reference=100)
+    # Chunk boundaries don't change the result
+    analysis.feed(LOG[:4])
+    analysis.feed(LOG[4:])
+    summary = analysis.summary()
+    assert summary['samples'] == 5
+    assert summary['violations'] == 3
+    assert summary['violation_rate'] == 3 / 5
+    # trapezoids over zeroed voltages below max_vm
+    assert abs(summary['time_above']['bus1'] - (0.5 * 1.06 + 0.5 * 1.06 * 2)) < 1e-9
+    assert abs(summary['time_above']['bus2'] - 1.06) < 1e-9
+    # record past the horizon and consuming loads are left out
+    assert summary['production'] == -30
+    assert abs(summary['production_loss'] - 0.7) < 1e-9
+
+
+def test_analyze_runs_cache(tmpdir):
+    log = str(tmpdir.join('sim.log'))
+    index = str(tmpdir.join('index.json'))
+    with open(log, 'w') as f:
+        f.writelines(LOG)
+    summaries = analyze_runs([log, str(tmpdir.join('missing.log'))], index=index, reference=100)
+    assert list(summaries) == [log]
+    assert os.path.exists(index)
+    # Cached summaries are used until the log changes
+    assert analyze_runs([log], index=index, reference=100) == summaries
+    with open(log, 'a') as f:
+        f.write('VOLTAGE 104.0\tbus1\t1.07\n')
+    assert analyze_runs([log], index=index, reference=100)[log]['samples'] == 6
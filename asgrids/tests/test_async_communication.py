@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import socket
+import tempfile
+from time import monotonic as time, sleep
+
+import pytest
+
+from .. import async_udp_communication
+from ..async_communication import endpoint
+from ..async_udp_communication import AsyncUdp, kernel_drops
+from ..defs import Allocation, Packet
+from ..network_allocator import NetworkAllocator, ShardedAllocator
+from ..network_load import NetworkLoad
+
+
+def test_endpoint():
+    assert endpoint('127.0.0.1:5000') == 'tcp://127.0.0.1:5000'
+    assert endpoint('127.0.0.1:5000', 'inproc') == 'inproc://127.0.0.1:5000'
+    assert endpoint('127.0.0.1:5000', 'ipc') == 'ipc://' + os.path.join(tempfile.gettempdir(), 'asgrids-127.0.0.1:5000')
+    # Explicit schemes win over the mode's
+    assert endpoint('ipc:///tmp/allocator', 'tcp') == 'ipc:///tmp/allocator'
+    with pytest.raises(ValueError):
+        endpoint('udp://127.0.0.1:5000')
+
+
+def test_inproc_group():
+    group = 'pi-group'
+    allocator = NetworkAllocator('127.0.0.1:5100', mode='inproc')
+    allocator.host_group(group)
+    allocator.run()
+    loads = []
+    for port in range(5101, 5104):
+        load = NetworkLoad('127.0.0.1:{}'.format(port), mode='inproc')
+        load.rated_allocation = Allocation(p_value=-30, q_value=0)
+        load.join_group(group)
+        load.run()
+        loads.append(load)
+    try:
+        deadline = time() + 10
+        sent = 0
+        # Subscriptions are set up asynchronously, publish until all loads got the allocation
+        while time() < deadline and any(load.curr_allocation.p_value != -15 for load in loads):
+            allocator.send_group_allocation(group, Allocation(0, 0.5, 0, 10))
+            sent += 1
+            sleep(0.1)
+        assert [load.curr_allocation for load in loads] == [Allocation(0, -15, 0, 10)] * 3
+        # A single packet per cycle, whatever the number of loads
+        sleep(0.2)
+        assert allocator.metrics.get('sent', 'group_allocation') == sent
+    finally:
+        for agent in loads + [allocator]:
+            agent.stop()
+
+
+def test_udp_group():
+    group = '239.255.0.1:5150'
+    allocator = NetworkAllocator('127.0.0.1:5150')
+    allocator.run()
+    loads = []
+    for port in range(5151, 5154):
+        load = NetworkLoad('127.0.0.1:{}'.format(port))
+        load.rated_allocation = Allocation(p_value=-30, q_value=0)
+        load.join_group(group)
+        load.run()
+        loads.append(load)
+    # Not a member
+    other = NetworkLoad('127.0.0.1:5154')
+    other.run()
+    try:
+        allocator.send_group_allocation(group, Allocation(0, 0.5, 0, 10))
+        assert wait_for(lambda: all(load.curr_allocation.p_value == -15 for load in loads))
+        assert [load.curr_allocation for load in loads] == [Allocation(0, -15, 0, 10)] * 3
+        assert other.curr_allocation == Allocation()
+        # A single datagram, copied to each member
+        assert allocator.metrics.get('sent', 'group_allocation') == 1
+        assert all(load.metrics.get('received', 'group_allocation') == 1 for load in loads)
+    finally:
+        for agent in loads + [other, allocator]:
+            agent.stop()
+
+
+@pytest.mark.parametrize('shards', [1, 2])
+def test_udp_group_without_multicast(shards):
+    group = '239.255.0.1:5160'
+    allocators = [NetworkAllocator('127.0.0.1:{}'.format(port)) for port in range(5160, 5160 + shards)]
+    for allocator in allocators:
+        allocator.comm.multicast = False
+        allocator.run()
+    allocator = allocators[0] if shards == 1 else ShardedAllocator(allocators)
+    loads = []
+    for port in range(5171, 5175):
+        load = NetworkLoad('127.0.0.1:{}'.format(port))
+        load.comm.multicast = False
+        load.rated_allocation = Allocation(p_value=-30, q_value=0)
+        load.join_group(group)
+        load.run()
+        loads.append(load)
+    try:
+        assert all(load.comm.groups == [] for load in loads)
+        # Sent to each member, by the shard in charge of it
+        allocator.send_group_allocation(group, Allocation(0, 0.5, 0, 10), [load.local for load in loads[:3]])
+        assert wait_for(lambda: all(load.curr_allocation.p_value == -15 for load in loads[:3]))
+        assert loads[3].curr_allocation == Allocation()
+        assert sum(shard.metrics.get('sent', 'group_allocation') for shard in allocators) == 3
+    finally:
+        for agent in loads + allocators:
+            agent.stop()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time() + timeout
+    while time() < deadline and not predicate():
+        sleep(0.01)
+    return predicate()
+
+
+def start_udp(address, **settings):
+    received = []
+    comm = AsyncUdp(address, callback=received.append)
+    for name, value in settings.items():
+        setattr(comm, name, value)
+    comm.start()
+    assert comm.ready.wait(5)
+    return comm, received
+
+
+def test_udp_bulk_receive():
+    receiver, received = start_udp('127.0.0.1:5200', bulk=True, batch_size=8, rcvbuf=2 ** 20)
+    sender, _ = start_udp('127.0.0.1:5201')
+    try:
+        n = 50
+        for i in range(n):
+            sender.send(Packet('allocation', Allocation(i, i, 0, 1), src=sender._local_address), receiver._local_address)
+        assert wait_for(lambda: len(received) == n)
+        assert sorted(p.payload.aid for p in received) == list(range(n))
+        # Drained several datagrams per wakeup, none dropped
+        assert 0 < receiver.metrics.get('batches') <= n
+        assert receiver.metrics.get('received', 'allocation') == n
+        counters = receiver.drop_counters()
+        assert counters['decode_errors'] == counters['not_running'] == 0
+        assert counters['kernel_drops'] is None or counters['kernel_drops'] == 0
+
+        # Garbage is counted, not handed over
+        garbage = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        garbage.sendto(b'\xc1', ('127.0.0.1', 5200))
+        garbage.close()
+        assert wait_for(lambda: receiver.metrics.get('decode_errors') == 1)
+        assert len(received) == n
+    finally:
+        receiver.stop()
+        sender.stop()
+
+
+def test_udp_receivers():
+    receiver, received = start_udp('127.0.0.1:5210', receivers=2)
+    try:
+        assert len(receiver._socks) == 2
+        assert all(sock.getsockname() == ('127.0.0.1', 5210) for sock in receiver._socks)
+        counters = receiver.drop_counters()
+        assert all(value is None or isinstance(value, int) for value in counters.values())
+    finally:
+        receiver.stop()
+
+
+def test_kernel_drops(monkeypatch):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    inode = os.fstat(sock.fileno()).st_ino
+    header = '  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref ' \
+             'pointer drops\n'
+    line = '  {}: 0100007F:1450 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 {} 2 ' \
+           '0000000000000000 {}\n'
+    files = {'/proc/net/udp': header + line.format(0, inode + 1, 5),
+             '/proc/net/udp6': header + line.format(0, inode, 7)}
+    try:
+        # Matched on the inode column, in udp6 when not in udp
+        monkeypatch.setattr(async_udp_communication, 'open', lambda path: io.StringIO(files[path]), raising=False)
+        assert kernel_drops(sock) == 7
+        files['/proc/net/udp6'] = header
+        assert kernel_drops(sock) is None
+
+        def unavailable(path):
+            raise OSError(path)
+        monkeypatch.setattr(async_udp_communication, 'open', unavailable, raising=False)
+        assert kernel_drops(sock) is None
+    finally:
+        sock.close()
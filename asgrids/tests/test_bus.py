@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from time import monotonic as time
+
+from ..bus import GridStateBus, PowerFlowTrigger
+
+
+def test_grid_state_bus():
+    bus = GridStateBus(['a', 'b', 'c'])
+    assert not bus.changed().any()
+    bus.write_setpoint(bus.slot('b'), -10, 1)
+    assert bus.read_setpoint(1) == (-10, 1)
+    p, q, changed = bus.consume_setpoints()
+    assert changed.tolist() == [False, True, False]
+    assert p[1] == -10 and q[1] == 1
+    assert not bus.consume_setpoints()[2].any()
+
+    assert bus.new_voltage(0) is None
+    bus.publish_voltages([1.0, 1.02, 1.04])
+    assert bus.new_voltage(2) == 1.04
+    # Only once per publication
+    assert bus.new_voltage(2) is None
+    assert bus.read_voltage(2)[0] == 1.04
+
+
+def write_setpoint(bus):
+    bus.write_setpoint(bus.slot('b'), -20, 0)
+
+
+def test_shared_grid_state_bus():
+    bus = GridStateBus(['a', 'b'], shared=True)
+    process = multiprocessing.get_context('fork').Process(target=write_setpoint, args=[bus])
+    process.start()
+    process.join()
+    assert bus.consume_setpoints()[0].tolist() == [0, -20]
+    bus.close(unlink=True)
+
+
+def test_power_flow_trigger():
+    trigger = PowerFlowTrigger(threshold=10, max_staleness=0.2, coalesce=0.05)
+    bus = GridStateBus(['a', 'b'])
+    bus.trigger = trigger
+    # No change, no solve
+    assert not trigger.wait(timeout=0.05)
+    # A burst above threshold is solved once, after the coalescing window
+    start = time()
+    bus.write_setpoint(0, -6, 0)
+    bus.write_setpoint(1, -6, 0)
+    assert trigger.wait(timeout=1)
+    assert 0.05 <= time() - start < 0.2
+    assert trigger.solves == {'threshold': 1, 'staleness': 0}
+    # Small changes wait for the staleness deadline
+    start = time()
+    bus.write_setpoint(0, -7, 0)
+    bus.write_setpoint(0, -7, 0)
+    assert trigger.wait(timeout=1)
+    assert time() - start >= 0.2
+    assert trigger.solves == {'threshold': 1, 'staleness': 1}
+    trigger.stop()
+    assert not trigger.wait()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import pickle
+from copy import deepcopy
+
+from ..agent import ErrorModel
+from ..channel import ChannelModel, Link
+from ..defs import Allocation, Packet
+from ..network_load import NetworkLoad
+
+
+def fates(model, src, dst, n):
+    return [model.on_send(None, src, dst) for _ in range(n)]
+
+
+def test_seeded_links():
+    model = ChannelModel(default=Link(loss=0.2, delay=0.05, jitter=0.01), seed=1, block=100)
+    a = fates(model, 'a', 'b', 1000)
+    # Each link has its own reproducible stream, whatever the other links' traffic
+    other = ChannelModel(default=Link(loss=0.2, delay=0.05, jitter=0.01), seed=1, block=100)
+    fates(other, 'a', 'c', 10)
+    assert fates(other, 'a', 'b', 1000) == a
+    assert fates(ChannelModel(default=Link(loss=0.2), seed=2), 'a', 'b', 1000) != a
+    losses = sum(drop for drop, _ in a)
+    assert 150 < losses < 250
+    assert all(0.04 <= delay <= 0.06 for _, delay in a)
+    assert not model.on_receive(None)
+
+
+def test_link_lookup():
+    model = ChannelModel(seed=1)
+    assert model.on_send(None, 'a', 'b') == (False, 0)
+    model.set_link(None, 'b', Link(loss=1))
+    assert all(drop for drop, _ in fates(model, 'a', 'b', 10))
+    model.set_link('a', 'b', Link(loss=0))
+    assert not any(drop for drop, _ in fates(model, 'a', 'b', 10))
+    assert all(drop for drop, _ in fates(model, 'c', 'b', 10))
+
+
+def test_burst_losses():
+    # Same mean loss rate as Bernoulli 20%, but in bursts
+    model = ChannelModel(default=Link(loss=0, burst_enter=0.05, burst_exit=0.2), seed=3)
+    drops = [drop for drop, _ in fates(model, 'a', 'b', 20000)]
+    assert 0.15 < sum(drops) / len(drops) < 0.25
+    runs = sum(1 for i in range(1, len(drops)) if drops[i] and not drops[i - 1])
+    assert sum(drops) / runs > 3
+
+
+def test_error_model():
+    assert ErrorModel(rate=1.0).on_send(None, 'a', 'b') == (False, 0)
+    assert ErrorModel(rate=0.0).on_send(None, 'a', 'b') == (True, 0)
+    # Dropped once, on the send side: the one hop loss is 1 - rate
+    model = ErrorModel(rate=0.9, seed=1)
+    drops = [model.on_send(None, 'a', 'b')[0] for _ in range(20000)]
+    assert 0.09 < sum(drops) / len(drops) < 0.11
+    assert not ErrorModel(rate=0.0).on_receive(None)
+
+
+def test_copy():
+    model = ChannelModel(default=Link(loss=0.2, delay=0.05, jitter=0.01), seed=1, block=100)
+    a = fates(model, 'a', 'b', 100)
+    # copies replay the streams from the seed
+    assert fates(pickle.loads(pickle.dumps(model)), 'a', 'b', 100) == a
+    assert fates(deepcopy(model), 'a', 'b', 100) == a
+
+
+def test_group_fates():
+    # Each member of a group applies its own link from the publisher
+    channel = ChannelModel(seed=1)
+    channel.set_link('127.0.0.1:5001', '127.0.0.1:5010', Link(loss=1.0))
+    group = '239.255.0.1:5100'
+    nodes = []
+    for local in ('127.0.0.1:5010', '127.0.0.1:5011'):
+        node = NetworkLoad(local=local)
+        node.logger = logging.getLogger(__name__)
+        node.rated_allocation = Allocation(p_value=-30, q_value=0)
+        node.join_group(group)
+        node.error_model = channel
+        node.handle_receive(Packet('group_allocation', [group, Allocation(3, 0.5, 0, 10)],
+                                   src='127.0.0.1:5001', dst=group))
+        nodes.append(node)
+    assert nodes[0].curr_allocation == Allocation()
+    assert nodes[1].curr_allocation == Allocation(3, -15, 0, 10)
+    assert nodes[0].metrics.get('dropped_group', 'group_allocation') == 1
+    assert nodes[1].metrics.get('dropped_group', 'group_allocation') == 0
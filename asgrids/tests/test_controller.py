@@ -136,3 +136,17 @@ def test_pi_controller():
                     assert np.isclose(percent_curtailed, a.p_value / generator_maximum_powers[i])
             else:
                 assert a.p_value == generator_maximum_powers[i]  # no over-voltage in the network so no curtailment
+
+
+def test_group_allocation():
+    generator_maximum_powers = [-5000, -10000]
+    controller = PIController(maximum_voltage=250, duration=10)
+    group_controller = PIController(maximum_voltage=250, duration=10)
+    for v in (240, 255, 260, 245):
+        _, ga = controller.generate_allocations([v], [v, v - 5], [1000], generator_maximum_powers)
+        a = group_controller.generate_group_allocation([v], [v, v - 5])
+        assert a.duration == 10
+        assert 0 <= a.p_value <= 1
+        for allocation, p_max in zip(ga, generator_maximum_powers):
+            assert allocation.p_value == a.p_value * p_max
+    assert a.p_value < 1
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..defs import HashRing
+
+
+def test_hash_ring():
+    shards = ['127.0.0.1:{}'.format(port) for port in range(4000, 4004)]
+    nodes = ['127.0.0.1:{}'.format(port) for port in range(5000, 7000)]
+    ring = HashRing(shards)
+    assert HashRing().get(nodes[0]) is None
+    assert ring.shards == shards
+
+    owners = {nid: ring.get(nid) for nid in nodes}
+    # Deterministic across instances
+    assert owners == {nid: HashRing(reversed(shards)).get(nid) for nid in nodes}
+    # All shards get a fair share of nodes
+    for shard in shards:
+        assert list(owners.values()).count(shard) > len(nodes) / len(shards) / 2
+
+    # Removing a shard only moves its own nodes
+    ring.remove(shards[0])
+    for nid in nodes:
+        if owners[nid] != shards[0]:
+            assert ring.get(nid) == owners[nid]
+        else:
+            assert ring.get(nid) in shards[1:]
+    ring.add(shards[0])
+    assert owners == {nid: ring.get(nid) for nid in nodes}
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from types import SimpleNamespace
+
+import asgrids
+from .. import deploy
+from ..channel import ChannelModel, Link
+from ..deploy import PACKAGE_HASH_FILE, SmartGridSimulation
+
+
+class FakeConnection(object):
+    """ rpyc classic connection evaluating code locally, site-packages being site """
+    def __init__(self, site):
+        self.namespace = {}
+        self.closed = False
+        self.modules = SimpleNamespace(importlib=SimpleNamespace(invalidate_caches=lambda: None),
+                                       site=SimpleNamespace(getsitepackages=lambda: [site]))
+
+    def eval(self, code):
+        return eval(code, self.namespace)
+
+    def execute(self, code):
+        exec(code, self.namespace)
+
+    def close(self):
+        self.closed = True
+
+
+class Closable(object):
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    stop = close
+
+
+def test_join_nodes():
+    sim = SmartGridSimulation()
+    allocator = sim.create_node('allocator', '127.0.0.1:5300')
+    allocator.run()
+    try:
+        loads = sim.create_nodes('load', ['127.0.0.1:{}'.format(port) for port in range(5301, 5311)])
+        # The channel of the node carrying the batches doesn't apply to the others' joins
+        channel = ChannelModel()
+        channel.set_link(loads[0].local, allocator.local, Link(loss=1.0))
+        loads[0].error_model = channel
+        assert sim.join_nodes(loads, allocator.local, timeout=5, batch=4) == []
+        assert all(load.remote == allocator.local and load.joined.is_set() for load in loads)
+        assert sorted(allocator.nodes) == sorted(load.local for load in loads)
+    finally:
+        sim.stop()
+
+
+def test_package_hash(tmp_path, monkeypatch):
+    package = tmp_path / 'asgrids'
+    (package / 'sub').mkdir(parents=True)
+    (package / '__init__.py').write_text('a = 1\n')
+    (package / 'sub' / 'module.py').write_text('b = 2\n')
+    monkeypatch.setattr(asgrids, '__file__', str(package / '__init__.py'))
+    digest = SmartGridSimulation.package_hash()
+    assert SmartGridSimulation.package_hash() == digest
+
+    # Compiled files and the hash left by uploads are ignored
+    (package / '__pycache__').mkdir()
+    (package / '__pycache__' / 'module.cpython-37.pyc').write_bytes(b'\0')
+    (package / 'sub' / 'module.pyc').write_bytes(b'\0')
+    (package / PACKAGE_HASH_FILE).write_text(digest)
+    assert SmartGridSimulation.package_hash() == digest
+
+    # Contents and paths are hashed
+    (package / 'sub' / 'module.py').write_text('b = 3\n')
+    assert SmartGridSimulation.package_hash() != digest
+    (package / 'sub' / 'module.py').write_text('b = 2\n')
+    (package / 'sub' / 'module.py').rename(package / 'sub' / 'other.py')
+    assert SmartGridSimulation.package_hash() != digest
+
+
+def test_check_remote(tmp_path, monkeypatch):
+    uploads = []
+    monkeypatch.setattr(deploy.rpyc.classic, 'upload_package',
+                        lambda conn, module, path: uploads.append(path) or os.makedirs(path, exist_ok=True))
+    conn = FakeConnection(str(tmp_path))
+
+    # Uploaded when there's no hash, or a different one, remotely
+    assert not SmartGridSimulation.check_remote(conn, str(tmp_path), 'digest')
+    assert uploads == [str(tmp_path / 'asgrids')]
+    assert (tmp_path / 'asgrids' / PACKAGE_HASH_FILE).read_text() == 'digest'
+    assert SmartGridSimulation.check_remote(conn, str(tmp_path), 'digest')
+    assert len(uploads) == 1
+    assert not SmartGridSimulation.check_remote(conn, str(tmp_path), 'other')
+    assert len(uploads) == 2
+
+
+def test_remote_host(tmp_path, monkeypatch):
+    conns = []
+
+    def deployed_server(machine):
+        conn = FakeConnection(str(tmp_path))
+        conns.append(conn)
+        return SimpleNamespace(classic_connect=lambda: conn, close=lambda: None)
+
+    uploads = []
+    monkeypatch.setattr(deploy.rpyc.classic, 'upload_package',
+                        lambda conn, module, path: uploads.append(path) or os.makedirs(path, exist_ok=True))
+    monkeypatch.setattr(deploy, 'SshMachine', Closable)
+    monkeypatch.setattr(deploy, 'DeployedServer', deployed_server)
+    monkeypatch.setattr(deploy, 'BgServingThread', Closable)
+    sim = SmartGridSimulation()
+    sim._package_hash = 'digest'
+
+    # Deployed once per host
+    conn = sim.remote_host('host', 'user', None)
+    assert sim.remote_host('host', 'user', None) is conn
+    assert len(conns) == 1 and len(uploads) == 1
+    # Closed connections are dropped, the package isn't uploaded again
+    conn.close()
+    reconnected = sim.remote_host('host', 'user', None)
+    assert reconnected is not conn and len(conns) == 2
+    assert len(uploads) == 1
+    assert list(sim.controllers) == [reconnected]
+
+    # Not reused after stop
+    sim.stop()
+    assert sim.hosts == {} and sim.controllers == {}
+    assert sim.remote_host('host', 'user', None) is conns[2]
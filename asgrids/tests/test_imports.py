@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandapower', 'pandas', 'scipy', 'rpyc', 'plumbum', 'zmq', 'simpy']
+
+
+def imported_modules(statement):
+    """ Heavy modules imported by statement in a fresh interpreter """
+    code = "import sys\n{}\nprint(' '.join(m for m in {!r} if m in sys.modules))".format(statement, HEAVY_MODULES)
+    return subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split()
+
+
+def test_lazy_imports():
+    # Hosting agents over udp only needs the transport and agent code
+    assert imported_modules("import asgrids") == []
+    assert imported_modules("from asgrids import NetworkLoad, NetworkAllocator, NetworkAggregator, AsyncUdp, Packet\n"
+                            "NetworkLoad(local='127.0.0.1:5000')") == []
+    # tcp mode only pulls zmq
+    assert imported_modules("from asgrids import NetworkLoad\n"
+                            "NetworkLoad(local='127.0.0.1:5000', mode='tcp')") == ['zmq']
+    assert 'pandapower' in imported_modules("from asgrids import SmartGridSimulation")
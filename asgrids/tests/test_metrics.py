@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..metrics import Histogram, Metrics
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None
+    for i in range(1, 101):
+        histogram.observe(i * 1e-3)
+    assert histogram.count == 100
+    assert histogram.min == 1e-3 and histogram.max == 0.1
+    # Quantiles are bucket upper bounds, at most twice the exact value
+    for q in (0.5, 0.9, 0.99):
+        assert q * 0.1 <= histogram.quantile(q) <= 2 * q * 0.1
+    assert histogram.quantile(1) == 0.1
+    histogram.observe(1e3)
+    assert histogram.snapshot()['buckets'][-1] == [float("inf"), 1]
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics.count('sent', 'allocation')
+    metrics.count('sent', 'allocation')
+    metrics.count('sent', 'join')
+    metrics.count('decode_errors', n=3)
+    metrics.observe('decode_time', 1e-5)
+    metrics.gauge('queue', lambda: 4)
+    metrics.gauge('broken', lambda: 1 / 0)
+    assert metrics.get('sent') == 3
+    assert metrics.get('sent', 'allocation') == 2
+    assert metrics.get('received') == 0
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'sent': {'allocation': 2, 'join': 1}, 'decode_errors': {'None': 3}}
+    assert snapshot['histograms']['decode_time']['None']['count'] == 1
+    assert snapshot['gauges'] == {'queue': 4, 'broken': None}
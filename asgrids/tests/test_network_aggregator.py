@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from ..defs import Allocation, Packet
+from ..network_aggregator import NetworkAggregator
+from ..network_allocator import NetworkAllocator
+
+
+def stub(agent):
+    """ Record what agent sends instead of sending it, and don't schedule anything """
+    sent = []
+    agent.logger = logging.getLogger(__name__)
+    agent.send = lambda packet, remote: sent.append((packet, remote))
+    agent.schedule = lambda *args, **kwargs: None
+    return sent
+
+
+def test_aggregator():
+    aggregator = NetworkAggregator(local='127.0.0.1:5100', remote='127.0.0.1:5000')
+    sent = stub(aggregator)
+    aggregator.max_batch = 2
+
+    # Joins are acknowledged locally
+    aggregator.receive_handle(Packet('join', [Allocation(0, 1, 0, 1), None], src='127.0.0.1:5101',
+                                     dst='127.0.0.1:5100'))
+    assert sent == [(Packet('join_ack', src='127.0.0.1:5100', dst='127.0.0.1:5101'), '127.0.0.1:5101')]
+    # A join without allocation is acknowledged but not forwarded
+    aggregator.receive_handle(Packet('join', [None, None], src='127.0.0.1:5102', dst='127.0.0.1:5100'))
+    assert aggregator.nodes == {'127.0.0.1:5101', '127.0.0.1:5102'}
+    assert list(aggregator.pending) == ['127.0.0.1:5101']
+
+    # Only the latest report of each node is forwarded, max_batch reports per packet
+    for port in (5101, 5102, 5103):
+        for p in (2, 3):
+            report = [Allocation(0, p, 0, 1), Allocation(0, 10, 0, 1), 1.0]
+            aggregator.receive_handle(Packet('curr_allocation', report, src='127.0.0.1:{}'.format(port)))
+    del sent[:]
+    aggregator.forward_reports()
+    assert [(packet.ptype, packet.dst, remote) for packet, remote in sent] == \
+        [('curr_allocations', '127.0.0.1:5000', '127.0.0.1:5000')] * 2
+    assert [len(packet.payload) for packet, _ in sent] == [2, 1]
+    reports = dict(entry for packet, _ in sent for entry in packet.payload)
+    assert sorted(reports) == ['127.0.0.1:5101', '127.0.0.1:5102', '127.0.0.1:5103']
+    assert all(report[0].p_value == 3 for report in reports.values())
+    # Nothing new to forward
+    del sent[:]
+    aggregator.forward_reports()
+    assert sent == []
+
+    # Packets for other nodes are relayed to them
+    allocation = Packet('allocation', Allocation(1, 5, 0, 1), src='127.0.0.1:5000', dst='127.0.0.1:5101')
+    aggregator.receive_handle(allocation)
+    assert sent == [(allocation, '127.0.0.1:5101')]
+
+
+def test_allocator_routes():
+    allocator = NetworkAllocator(local='127.0.0.1:5000')
+    sent = stub(allocator)
+    report = [Allocation(0, 3, 0, 1), Allocation(0, 10, 0, 1), 1.0]
+    allocator.receive_handle(Packet('curr_allocations', [['127.0.0.1:5101', report], ['127.0.0.1:5102', report]],
+                                    src='127.0.0.1:5100', dst='127.0.0.1:5000'))
+    assert sorted(allocator.nodes) == ['127.0.0.1:5101', '127.0.0.1:5102']
+    assert allocator.route('127.0.0.1:5101') == '127.0.0.1:5100'
+    assert allocator.route('127.0.0.1:5200') == '127.0.0.1:5200'
+
+    # Allocations go through the aggregator
+    allocator.send_allocation('127.0.0.1:5101', Allocation(0, 5, 0, 1))
+    packet, remote = sent[-1]
+    assert (packet.ptype, packet.dst, remote) == ('allocation', '127.0.0.1:5101', '127.0.0.1:5100')
+
+    # A direct report replaces the route
+    allocator.receive_handle(Packet('curr_allocation', report, src='127.0.0.1:5102', dst='127.0.0.1:5000'))
+    assert allocator.route('127.0.0.1:5102') == '127.0.0.1:5102'
+    # Removed nodes lose their route
+    allocator.remove_node('127.0.0.1:5101')
+    assert allocator.route('127.0.0.1:5101') == '127.0.0.1:5101'
+    assert list(allocator.nodes) == ['127.0.0.1:5102']
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from ..defs import Allocation, Packet
+from ..network_load import NetworkLoad
+
+
+def test_delta_reporting():
+    node = NetworkLoad(local='127.0.0.1:5000')
+    allocation = Allocation(0, 10, 1, 1)
+    max_allocation = Allocation(p_value=float("inf"), q_value=float("inf"))
+    report = [allocation, max_allocation, 1.0]
+
+    # Periodic mode always reports
+    assert node.should_report(report, 0)
+    node.last_report, node.last_report_time = report, 0
+    assert node.should_report(report, 1)
+
+    node.report_delta = True
+    node.report_allocation_deadband = 0.5
+    node.report_measure_deadband = 0.01
+    node.report_heartbeat_period = 30
+
+    # Nothing changed beyond deadbands
+    assert not node.should_report(report, 1)
+    assert not node.should_report([Allocation(0, 10.4, 1, 1), max_allocation, 1.005], 1)
+    # Allocation, max_allocation or measure changed
+    assert node.should_report([Allocation(0, 11, 1, 1), max_allocation, 1.0], 1)
+    assert node.should_report([allocation, Allocation(0, 30, 0, 1), 1.0], 1)
+    assert node.should_report([allocation, max_allocation, 1.02], 1)
+    # Heartbeat expired
+    assert node.should_report(report, 30)
+
+
+def test_group_allocation():
+    node = NetworkLoad(local='127.0.0.1:5000')
+    node.logger = logging.getLogger(__name__)
+    node.join_group('239.255.0.1:5100')
+    node.max_allocation = Allocation(0, -20, 0, 1)
+
+    # Scales max_allocation, or rated_allocation when set
+    node.handle_receive(Packet('group_allocation', ['239.255.0.1:5100', Allocation(3, 0.5, 0, 10)],
+                               src='127.0.0.1:5001', dst='239.255.0.1:5100'))
+    assert node.curr_allocation == Allocation(3, -10, 0, 10)
+    node.rated_allocation = Allocation(p_value=-30, q_value=0)
+    node.handle_receive(Packet('group_allocation', ['239.255.0.1:5100', Allocation(4, 0.5, 0, 10)],
+                               src='127.0.0.1:5001', dst='127.0.0.1:5000'))
+    assert node.curr_allocation == Allocation(4, -15, 0, 10)
+
+    # Groups not joined are ignored
+    node.handle_receive(Packet('group_allocation', ['239.255.0.2:5100', Allocation(5, 0, 0, 10)],
+                               src='127.0.0.1:5001', dst='239.255.0.2:5100'))
+    assert node.curr_allocation == Allocation(4, -15, 0, 10)
+
+
+def test_group_allocation_without_rating():
+    # The default max_allocation is unbounded, there is no share to scale
+    node = NetworkLoad(local='127.0.0.1:5999')
+    node.logger = logging.getLogger(__name__)
+    node.join_group('239.255.0.1:5100')
+    assert node.group_share(Allocation(1, 0.0, 0, 10)) is None
+    node.handle_receive(Packet('group_allocation', ['239.255.0.1:5100', Allocation(1, 0.0, 0, 10)],
+                               src='127.0.0.1:5001', dst='239.255.0.1:5100'))
+    assert node.curr_allocation == Allocation()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandapower as pp
+import pandapower.networks as pn
+import pandas as pd
+
+from ..channel import ChannelModel, Link
+from ..controller import PIController
+from ..offline import OfflineSimulation
+
+
+def pv_grid(steps=40):
+    net = pn.create_cigre_network_lv()
+    curves = {'timestamp': np.arange(steps, dtype=float)}
+    for name, bus in zip(net.load['name'].tolist(), net.load['bus'].tolist()):
+        pp.create_load(net, bus, p_kw=0, name='PV_{}'.format(name))
+        curves['{}_P'.format(name)] = np.full(steps, 2.0)
+        curves['PV_{}_P'.format(name)] = np.full(steps, -30.0)
+    return net, pd.DataFrame(curves)
+
+
+def test_offline_simulation():
+    net, curves = pv_grid()
+    no_control = OfflineSimulation(net, curves).run(reference=30 * 15 * 40)
+    assert no_control['violation_rate'] > 0
+    assert abs(no_control['production_loss']) < 1e-9
+    # net is left untouched
+    assert (net.load['p_kw'].values >= 0).all()
+
+    controlled = OfflineSimulation(net, curves, controller=PIController(400 * 1.05, duration=5), max_vm=1.05)
+    summary = controlled.run(reference=30 * 15 * 40)
+    assert summary['control_cycles'] == 8
+    assert summary['violation_rate'] < no_control['violation_rate']
+    assert summary['production_loss'] > 0
+    # the controller is copied by each run
+    assert controlled.run(reference=30 * 15 * 40) == summary
+
+    lossy = OfflineSimulation(net, curves, controller=PIController(400 * 1.05, duration=5), max_vm=1.05,
+                              channel=ChannelModel(Link(loss=0.5, delay=2), seed=1))
+    summary = lossy.run(reference=30 * 15 * 40)
+    assert lossy.run(reference=30 * 15 * 40) == summary
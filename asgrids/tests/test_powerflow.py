@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandapower as pp
+import pandapower.networks as pn
+
+from ..powerflow import NewtonPowerFlow, PandapowerPowerFlow, PowerFlow, RadialPowerFlow
+
+
+def check_power_flow(net, solver):
+    power_flow = PowerFlow(net)
+    assert isinstance(power_flow.solver, solver)
+    random = np.random.RandomState(0)
+    p_kw = net.load['p_kw'].values.copy()
+    for _ in range(3):
+        net.load['p_kw'] = p_kw * random.uniform(0.5, 1.5, len(net.load))
+        vm_pu = power_flow.run()
+        pp.runpp(net)
+        assert np.allclose(vm_pu, net.res_bus['vm_pu'].values, atol=1e-7)
+    return power_flow
+
+
+def test_radial_power_flow():
+    net = pn.create_cigre_network_lv()
+    for i, bus in enumerate(net.load.bus):
+        pp.create_load(net, bus, p_kw=-20 * i, q_kvar=0, name='pv{}'.format(i))
+    power_flow = check_power_flow(net, RadialPowerFlow)
+    grid = power_flow.grid
+    assert np.allclose(grid.load_vm_pu, net.res_bus['vm_pu'].loc[net.load['bus']].values, atol=1e-7)
+    assert np.array_equal(grid.res_bus['vm_pu'], grid.vm_pu)
+    assert grid.res_load['p_kw'][0] == net.load['p_kw'][0]
+
+
+def test_meshed_power_flow():
+    net = pn.create_cigre_network_lv()
+    pp.create_line(net, 5, 10, 0.1, 'NAYY 4x150 SE')
+    check_power_flow(net, NewtonPowerFlow)
+    check_power_flow(pn.case30(), NewtonPowerFlow)
+
+
+def test_voltage_dependent_loads():
+    net = pn.create_cigre_network_lv()
+    net.load['const_z_percent'] = 50.
+    check_power_flow(net, PandapowerPowerFlow)
+
+
+def test_factor_reuse():
+    net = pn.case30()
+    power_flow = check_power_flow(net, NewtonPowerFlow)
+    assert power_flow.solver.factorizations == 1
+    # A topology change compiles the grid again
+    net.line.loc[0, 'in_service'] = False
+    vm_pu = power_flow.run()
+    assert power_flow.compilations == 2
+    pp.runpp(net)
+    assert np.allclose(vm_pu, net.res_bus['vm_pu'].values, atol=1e-7)
+
+
+def test_voltage_sensitivity():
+    net = pn.create_cigre_network_lv()
+    power_flow = PowerFlow(net)
+    vm_pu = power_flow.run().copy()
+    sensitivity = power_flow.sensitivity
+    name, bus = net.load['name'].iat[3], net.load['bus'].iat[3]
+    p_kw, q_kvar = net.load['p_kw'].iat[3] + 5, net.load['q_kvar'].iat[3] + 1
+    estimate = sensitivity.set_load(name, p_kw, q_kvar)
+    net.load.loc[net.load.index[3], ['p_kw', 'q_kvar']] = p_kw, q_kvar
+    power_flow.run()
+    row = net.bus.index.get_loc(bus)
+    change = power_flow.grid.vm_pu[row] - vm_pu[row]
+    assert change < 0
+    assert abs(estimate - power_flow.grid.vm_pu[row]) < 0.05 * abs(change)
+    # rebased on the new solution
+    assert sensitivity.load_vm_pu[3] == power_flow.grid.load_vm_pu[3]
+
+
+def test_scenarios():
+    for net in (pn.create_cigre_network_lv(), pn.case30()):
+        power_flow = PowerFlow(net)
+        vm_pu = power_flow.run().copy()
+        p_kw = net.load['p_kw'].values * np.random.RandomState(0).uniform(0.8, 1.2, (10, len(net.load)))
+        scenarios = power_flow.run_scenarios(p_kw, chunk_size=4)
+        assert scenarios.shape == (10, len(net.bus))
+        assert np.array_equal(power_flow.grid.vm_pu, vm_pu, equal_nan=True)
+        for i in (0, 9):
+            net.load['p_kw'] = p_kw[i]
+            pp.runpp(net)
+            assert np.allclose(scenarios[i], net.res_bus['vm_pu'].values, atol=1e-7)
+
+
+def test_agent_loads():
+    net = pn.create_cigre_network_lv()
+    loads = len(net.load)
+    power_flow = PowerFlow(net)
+    p_kw = net.load['p_kw'].values.copy()
+    names = ['agent{}'.format(i) for i in range(3 * loads)]
+    agents = power_flow.add_agents(names, np.arange(3 * loads) % loads, weights=np.repeat([0.5, 0.4, 0.3], loads))
+    assert list(agents.members(0)) == [0, loads, 2 * loads]
+    # same as 1.2 times each load, without growing net.load
+    vm_pu = power_flow.run()
+    assert len(net.load) == loads
+    assert np.allclose(net.load['p_kw'].values, 1.2 * p_kw)
+
+    estimate = power_flow.sensitivity.shift_load(*agents.estimate('agent0', p_kw[0] + 10, net.load['q_kvar'][0] / 1.2))
+    assert agents.set('agent0', p_kw[0] + 10, net.load['q_kvar'][0] / 1.2)
+    assert not agents.set('agent0', p_kw[0] + 10, net.load['q_kvar'][0] / 1.2)
+    assert np.isclose(power_flow.run()[net.load['bus'][0]], estimate, atol=1e-4)
+    assert power_flow.grid.vm_pu[net.load['bus'][0]] < vm_pu[net.load['bus'][0]]
+    assert np.isclose(net.load['p_kw'][0], 1.2 * p_kw[0] + 0.5 * 10)
+    pp.runpp(net)
+    assert np.allclose(agents.vm_pu(power_flow.grid), net.res_bus['vm_pu'].loc[net.load['bus']].values[agents.rows])
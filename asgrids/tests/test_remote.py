@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pickle
+
+from ..remote import NodeController, RemoteBatch
+
+
+def test_node_controller():
+    controller = NodeController()
+    batch = RemoteBatch()
+    batch.create('load', '127.0.0.1:5100', report_measure_period=2)
+    batch.create('load', '127.0.0.1:5101')
+    batch.set(None, update_measure_period=3)
+    batch.get('127.0.0.1:5100', 'report_measure_period')
+    batch.get('127.0.0.1:5102', 'local')
+    batch.get(None, 'update_measure_period')
+    batch.create('switch', '127.0.0.1:5103')
+    results = pickle.loads(controller.handle(pickle.dumps(batch.commands)))
+
+    assert results[:4] == [[True, '127.0.0.1:5100'], [True, '127.0.0.1:5101'], [True, {'127.0.0.1:5100': None,
+                                                                                       '127.0.0.1:5101': None}],
+                           [True, 2]]
+    # Failures don't stop the batch
+    assert not results[4][0]
+    assert results[5] == [True, {'127.0.0.1:5100': 3, '127.0.0.1:5101': 3}]
+    assert not results[6][0]
+    assert sorted(controller.nodes) == ['127.0.0.1:5100', '127.0.0.1:5101']
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..tuning import VoltageTrajectories, bump, grid_search, random_search, tune
+
+
+def plant(generator_peaks, steps=100):
+    # Voltages of test_controller, with 5, 10 and 15 kW of production
+    return VoltageTrajectories(load_voltages=bump(steps, [240, 245]), generator_voltages=bump(steps, generator_peaks),
+                               available=bump(steps, [5e3, 10e3, 15e3]), sensitivity=1e-3, maximum_voltage=250,
+                               cycle=2)
+
+
+def test_tune(tmpdir):
+    candidates = grid_search([0, 5e-2, 0.5], [0, 4e-5])
+    assert len(candidates) == 6 and len(random_search(10, seed=1)) == 10
+
+    results = tune(plant([230, 245, 240]), candidates)
+    # no overvoltage, no curtailment
+    assert all(r['overvoltage'] == 0 and r['curtailed_energy'] == 0 and r['settling_time'] == 0 for r in results)
+
+    overvoltage = plant([230, 245, 270])
+    results = tune(overvoltage, candidates)
+    assert [(r['sigma'], r['tau']) for r in results] == [(c['sigma'], c['tau']) for c in candidates]
+    # no control, then gains trading overvoltage for curtailment, too high ones curtailing for nothing
+    assert results[0]['curtailed_energy'] == 0 and results[0]['overvoltage'] > 0
+    assert results[1]['overvoltage'] < results[0]['overvoltage'] and results[1]['curtailed_energy'] > 0
+    assert results[2]['overvoltage'] < results[0]['overvoltage']
+    assert results[4]['overvoltage'] >= results[2]['overvoltage']
+    assert results[4]['curtailed_energy'] > results[2]['curtailed_energy']
+    assert all(0 < r['settling_time'] < 100 for r in results)
+
+    # same results from worker processes, then from the cache
+    cache = str(tmpdir.join('tuning.json'))
+    assert tune(overvoltage, candidates, workers=2, cache=cache) == results
+    overvoltage.trajectories = None
+    assert tune(overvoltage, candidates, cache=cache) == results
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tuning of the PIController gains.
+
+Candidate gains (sigma, tau) are evaluated in closed loop against a plant, either the
+offline simulation of a grid (GridPlant) or voltage trajectories, recorded or synthetic,
+lowered by curtailment (VoltageTrajectories). Each candidate gets:
+
+- overvoltage: integral over time of the voltages above the controller's maximum voltage (V.s),
+  summed over the nodes
+- curtailed_energy: energy the generators could have produced but didn't (kWh)
+- settling_time: time (s) from the first overvoltage until voltages stay below the maximum voltage,
+  inf if they don't by the end of the run, 0 without overvoltage
+
+Candidates are evaluated in worker processes and their metrics are kept in a JSON cache.
+"""
+
+import hashlib
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .analysis import AnalysisCache
+from .controller import PIController
+
+# times (s), voltages (V) of the nodes, available and actual production (W) of the generators, by step
+Trajectories = namedtuple('Trajectories', ['times', 'voltages', 'available', 'production'])
+
+
+def bump(steps, peaks, center=None, width=None):
+    """ Gaussian voltage trajectories, steps x nodes, peaking at peaks (V) at step center """
+    center = steps / 2 if center is None else center
+    width = 0.12 * steps if width is None else width
+    base = np.exp(-(np.arange(steps, dtype=float) - center) ** 2 / width ** 2)
+    return base[:, None] * np.asarray(peaks, dtype=float)
+
+
+class VoltageTrajectories(object):
+    """ Voltages of loads and generators over time, lowered by curtailment.
+
+    Generators produce their available power up to their last received allocation, applied
+    from the next step on. The voltage of each node is its trajectory without control less
+    sensitivity times the total curtailed power.
+
+    :param load_voltages: voltages (V) of the loads without control, steps x loads
+    :param generator_voltages: same for the generators
+    :param available: available production (W, positive) of the generators, steps x generators
+    :param capacity: maximum production (W) of each generator, scaled by the controller, the
+        maximum available production if None
+    :param sensitivity: voltage drop (V) per curtailed W, scalar or by node (loads then generators)
+    :param maximum_voltage: maximum voltage (V) of the controller
+    :param step: duration (s) of a step
+    :param cycle: steps between two runs of the controller
+    """
+    def __init__(self, load_voltages, generator_voltages, available, capacity=None, sensitivity=1e-3,
+                 maximum_voltage=250, step=1.0, cycle=1):
+        self.load_voltages = np.asarray(load_voltages, dtype=float)
+        self.generator_voltages = np.asarray(generator_voltages, dtype=float)
+        self.available = np.asarray(available, dtype=float)
+        self.capacity = self.available.max(axis=0) if capacity is None else np.asarray(capacity, dtype=float)
+        self.sensitivity = np.broadcast_to(np.asarray(sensitivity, dtype=float),
+                                           self.load_voltages.shape[1] + self.generator_voltages.shape[1])
+        self.maximum_voltage = maximum_voltage
+        self.step = step
+        self.cycle = cycle
+
+    @property
+    def duration(self):
+        """ Duration (s) of the controller's allocations """
+        return self.cycle * self.step
+
+    @property
+    def key(self):
+        """ Digest of the plant, to cache its results """
+        digest = hashlib.sha1()
+        for array in (self.load_voltages, self.generator_voltages, self.available, self.capacity,
+                      self.sensitivity):
+            digest.update(repr(array.shape).encode())
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(repr((self.maximum_voltage, self.step, self.cycle)).encode())
+        return digest.hexdigest()
+
+    def trajectories(self, controller):
+        """ Run of controller on the plant
+
+        :rtype: Trajectories
+        """
+        steps = len(self.available)
+        nodes = np.hstack((self.load_voltages, self.generator_voltages))
+        loads = self.load_voltages.shape[1]
+        load_maximum_powers = [float('inf')] * loads
+        caps = np.full(self.available.shape[1], np.inf)
+        voltages = np.empty_like(nodes)
+        production = np.empty_like(self.available)
+        for step in range(steps):
+            production[step] = np.minimum(self.available[step], caps)
+            voltages[step] = nodes[step] - self.sensitivity * (self.available[step] - production[step]).sum()
+            if step % self.cycle == 0:
+                _, allocations = controller.generate_allocations(
+                    voltages[step, :loads], voltages[step, loads:], load_maximum_powers, self.capacity)
+                caps = np.array([allocation.p_value for allocation in allocations])
+        return Trajectories(np.arange(steps) * self.step, voltages, self.available, production)
+
+
+class GridPlant(object):
+    """ Offline simulation of a grid as plant, the voltages being those of its loads
+
+    :param simulation: OfflineSimulation, its controller is left out
+    """
+    def __init__(self, simulation):
+        self.simulation = simulation
+        net = simulation.net
+        self.load_vn_kv = net.bus['vn_kv'].loc[net.load['bus']].values
+        self.maximum_voltage = simulation.max_vm * self.load_vn_kv.max() * 1000
+        times = simulation.times
+        self.duration = simulation.cycle * (times[1] - times[0] if len(times) > 1 else 1.0)
+
+    @property
+    def key(self):
+        return self.simulation.key
+
+    def trajectories(self, controller):
+        simulation = self.simulation
+        generators = simulation.generators
+        voltages = []
+        production = []
+        load_bus_rows = None
+        for step, p_kw, vm_pu in simulation.simulate(controller=controller):
+            if load_bus_rows is None:
+                load_bus_rows = simulation.power_flow.grid.load_bus_rows
+            voltages.append(vm_pu[load_bus_rows] * self.load_vn_kv * 1000)
+            production.append(-p_kw[generators] * 1e3)
+        steps = len(voltages)
+        return Trajectories(simulation.times[:steps], np.array(voltages),
+                            -simulation.p_kw[:steps, generators] * 1e3, np.array(production))
+
+
+def trajectory_metrics(trajectories, maximum_voltage):
+    """ Metrics of a run, see the module's documentation
+
+    :rtype: dict
+    """
+    times, voltages, available, production = trajectories
+    excess = np.nan_to_num(np.maximum(voltages - maximum_voltage, 0))
+    above = np.flatnonzero(excess.max(axis=1) > 0)
+    if not len(above):
+        settling_time = 0.0
+    elif above[-1] == len(times) - 1:
+        settling_time = float('inf')
+    else:
+        settling_time = float(times[above[-1] + 1] - times[above[0]])
+    return {
+        'overvoltage': float(np.trapz(excess, times, axis=0).sum()),
+        'curtailed_energy': float(np.trapz((available - production).sum(axis=1), times)) / 3.6e6,
+        'settling_time': settling_time,
+    }
+
+
+def evaluate(plant, gains):
+    """ Gains and metrics of a run of PIController with gains (sigma, tau) on plant
+
+    :rtype: dict
+    """
+    controller = PIController(plant.maximum_voltage, duration=plant.duration, **gains)
+    return dict(gains, **trajectory_metrics(plant.trajectories(controller), plant.maximum_voltage))
+
+
+def grid_search(sigma, tau):
+    """ Candidate gains of each combination of sigma and tau values """
+    return [{'sigma': float(s), 'tau': float(t)} for s in sigma for t in tau]
+
+
+def random_search(n, sigma=(1e-3, 1), tau=(1e-7, 1e-3), seed=None):
+    """ n candidate gains, log-uniformly distributed in the sigma and tau ranges """
+    random = np.random.RandomState(seed)
+    sigmas = np.exp(random.uniform(np.log(sigma[0]), np.log(sigma[1]), n))
+    taus = np.exp(random.uniform(np.log(tau[0]), np.log(tau[1]), n))
+    return [{'sigma': float(s), 'tau': float(t)} for s, t in zip(sigmas, taus)]
+
+
+class TuningCache(AnalysisCache):
+    """ JSON index of evaluated candidates, keyed by plant and gains """
+    @staticmethod
+    def key(plant, gains):
+        return '{}?{}'.format(plant, json.dumps(gains, sort_keys=True))
+
+    def get(self, plant, gains):
+        return self.entries.get(self.key(plant, gains))
+
+    def put(self, plant, gains, result):
+        self.entries[self.key(plant, gains)] = result
+        self.changed = True
+
+
+_plant = None
+
+
+def _init_worker(plant):
+    global _plant
+    _plant = plant
+
+
+def _evaluate(gains):
+    return evaluate(_plant, gains)
+
+
+def tune(plant, candidates, workers=1, cache=None):
+    """ Evaluate candidate gains on plant, only those missing from the cache.
+
+    :param plant: GridPlant or VoltageTrajectories
+    :param candidates: dicts of PIController gains (sigma, tau), see grid_search and random_search
+    :param workers: number of worker processes, the plant being sent once to each
+    :param cache: path of the TuningCache JSON index, None to disable caching
+    :returns: gains and metrics of each candidate, in order
+    :rtype: list
+    """
+    candidates = [dict(gains) for gains in candidates]
+    cache = TuningCache(cache) if cache is not None else None
+    key = plant.key
+    results = [None if cache is None else cache.get(key, gains) for gains in candidates]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plant,)) as executor:
+            evaluated = list(executor.map(_evaluate, [candidates[i] for i in missing]))
+    else:
+        evaluated = [evaluate(plant, candidates[i]) for i in missing]
+    for i, result in zip(missing, evaluated):
+        results[i] = result
+        if cache is not None:
+            cache.put(key, candidates[i], result)
+    if cache is not None:
+        cache.save()
+    return results
@@ -1,7 +1,7 @@
 from queue import Queue, Full, Empty
 from threading import Event, Lock
 from time import monotonic as time, sleep
-from asgrids import SmartGridSimulation, Allocation, Packet#, runpp, optimize_network_pi, optimize_network_opf#, live_plot_voltage
+from asgrids import SmartGridSimulation, Allocation, Packet, ChannelModel, Link, GridStateBus, PowerFlowTrigger#, runpp, optimize_network_pi, optimize_network_opf#, live_plot_voltage
 from signal import signal, SIGINT
 import pandapower.networks as pn
 import pandapower as pp
@@ -22,6 +22,8 @@ network_ready: Queue = Queue(1)
 plot_values: Queue = Queue()
 voltage_values: Queue = Queue()
 allocation_generators: dict = {}
+bus = None
+trigger = None
 lock = Lock()
 initial_time = None
 nodes: list = []
@@ -73,8 +75,57 @@ parser.add_argument('--accel', type=float,
                     default=1.0)
 parser.add_argument('--p-factor', type=float,
                     default=1.0)
-parser.add_argument('--mode', type=str,
-                    default='udp')
+parser.add_argument('--mode', type=str, choices=['udp', 'tcp', 'ipc', 'inproc'],
+                    default='udp', help="udp datagrams, or zmq over tcp, ipc or inproc endpoints")
+parser.add_argument('--report-delta', action='store_true',
+                    help='only report measures when they change beyond deadbands')
+parser.add_argument('--report-deadband', type=float,
+                    help='allocation deadband (kW) for delta reporting',
+                    default=0.1)
+parser.add_argument('--measure-deadband', type=float,
+                    help='voltage deadband (p.u.) for delta reporting',
+                    default=1e-3)
+parser.add_argument('--heartbeat', type=float,
+                    help='maximum time (s) between two reports in delta reporting',
+                    default=30)
+parser.add_argument('--rcvbuf', type=int,
+                    help="allocator's UDP receive buffer size (bytes)",
+                    default=None)
+parser.add_argument('--receivers', type=int,
+                    help="number of allocator's UDP receiver sockets (SO_REUSEPORT)",
+                    default=1)
+parser.add_argument('--bulk-receive', action='store_true',
+                    help="allocator drains many datagrams per wakeup")
+parser.add_argument('--state-bus', action='store_true',
+                    help='exchange setpoints and voltages through a GridStateBus instead of queues')
+parser.add_argument('--pp-threshold', type=float,
+                    help='adaptive power flow: solve once setpoints changed by this much (kW), implies --state-bus',
+                    default=None)
+parser.add_argument('--pp-staleness', type=float,
+                    help='adaptive power flow: maximum age (s) of an unsolved setpoint change',
+                    default=1.0)
+parser.add_argument('--pp-coalesce', type=float,
+                    help='adaptive power flow: time (s) to wait for more changes before solving',
+                    default=0.05)
+parser.add_argument('--pandapower-pf', action='store_true',
+                    help="solve every power flow with pandapower's runpp instead of the radial sweep")
+parser.add_argument('--estimate-voltage', action='store_true',
+                    help='answer reports with voltages estimated from the last power flow and the setpoint changes since')
+parser.add_argument('--pi-group', type=str, default=None,
+                    help="send the PI controller's allocations once to the PV nodes, joined to this group "
+                         "(a multicast ip:port in udp mode, the address the allocator publishes on otherwise)")
+parser.add_argument('--loss', type=float,
+                    help='packet loss rate (%%) emulated by the agents, instead of netem',
+                    default=0)
+parser.add_argument('--delay', type=float,
+                    help='one way delay (s) emulated by the agents',
+                    default=0)
+parser.add_argument('--jitter', type=float,
+                    help='delay jitter (s) emulated by the agents',
+                    default=0)
+parser.add_argument('--seed', type=int,
+                    help='seed of the emulated packet losses and delays',
+                    default=None)
                 
 parser.add_argument('--no-forecast', action='store_true')
 parser.add_argument('--check-limit', action='store_true')
@@ -100,6 +151,21 @@ output = args.output
 initial_port = args.initial_port
 address = args.address
 mode = args.mode
+report_delta = args.report_delta
+report_deadband = args.report_deadband
+measure_deadband = args.measure_deadband
+heartbeat = args.heartbeat
+rcvbuf = args.rcvbuf
+receivers = args.receivers
+bulk_receive = args.bulk_receive
+pp_threshold = args.pp_threshold
+pp_staleness = args.pp_staleness
+pp_coalesce = args.pp_coalesce
+state_bus = args.state_bus or pp_threshold is not None
+loss = args.loss
+delay = args.delay
+jitter = args.jitter
+seed = args.seed
 
 curves = pd.read_csv(CSV_FILE)
 curves.drop(curves[curves['timestamp']<=49].index, inplace=True)
@@ -128,20 +194,32 @@ print("WITH PV: {}".format(with_pv))
 if with_optimize:
     print("WITH OPTIMIZER: {}".format(optimizer))
     print("WITH OPTIMIZE CYCLE: {}".format(optimize_cycle))
-print("PP CYCLE: {}".format(pp_cycle))
+if pp_threshold is not None:
+    print("ADAPTIVE PP: threshold {}kW, staleness {}s, coalesce {}s".format(pp_threshold, pp_staleness, pp_coalesce))
+else:
+    print("PP CYCLE: {}".format(pp_cycle))
 print("WITH PLOT: {}".format(plot_voltage))
 print("SIM TIME: {}s".format(simtime))
 print("INITIAL ADDRESS {}:{}".format(address, initial_port))
 print("MAX VM_PU {}".format(max_vm))
 print("COMM MODE {}".format(mode))
+print("PACKET LOSS {}%, DELAY {}s, JITTER {}s".format(loss, delay, jitter))
 # Create SmartGridSimulation environment
 sim: SmartGridSimulation = SmartGridSimulation()
+sim.radial_power_flow = not args.pandapower_pf
+sim.estimate_voltages = args.estimate_voltage
+sim.pi_group = args.pi_group
 terminate = Event()
 terminate.clear()
 # Handle ctrl-c interruptin
 def shutdown(x, y):
     print("Shutdown")
+    if mode == 'udp':
+        print("Allocator drops: {}".format(allocator.comm.drop_counters()))
     terminate.set()
+    if trigger is not None:
+        print("Power flow solves: {}".format(trigger.solves))
+        trigger.stop()
     # allocations_queue.put([0, 0, 0, 0])
     # voltage_values.put([0,0])
     sim.stop()
@@ -213,9 +291,17 @@ def allocation_updated(allocation: Allocation, node_addr: str, timestamp):
     # We receive node_addr as "X.X.X.X:YYYY"
     # ind also identifies the node in pandapawer loads list
     # print("Node %s updated allocation"%node_addr)
+    if bus is not None:
+        slot = bus.slot(node_addr)
+        bus.write_setpoint(slot, allocation.p_value, allocation.q_value)
+        if sim.estimate_voltages:
+            return sim.estimate_voltage(net, node_addr, allocation.p_value, allocation.q_value)
+        return bus.new_voltage(slot)
     try:
         allocations_queue.put(
             [timestamp, node_addr, allocation.p_value, allocation.q_value])
+        if sim.estimate_voltages:
+            return sim.estimate_voltage(net, node_addr, allocation.p_value, allocation.q_value)
         measure = measure_queues[node_addr].get_nowait()
         # if logger_n is not None:
         #     logger_n.info('{}\t{}\t{}\t{}\t{}'.format(
@@ -246,6 +332,10 @@ def create_nodes(net, remote, mode='udp'):
         node = sim.create_node(ntype='load', addr='{}:{}'.format(address, next(port)), mode=mode)
         node.update_measure_period = 1
         node.report_measure_period = 1
+        node.report_delta = report_delta
+        node.report_allocation_deadband = report_deadband
+        node.report_measure_deadband = measure_deadband
+        node.report_heartbeat_period = heartbeat
         measure_queues[node.local] = Queue(maxsize=1)
         node.update_measure_cb = allocation_updated
         node.joined_callback = joined_network
@@ -257,6 +347,10 @@ def create_nodes(net, remote, mode='udp'):
             net.load['min_q_kvar'][i] = 0
             net.load['max_q_kvar'][i] = 0
             pp.create_polynomial_cost(net, i, 'load', np.array([1, 0]))
+            if sim.pi_group is not None:
+                # group allocations scale the 30kW maximum production
+                node.rated_allocation = Allocation(p_value=-30, q_value=0)
+                node.join_group(sim.pi_group)
 
         net.load['name'][i] = "{}".format(node.local)
         nodes.append(node)
@@ -271,6 +365,12 @@ def create_nodes(net, remote, mode='udp'):
 allocator = sim.create_node(
     ntype='allocator', addr="{}:{}".format(address, next(port)), mode=mode)
 allocator.identity = allocator.local
+if mode == 'udp':
+    allocator.comm.rcvbuf = rcvbuf
+    allocator.comm.receivers = receivers
+    allocator.comm.bulk = bulk_receive
+if sim.pi_group is not None:
+    allocator.host_group(sim.pi_group)
 allocator.run()
 
 net = pp.from_json(JSON_FILE)
@@ -284,10 +384,18 @@ net.load['controllable'] = False
 
 
 nodes = create_nodes(net, allocator.local, mode=mode)
+if state_bus:
+    # slots follow net.load rows, named after the nodes' addresses
+    bus = GridStateBus(net.load['name'].tolist())
 if not skip_join:
     print("waiting for {} nodes to join network".format(len(nodes)))
     network_ready.get()
 print("Network ready")
+if loss > 0 or delay > 0 or jitter > 0:
+    # Same seeded links, whatever the number of agents
+    channel = ChannelModel(default=Link(loss=loss / 100, delay=delay, jitter=jitter), seed=seed)
+    for agent in [allocator] + nodes:
+        agent.error_model = channel
 initial_time = time()
 allocator.allocation_updated = allocator_measure_updated
 for node in nodes:
@@ -316,12 +424,16 @@ def worker_pp(fn, args: list, cycle: float):
         if cycle > 0:
             sleep(cycle)
 
-def worker_optimize(fn, args: list, cycle: float):
+def worker_optimize(fn, args: list, cycle: float, copy=True):
     import sys, traceback
     while not terminate.is_set():
-        lock.acquire()
-        netcopy = deepcopy(net)
-        lock.release()
+        if copy:
+            lock.acquire()
+            netcopy = deepcopy(net)
+            lock.release()
+        else:
+            # the PI controller only reads the power flow results of net
+            netcopy = net
         ARGS = [netcopy] + args
         try:
             fn(*ARGS)
@@ -339,12 +451,20 @@ with Executor(max_workers=200) as executor:
     try:
         # net_copy = deepcopy(net)
         print("Running power flow analysis")
-        executor.submit(worker_pp, sim.runpp, [net, allocations_queue, measure_queues, plot_values, plot_voltage, initial_time, logger_n], pp_cycle*accel)
+        if pp_threshold is not None:
+            # Blocks until setpoints changed enough or got too old, instead of polling every pp_cycle
+            trigger = PowerFlowTrigger(threshold=pp_threshold, max_staleness=pp_staleness*accel,
+                                       coalesce=pp_coalesce*accel)
+            executor.submit(sim.runpp_adaptive, net, bus, trigger, logger_n, lock)
+        elif bus is not None:
+            executor.submit(worker_pp, sim.runpp_bus, [net, bus, logger_n], pp_cycle*accel)
+        else:
+            executor.submit(worker_pp, sim.runpp, [net, allocations_queue, measure_queues, plot_values, plot_voltage, initial_time, logger_n], pp_cycle*accel)
         if with_optimize:
             # net_copy = deepcopy(net)
             if optimizer == 'pi':
                 print("Optimizing network in realtime with PI")
-                executor.submit(worker_optimize, sim.optimize_network_pi, [allocator, voltage_values, optimize_cycle*accel, max_vm, check_limit], optimize_cycle*accel)
+                executor.submit(worker_optimize, sim.optimize_network_pi, [allocator, voltage_values, optimize_cycle*accel, max_vm, check_limit], optimize_cycle*accel, False)
             elif optimizer == 'opf':
                 print("Optimizing network in realtime with OPF")
                 executor.submit(worker_optimize, sim.optimize_network_opf, [allocator, voltage_values, optimize_cycle*accel, max_vm, opf_forecast, check_limit], optimize_cycle*accel)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline counterpart of cigre_pv_example.py: the same profiles, PI controller and emulated
+packet losses/delays, stepped in a loop instead of run in real time with agents.
+Prints the run's metrics, as computed by the plotting scripts (asgrids.analysis).
+
+    python examples/cigre_pv_offline.py --with-pv --optimize --sigma 0.05 --tau 4e-5 --loss 10 --seed 1
+"""
+
+import argparse
+import json
+import logging
+from time import monotonic as time
+
+import pandas as pd
+import pandapower as pp
+
+from asgrids import ChannelModel, Link, OfflineSimulation, PIController
+
+parser = argparse.ArgumentParser(
+    description='Offline time-series simulation of the PI controlled CIGRE LV network')
+parser.add_argument('--with-pv', action='store_true',
+                    help='with or without PV power production')
+parser.add_argument('--csv-file', type=str,
+                    help='CSV database with loads timeseries',
+                    default='./cigre_curves.csv')
+parser.add_argument('--json-file', type=str,
+                    help='pandapower network',
+                    default='./cigre_network_lv.json')
+parser.add_argument('--optimize', action='store_true',
+                    help='control the PV with the PI controller')
+parser.add_argument('--optimize-cycle', type=int,
+                    help='steps between two runs of the controller',
+                    default=5)
+parser.add_argument('--sigma', type=float,
+                    help='proportional gain of the PI controller',
+                    default=5e-2)
+parser.add_argument('--tau', type=float,
+                    help='integral gain of the PI controller',
+                    default=4e-5)
+parser.add_argument('--max-vm', type=float,
+                    help='maxium voltage that triggers optimization',
+                    default=1.01)
+parser.add_argument('--check-limit', action='store_true')
+parser.add_argument('--p-factor', type=float,
+                    default=1.0)
+parser.add_argument('--steps', type=int,
+                    help='number of steps, all the profiles if not set',
+                    default=None)
+parser.add_argument('--loss', type=float,
+                    help='packet loss rate (%%) of measures and allocations',
+                    default=0)
+parser.add_argument('--delay', type=float,
+                    help='one way delay (s)',
+                    default=0)
+parser.add_argument('--jitter', type=float,
+                    help='delay jitter (s)',
+                    default=0)
+parser.add_argument('--seed', type=int,
+                    help='seed of the emulated packet losses and delays',
+                    default=None)
+parser.add_argument('--analysis-max-vm', type=float,
+                    help='voltage limit (p.u.) of the violation metrics',
+                    default=1.05)
+parser.add_argument('--output', type=str,
+                    help='log of LOAD and VOLTAGE records, as cigre_pv_example.py --output',
+                    default='')
+args = parser.parse_args()
+
+# Same horizon as cigre_pv_example.py
+curves = pd.read_csv(args.csv_file)
+curves.drop(curves[curves['timestamp'] <= 49].index, inplace=True)
+curves.drop(curves[curves['timestamp'] >= 249].index, inplace=True)
+curves.reset_index(drop=True, inplace=True)
+curves['timestamp'] = curves['timestamp'] - curves.iloc[0, 0]
+if not args.with_pv:
+    curves[[c for c in curves.columns if c.startswith('PV')]] = 0
+
+net = pp.from_json(args.json_file)
+controller = None
+if args.optimize:
+    controller = PIController(maximum_voltage=400 * args.max_vm, sigma=args.sigma, tau=args.tau,
+                              duration=args.optimize_cycle)
+channel = None
+if args.loss > 0 or args.delay > 0 or args.jitter > 0:
+    channel = ChannelModel(default=Link(loss=args.loss / 100, delay=args.delay, jitter=args.jitter), seed=args.seed)
+log = None
+if args.output != '':
+    log = logging.getLogger('SmartGridSimulationN')
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.FileHandler(args.output, mode='w'))
+
+sim = OfflineSimulation(net, curves, controller=controller, max_vm=args.max_vm, cycle=args.optimize_cycle,
+                        check_limit=args.check_limit, channel=channel, p_factor=args.p_factor)
+start = time()
+summary = sim.run(steps=args.steps, log=log, max_vm=args.analysis_max_vm)
+print("Simulated {} steps in {:.3f}s".format(args.steps or len(curves), time() - start))
+summary.pop('time_above')
+print(json.dumps(summary, indent=2))
@@ -42,6 +42,9 @@ parser.add_argument('--pp', action='store_true',
 parser.add_argument('--initial-port', type=int,
                     default=4000)
 parser.add_argument('--skip-join', action='store_true')
+parser.add_argument('--allocators', type=int,
+                    help='number of allocator shards',
+                    default=1)
 parser.add_argument('--pp-cycle', type=int,
                     help='CSV database with loads timeseries',
                     default=1)
@@ -64,6 +67,7 @@ initial_port = args.initial_port
 skip_join = args.skip_join
 pp_cycle = args.pp_cycle
 optimize_cycle = args.optimize_cycle
+n_allocators = args.allocators
 
 nodes: list = []
 
@@ -181,67 +185,55 @@ def allocator_measure_updated(allocation: list, node_addr: str):
         # print("voltage_values is full: {}".format(e))
         pass
 
-def add_more_nodes(net, N):
-    maxN = len(net.load.index)
-    for i in range(N//maxN):
-        for j in range(maxN):
-            try:
-                params = dict(net.load.loc[j])
-            except:
-                print("Error")
-            if 'name' in params.keys() and params['name'] != None:
-                params['name'] = params['name']+'_{}'.format(j+i*maxN)
-            try:
-                pp.create_load(net, **params)
-            except:
-                print("Error")
-   
-    for i in range(N%maxN):
-        params = dict(net.load.loc[i])
-        if 'name' in params.keys() and params['name'] != None:
-            params['name'] = params['name']+'_{}'.format(N//maxN)
-        pp.create_load(net, **params)
-
 def create_nodes(net, remote):
     # Create remote agents of type NetworkLoad
     # nodes = list()
     sim_nodes = len(net.load.index)
+    rows = np.arange(sim_nodes)
     if nNodes !='all' and int(nNodes) <= sim_nodes:
         sim_nodes = int(nNodes)
     elif nNodes !='all' and int(nNodes) > sim_nodes:
-        print("adding %d nodes to pandapower net"%(int(nNodes) - sim_nodes))
-        try:
-            add_more_nodes(net, int(nNodes) - sim_nodes)
-        except Exception as e:
-            print(e)
+        # Extra agents share the existing loads instead of growing net.load
+        print("mapping %d agents onto the %d loads of pandapower net"%(int(nNodes), sim_nodes))
         sim_nodes = int(nNodes)
-    for i in range(sim_nodes):
-        port_number=next(port)
-        # print('load', '127.0.0.1:{}'.format(port_number))
-        node = sim.create_node('load', '127.0.0.1:{}'.format(port_number))
-        node.update_measure_period = 1
-        node.run()
+        rows = np.arange(sim_nodes) % len(net.load.index)
+    addrs = ['127.0.0.1:{}'.format(next(port)) for _ in range(sim_nodes)]
+    if sim_nodes > len(net.load.index):
+        sim.add_agents(net, addrs, rows)
+    # Create and run all nodes in parallel
+    for i, node in enumerate(sim.create_nodes('load', addrs)):
         measure_queues[node.local] = Queue(1)
         if run_pp:
             node.update_measure_cb = allocation_updated
         node.joined_callback = joined_network
-        addr_to_name[node.local] = net.load['name'][i]
-        net.load['name'][i] = "{}".format(node.local)
+        row = rows[i]
+        addr_to_name[node.local] = net.load['name'].iat[row]
+        if sim_nodes <= len(net.load.index):
+            net.load['name'].iat[row] = "{}".format(node.local)
         nodes.append(node)
         allocation = Allocation(
             0,
-            net.load.loc[net.load['name'] == node.local, 'p_kw'].item(),
-            net.load.loc[net.load['name'] == node.local, 'q_kvar'].item(),
+            float(net.load['p_kw'].iat[row]),
+            float(net.load['q_kvar'].iat[row]),
             1)
         node.curr_allocation = allocation
 
-    for node in nodes:
-        packet = Packet('join_ack', src=allocator.local, dst=node.local)
-        node.handle_receive(packet)
+    if skip_join:
+        for node in nodes:
+            packet = Packet('join_ack', src=allocator.owner(node.local), dst=node.local)
+            node.handle_receive(packet)
+    else:
+        failed = sim.join_nodes(nodes, remote)
+        if failed:
+            print("{} nodes failed to join".format(len(failed)))
     return nodes
 
-allocator = sim.create_node(
-    ntype='allocator', addr="127.0.0.1:{}".format(next(port)))
+if n_allocators > 1:
+    allocator = sim.create_allocator_shards(
+        ["127.0.0.1:{}".format(next(port)) for _ in range(n_allocators)])
+else:
+    allocator = sim.create_node(
+        ntype='allocator', addr="127.0.0.1:{}".format(next(port)))
 initial_time = time()
 allocator.identity = allocator.local
 if optimize:
@@ -284,7 +276,7 @@ def worker_optimize(fn, args: list, cycle: float):
         try:
             lock.acquire()
             ARGS = [net] + args
-            if (net.res_bus['vm_pu']>=1.05).all():
+            if (sim.power_flow(net).grid.vm_pu>=1.05).all():
                 fn(*ARGS)
             lock.release()
 
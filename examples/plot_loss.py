@@ -7,6 +7,7 @@ import os
 from pandas.api.types import is_string_dtype
 import pickle
 from scipy.integrate import trapz
+from asgrids.analysis import analyze_runs
 
 #%%
 losses = [0, 10, 20, 30, 60]
@@ -85,12 +86,18 @@ parser.add_argument('--width', type=float,
                     default=1)
 parser.add_argument('--save', type=str, default='')
 parser.add_argument('--load', type=str, default='')
+parser.add_argument('--index', type=str, default='analysis_index.json',
+                    help='cache of per run summaries, empty to disable')
+parser.add_argument('--workers', type=int, default=1,
+                    help='processes parsing logs in parallel')
 parser.add_argument('--figsize', nargs=2, type=int, default=[6, 3])
 
 #%%
 args = parser.parse_args()
 save = args.save
 load = args.load
+index = args.index or None
+workers = args.workers
 losses = args.losses
 runs = args.runs
 with_pi = args.with_pi
@@ -124,46 +131,33 @@ if load != '':
     with open(load, 'rb') as pickle_file:
         hits_opf, hits_pi, hits_pv = pickle.load(pickle_file)
 else:
-    try:
-        data = pd.read_csv(os.path.join(results, 'sim_no_control.log'), header=None, delimiter='\t')
-        hits_pv =  [calculate_rate(data)]
-    except Exception as e:
-        hits_pv = [10]
+    loss_addresses = {0: '127.0.0.1', 10: '127.0.2.1', 20: '127.0.3.1', 30: '127.0.4.1', 60: '127.0.5.1'}
+    for j in losses:
+        if j not in loss_addresses:
+            raise ValueError(j)
+    no_control = os.path.join(results, 'sim_no_control.log')
+    logs = [no_control]
+    for j in losses:
+        for i in runs:
+            if with_opf:
+                logs.append(os.path.join(results, 'sim.opf.{}loss.{}.log'.format(loss_addresses[j], i)))
+            if with_pi:
+                logs.append(os.path.join(results, 'sim.pi.{}loss.{}.log'.format(loss_addresses[j], i)))
+    # Logs are parsed once, then summaries are read from the index
+    summaries = analyze_runs(logs, index=index, workers=workers, max_vm=max_vm)
+    hits_pv = [summaries[no_control]['violation_rate']] if no_control in summaries else [10]
     print(hits_pv)
     #%%
     for j in losses:
         hits_opf[j] = []
         hits_pi[j] = []
-        loss = ''
-        if j == 0:
-            loss = '127.0.0.1'
-        elif j == 10:
-            loss = '127.0.2.1'
-        elif j == 20:
-            loss = '127.0.3.1'
-        elif j == 30:
-            loss = '127.0.4.1'
-        elif j == 60:
-            loss = '127.0.5.1'
-        else:
-            raise ValueError(loss)
-
-
         for i in runs:
-            if with_opf:
-                try:
-                    # print('reading sim.opf.{}loss.{}.log'.format(j,i))
-                    data = pd.read_csv(os.path.join(results, 'sim.opf.{}loss.{}.log'.format(loss,i)), header=None, delimiter='\t')
-                    hits_opf[j] = hits_opf[j] + [100*calculate_rate(data)]
-                except Exception as e:
-                    print("ERROR:", e)
-            if with_pi:
-                try:
-                    print('reading sim.pi.{}loss.{}.log'.format(j,i))
-                    data = pd.read_csv(os.path.join(results, 'sim.pi.{}loss.{}.log'.format(loss,i)), header=None, delimiter='\t')
-                    hits_pi[j] = hits_pi[j] + [100*calculate_rate(data)]
-                except Exception as e:
-                    print(e)
+            for control, hits in (('opf', hits_opf), ('pi', hits_pi)):
+                log = os.path.join(results, 'sim.{}.{}loss.{}.log'.format(control, loss_addresses[j], i))
+                if log in summaries:
+                    hits[j] = hits[j] + [100*summaries[log]['violation_rate']]
+                elif log in logs:
+                    print("ERROR: can't read", log)
 
 if save != '':
     try:
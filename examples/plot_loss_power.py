@@ -9,6 +9,7 @@ from pandas.api.types import is_string_dtype
 from itertools import cycle
 import pickle
 from scipy.integrate import trapz
+from asgrids.analysis import analyze_runs
 
 parser = argparse.ArgumentParser(
     description='Plotting ECDF')
@@ -29,12 +30,18 @@ parser.add_argument('--max-vm', type=float,
                     default=1.05)
 parser.add_argument('--save', type=str, default='')
 parser.add_argument('--load', type=str, default='')
+parser.add_argument('--index', type=str, default='analysis_index.json',
+                    help='cache of per run summaries, empty to disable')
+parser.add_argument('--workers', type=int, default=1,
+                    help='processes parsing logs in parallel')
 parser.add_argument('--output', type=str, default='./ecdf_power_loss.png')
 
 args = parser.parse_args()
 output = args.output
 save = args.save
 load = args.load
+index = args.index or None
+workers = args.workers
 losses = args.losses
 max_vm = args.max_vm
 runs = args.runs
@@ -84,35 +91,25 @@ if load != '':
         data_opf, data_pi = pickle.load(pickle_file)
 
 else:
+    loss_addresses = {0: '127.0.0.1', 10: '127.0.2.1', 20: '127.0.3.1', 30: '127.0.4.1', 60: '127.0.5.1'}
+    for j in losses:
+        if j not in loss_addresses:
+            raise ValueError(j)
+    logs = [os.path.join(results, 'sim.{}.{}loss.{}.log'.format(control, loss_addresses[j], i))
+            for j in losses for i in runs for control in ['opf'] * with_opf + ['pi'] * with_pi]
+    # Logs are parsed once, then summaries are read from the index
+    summaries = analyze_runs(logs, index=index, workers=workers, max_vm=max_vm, reference=data_pv)
     for j in losses:
-        loss = ''
-        if j == 0:
-            loss = '127.0.0.1'
-        elif j == 10:
-            loss = '127.0.2.1'
-        elif j == 20:
-            loss = '127.0.3.1'
-        elif j == 30:
-            loss = '127.0.4.1'
-        elif j == 60:
-            loss = '127.0.5.1'
-        else:
-            raise ValueError(loss)
-
         data_opf[j] = []
         data_pi[j] = []
         for i in runs:
-            try:
-                if with_opf:
-                    print("reading for opf {}% loss: {}".format(j, i))
-                    data = pd.read_csv(os.path.join(results, 'sim.opf.{}loss.{}.log'.format(loss,i)), header=None, delimiter='\t')
-                    data_opf[j] = data_opf[j] + get_power_loss(data)
-                if with_pi:
-                    print("reading for pi {}% loss: {}".format(j, i))
-                    data = pd.read_csv(os.path.join(results, 'sim.pi.{}loss.{}.log'.format(loss,i)), header=None, delimiter='\t')
-                    data_pi[j] = data_opf[j] + get_power_loss(data)
-            except Exception as e:
-                print(e)
+            for control, data in (('opf', data_opf), ('pi', data_pi)):
+                log = os.path.join(results, 'sim.{}.{}loss.{}.log'.format(control, loss_addresses[j], i))
+                if log in summaries:
+                    print("{} {}% loss, run {}: {}".format(control, j, i, summaries[log]['production_loss']))
+                    data[j] = data[j] + [summaries[log]['production_loss']]
+                elif log in logs:
+                    print("ERROR: can't read", log)
 if save != '':
     with open(save, 'wb') as pickle_file:
         pickle.dump([data_opf, data_pi], pickle_file)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run a loss x run x optimizer matrix of cigre_pv_example.py experiments concurrently on one machine.
+
+Each run is its own process with its own port range, and packet losses are emulated by
+the agents (cigre_pv_example.py --loss) instead of tc/netem, so no root is needed.
+Logs are named as the plotting scripts expect (sim.<optimizer>.<address>loss.<run>.log)
+and everything is collected in --results:
+  - experiments.json: parameters, exit status and duration of each run
+  - analysis_index.json: per run summaries (asgrids.analysis), read back by the plotting scripts
+
+    python examples/run_experiments.py --losses 0 10 20 30 60 --runs 1 2 3 4 5 --optimizers pi opf
+
+--dry-run prints the command of each run of the matrix without running it, --skip-finished
+keeps the runs of a previous experiments.json that exited successfully and whose log exists.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic as time
+
+from asgrids.analysis import analyze_runs
+
+EXAMPLES = os.path.dirname(os.path.abspath(__file__))
+# Historical netem setup (create_netem.sh) had one loopback address per loss rate,
+# logs are still named after them
+LOSS_ADDRESSES = {0: '127.0.0.1', 10: '127.0.2.1', 20: '127.0.3.1', 30: '127.0.4.1', 60: '127.0.5.1'}
+
+
+def experiments(losses, runs, optimizers, initial_port, ports_per_run):
+    """ Parameters of each run of the matrix, with disjoint port ranges """
+    port = initial_port
+    for loss in losses:
+        for run in runs:
+            for optimizer in optimizers:
+                address = LOSS_ADDRESSES.get(loss, '127.0.0.1')
+                yield {'loss': loss, 'run': run, 'optimizer': optimizer, 'address': address, 'initial_port': port,
+                       'log': 'sim.{}.{}loss.{}.log'.format(optimizer, address if loss in LOSS_ADDRESSES else loss, run)}
+                port += ports_per_run
+
+
+def finished(results, manifest):
+    """ Runs of a previous manifest that exited successfully and whose log exists, by log name """
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest) as f:
+        previous = json.load(f)
+    return {r['log']: r for r in previous
+            if r['returncode'] == 0 and os.path.exists(os.path.join(results, r['log']))}
+
+
+def experiment_command(experiment, args):
+    """ Command line of a run """
+    return [sys.executable, os.path.join(EXAMPLES, 'cigre_pv_example.py'),
+               '--with-pv', '--optimize', '--optimizer', experiment['optimizer'],
+               '--loss', str(experiment['loss']), '--seed', str(experiment['run']),
+               '--address', experiment['address'], '--initial-port', str(experiment['initial_port']),
+               '--output', os.path.join(args.results, experiment['log']),
+               '--csv-file', os.path.join(EXAMPLES, 'cigre_curves.csv'),
+               '--json-file', os.path.join(EXAMPLES, 'cigre_network_lv.json'),
+               '--sim-time', str(args.sim_time), '--accel', str(args.accel),
+               '--optimize-cycle', str(args.optimize_cycle), '--max-vm', str(args.max_vm)] + args.extra
+
+
+def run_experiment(experiment, args):
+    command = experiment_command(experiment, args)
+    stdout = os.path.join(args.results, experiment['log'] + '.out')
+    start = time()
+    with open(stdout, 'w') as out:
+        try:
+            returncode = subprocess.run(command, stdout=out, stderr=subprocess.STDOUT, cwd=EXAMPLES,
+                                        timeout=args.sim_time * args.accel + args.timeout_margin).returncode
+        except subprocess.TimeoutExpired:
+            returncode = None
+    result = dict(experiment, returncode=returncode, duration=time() - start, command=command)
+    print("{optimizer} {loss}% loss run {run}: exit {returncode} after {duration:.1f}s".format(**result))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent loss x run experiments of the CIGRE LV network')
+    parser.add_argument('--losses', nargs='+', type=float, default=[0, 10, 20, 30, 60])
+    parser.add_argument('--runs', nargs='+', type=int, default=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
+    parser.add_argument('--optimizers', nargs='+', choices=['pi', 'opf'], default=['pi', 'opf'])
+    parser.add_argument('--results', type=str, default='./raw')
+    parser.add_argument('--jobs', type=int, help='concurrent runs', default=os.cpu_count())
+    parser.add_argument('--initial-port', type=int, default=10000)
+    parser.add_argument('--ports-per-run', type=int, help='size of the port range of a run', default=100)
+    parser.add_argument('--sim-time', type=float, default=300)
+    parser.add_argument('--accel', type=float, default=1.0)
+    parser.add_argument('--optimize-cycle', type=int, default=5)
+    parser.add_argument('--max-vm', type=float, default=1.05)
+    parser.add_argument('--timeout-margin', type=float, help='time (s) granted to a run beyond its sim time',
+                        default=120)
+    parser.add_argument('--skip-analysis', action='store_true', help="don't summarize the runs' logs")
+    parser.add_argument('--skip-finished', action='store_true',
+                        help='keep the successful runs of the previous experiments.json instead of running them again')
+    parser.add_argument('--dry-run', action='store_true', help='print the commands of the runs and exit')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='arguments passed to cigre_pv_example.py after --')
+    args = parser.parse_args()
+    args.losses = [int(loss) if loss == int(loss) else loss for loss in args.losses]
+    args.extra = [arg for arg in args.extra if arg != '--']
+    args.results = os.path.abspath(args.results)
+    manifest = os.path.join(args.results, 'experiments.json')
+
+    matrix = list(experiments(args.losses, args.runs, args.optimizers, args.initial_port, args.ports_per_run))
+    done = finished(args.results, manifest) if args.skip_finished else {}
+    todo = [experiment for experiment in matrix if experiment['log'] not in done]
+    if args.dry_run:
+        for experiment in matrix:
+            if experiment['log'] in done:
+                print("# finished: {}".format(experiment['log']))
+            else:
+                print(' '.join(experiment_command(experiment, args)))
+        print("# {} experiments, {} to run".format(len(matrix), len(todo)))
+        return 0
+    os.makedirs(args.results, exist_ok=True)
+
+    print("running {} experiments, {} at a time, {} already finished".format(len(todo), args.jobs,
+                                                                            len(matrix) - len(todo)))
+    start = time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        ran = {r['log']: r for r in executor.map(lambda experiment: run_experiment(experiment, args), todo)}
+    print("ran {} experiments in {:.1f}s".format(len(ran), time() - start))
+    results = [done.get(experiment['log']) or ran[experiment['log']] for experiment in matrix]
+
+    with open(manifest, 'w') as f:
+        json.dump(results, f, indent=1)
+    failed = [r for r in results if r['returncode'] != 0]
+    if failed:
+        print("{} runs failed, see {}".format(len(failed), manifest))
+
+    if not args.skip_analysis:
+        logs = [os.path.join(args.results, r['log']) for r in results]
+        summaries = analyze_runs(logs, index=os.path.join(args.results, 'analysis_index.json'),
+                                 workers=args.jobs, max_vm=args.max_vm)
+        print("summarized {} logs".format(len(summaries)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
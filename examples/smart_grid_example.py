@@ -11,7 +11,7 @@ import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import pandapower as pp
 
-from asgrids import Allocation, SmartGridSimulation
+from asgrids import Allocation, RemoteBatch, SmartGridSimulation
 
 # Define address of physical network nodes
 # In this case, the first address is the allocator's
@@ -30,20 +30,6 @@ def load_csv(file, columns=None):
     return filtered
 
 
-# to be used remotely to implement node's consumption behavior
-# This is an example of how to schedule events from a loaded timeseries
-def remote_func(node, loads):
-    # For better performance it is better that
-    # loads reference an already delivered netref object.
-    # Scheduling allocations
-    for v in loads:
-        allocation = Allocation(0, v[1], v[2])
-        node.schedule(action=node.allocation_handle,
-                      args={'allocation': allocation},
-                      delay=v[0],
-                      callbacks=[node.allocation_report])
-
-
 allocations_queue = Queue()  # type:Queue
 
 
@@ -57,31 +43,23 @@ def allocation_updated(allocation, node_addr):
 
 def create_nodes(sim):
     # Create remote agents of type NetworkLoad
+    # Each host is configured with a single batch of commands, that avoids
+    # the latency overhead of a round trip per netref attribute access
     for i in range(len(net_addr) - 1):
-        # a bigger latency overhead is noted using netref objects (node)
-        # Fortunately we can directly execute python remotely with conn
-        node, conn = sim.create_remote_node(
-            hostname=net_addr[i + 1], username='ubuntu', keyfile='~/.ssh/id_rsa.pub',
-            ntype='load', addr='{}:{}'.format(remote_value, random.randint(6000, 9000)))
+        conn = sim.remote_host(hostname=net_addr[i + 1], username='ubuntu', keyfile='~/.ssh/id_rsa.pub')
         # This will be address in the simulation network
-        # "node" is already registered in remote namespace
-        remote_value = sim.deliver(conn, net_addr[i + 1])
-        # conn.execute("node.run()")
-        node.run()
-        remote_value = sim.deliver(conn, {'dst': '{}:5555'.format(net_addr[0])})
-        # conn.execute("node.schedule(node.send_join, {{'dst':'{}:5555'}})".format(remote_value))
-        node.schedule(node.send_join, remote_value)
-
+        addr = '{}:{}'.format(net_addr[i + 1], random.randint(6000, 9000))
+        batch = RemoteBatch()
+        batch.create('load', addr)
+        batch.call(addr, 'run')
+        batch.call(addr, 'send_join', '{}:5555'.format(net_addr[0]))
+        # Scheduling allocations from the timeseries
         loads = load_csv('../victor_scripts/curves.csv', ['timestamp', 'load_%d_p' % (i + 1), 'load_%d_q' % (i + 1)])
-        remote_loads = sim.deliver(conn, loads)
-        remote_func(node, remote_loads)
-
-    # for i in range(len(net_addr)-1):
-    #     conn = sim.conns[i]
-    #     loads = load_csv('../victor_scripts/curves.csv', ['timestamp','load_%d_p'%(i+1), 'load_%d_q'%(i+1)])
-    #     remote_loads = sim.deliver(conn, loads)
-    #     remote_func(node, remote_loads)
-    # func(conn, loads)
+        for v in loads:
+            batch.schedule(addr, 'handle_allocation', args=[Allocation(0, v[1], v[2], 1)], delay=v[0])
+        for ok, result in sim.run_batch(conn, batch):
+            if not ok:
+                print("{}: {}".format(addr, result))
 
 
 def create_pp_net(net):
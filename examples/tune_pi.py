@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Search of PIController gains on the offline simulation of the CIGRE LV network
+(see cigre_pv_offline.py), in parallel, reusing the candidates evaluated by previous searches.
+
+    python examples/tune_pi.py --sigma 0.01 0.05 0.1 --tau 1e-5 4e-5 1e-4 --workers 4
+    python examples/tune_pi.py --random 64 --seed 1 --loss 10
+"""
+
+import argparse
+from time import monotonic as time
+
+import pandas as pd
+import pandapower as pp
+
+from asgrids import ChannelModel, GridPlant, Link, OfflineSimulation, tune
+from asgrids.tuning import grid_search, random_search
+
+parser = argparse.ArgumentParser(
+    description='PI controller gains search on the offline CIGRE LV simulation')
+parser.add_argument('--csv-file', type=str,
+                    help='CSV database with loads timeseries',
+                    default='./cigre_curves.csv')
+parser.add_argument('--json-file', type=str,
+                    help='pandapower network',
+                    default='./cigre_network_lv.json')
+parser.add_argument('--sigma', nargs='+', type=float,
+                    help='proportional gains of the grid search',
+                    default=[1e-2, 5e-2, 1e-1, 5e-1])
+parser.add_argument('--tau', nargs='+', type=float,
+                    help='integral gains of the grid search',
+                    default=[0, 1e-5, 4e-5, 1e-4, 4e-4])
+parser.add_argument('--random', type=int,
+                    help='number of random candidates, instead of the grid search',
+                    default=0)
+parser.add_argument('--seed', type=int,
+                    help='seed of the random search and of the emulated packet losses',
+                    default=None)
+parser.add_argument('--optimize-cycle', type=int,
+                    help='steps between two runs of the controller',
+                    default=5)
+parser.add_argument('--max-vm', type=float,
+                    help='maxium voltage of the controller',
+                    default=1.01)
+parser.add_argument('--loss', type=float,
+                    help='packet loss rate (%%) of measures and allocations',
+                    default=0)
+parser.add_argument('--delay', type=float,
+                    help='one way delay (s)',
+                    default=0)
+parser.add_argument('--workers', type=int,
+                    help='processes evaluating candidates in parallel',
+                    default=1)
+parser.add_argument('--cache', type=str,
+                    help='JSON cache of the evaluated candidates, empty to disable',
+                    default='tuning_index.json')
+args = parser.parse_args()
+
+curves = pd.read_csv(args.csv_file)
+curves.drop(curves[curves['timestamp'] <= 49].index, inplace=True)
+curves.drop(curves[curves['timestamp'] >= 249].index, inplace=True)
+curves.reset_index(drop=True, inplace=True)
+curves['timestamp'] = curves['timestamp'] - curves.iloc[0, 0]
+channel = None
+if args.loss > 0 or args.delay > 0:
+    channel = ChannelModel(default=Link(loss=args.loss / 100, delay=args.delay), seed=args.seed)
+sim = OfflineSimulation(pp.from_json(args.json_file), curves, max_vm=args.max_vm, cycle=args.optimize_cycle,
+                        channel=channel)
+if args.random > 0:
+    candidates = random_search(args.random, seed=args.seed)
+else:
+    candidates = grid_search(args.sigma, args.tau)
+
+start = time()
+results = tune(GridPlant(sim), candidates, workers=args.workers, cache=args.cache or None)
+print("Evaluated {} candidates in {:.1f}s".format(len(results), time() - start))
+print("{:>10} {:>10} {:>14} {:>14} {:>10}".format('sigma', 'tau', 'overvoltage', 'curtailed', 'settling'))
+for r in sorted(results, key=lambda r: (r['overvoltage'], r['curtailed_energy'])):
+    print("{sigma:10.3g} {tau:10.3g} {overvoltage:12.1f}Vs {curtailed_energy:11.2f}kWh {settling_time:9.0f}s".format(**r))
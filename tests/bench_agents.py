@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Scalability benchmarks of the agent framework itself (no power flow).
+
+For each communication mode and node count it measures:
+  - startup: time to create, run and join all loads to the allocator (SmartGridSimulation.create_nodes)
+  - cpu/rss: steady state process CPU and resident memory per node
+  - ingest: curr_allocation packets/s handled by the allocator
+  - fanout: allocation latency, from allocator send to load allocation_ack
+  - loop: control loop period, from sending allocations to all loads until all
+    of them reported the new allocation back to the allocator
+
+Results are appended as JSON lines to --output, one line per measure:
+    {"benchmark": ..., "mode": ..., "nodes": ..., "value": ..., "unit": ...}
+
+    python tests/bench_agents.py --nodes 10 100 1000 --modes udp tcp ipc inproc
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+from time import monotonic as time, process_time, sleep
+
+from asgrids import Allocation, SmartGridSimulation
+
+
+def rss_mb():
+    """ Current resident memory of this process (MiB) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        # peak rather than current outside linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def wait_for(predicate, timeout, period=0.01):
+    deadline = time() + timeout
+    while time() < deadline:
+        if predicate():
+            return True
+        sleep(period)
+    return predicate()
+
+
+def bench(mode, n, address, initial_port, duration, report_period, rounds, timeout):
+    results = []
+
+    def record(benchmark, value, unit):
+        results.append({'benchmark': benchmark, 'mode': mode, 'nodes': n, 'value': value, 'unit': unit,
+                        'python': platform.python_version()})
+
+    sim = SmartGridSimulation()
+    ports = iter(range(initial_port, initial_port + n + 1))
+    rss_before = rss_mb()
+
+    # Startup
+    start = time()
+    allocator = sim.create_node('allocator', '{}:{}'.format(address, next(ports)), mode=mode)
+    allocator.run()
+    loads = sim.create_nodes('load', ['{}:{}'.format(address, next(ports)) for _ in range(n)], mode=mode,
+                             join=allocator.local, timeout=timeout)
+    record('startup', time() - start, 's')
+    failed = sum(node.remote is None for node in loads)
+    if failed:
+        print("{} {}: {} nodes failed to join".format(mode, n, failed))
+    for node in loads:
+        node.report_measure_period = report_period
+
+    # Steady state CPU, RSS and ingest rate
+    wait_for(lambda: len(allocator.nodes) == n, timeout)
+    received = allocator.metrics.get('received', 'curr_allocation')
+    cpu, start = process_time(), time()
+    sleep(duration)
+    elapsed = time() - start
+    record('cpu_per_node', 100 * (process_time() - cpu) / elapsed / n, '%')
+    record('rss_per_node', (rss_mb() - rss_before) / n, 'MiB')
+    record('ingest', (allocator.metrics.get('received', 'curr_allocation') - received) / elapsed, 'packets/s')
+
+    # Allocation fan-out and control loop
+    periods = []
+    for r in range(1, rounds + 1):
+        value = float(r)
+        start = time()
+        for node in loads:
+            allocator.send_allocation(node.local, Allocation(0, value, 0, 1))
+        if wait_for(lambda: all(nid in allocator.nodes and allocator.nodes[nid][0].p_value == value
+                                for nid in (node.local for node in loads)), timeout):
+            periods.append(time() - start)
+    latency = allocator.metrics.snapshot()['histograms'].get('allocation_latency', {}).get('None', {'count': 0})
+    for key in ('mean', 'p50', 'p90', 'p99'):
+        if key in latency:
+            record('fanout_latency_{}'.format(key), latency[key], 's')
+    if periods:
+        record('loop_period', sum(periods) / len(periods), 's')
+    record('loop_timeouts', rounds - len(periods), 'rounds')
+
+    sim.stop()
+    sleep(1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent framework scalability benchmarks')
+    parser.add_argument('--nodes', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--modes', nargs='+', choices=['udp', 'tcp', 'ipc', 'inproc'],
+                        default=['udp', 'tcp'])
+    parser.add_argument('--address', type=str, default='127.0.0.1')
+    parser.add_argument('--initial-port', type=int, default=20000)
+    parser.add_argument('--duration', type=float, help='steady state measurement time (s)', default=5)
+    parser.add_argument('--report-period', type=float, help='loads report_measure_period (s)', default=1)
+    parser.add_argument('--rounds', type=int, help='control loop rounds', default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', type=str, default='bench_agents.jsonl')
+    args = parser.parse_args()
+
+    port = args.initial_port
+    with open(args.output, 'a') as output:
+        for mode in args.modes:
+            for n in args.nodes:
+                print("benchmarking {} nodes over {}".format(n, mode))
+                for result in bench(mode, n, args.address, port, args.duration, args.report_period,
+                                    args.rounds, args.timeout):
+                    print("  {benchmark}: {value:.6g} {unit}".format(**result))
+                    output.write(json.dumps(result) + '\n')
+                output.flush()
+                # avoid reusing ports still in TIME_WAIT
+                port += n + 1
+    # Remaining agent threads are not all daemons
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
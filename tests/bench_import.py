@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Import time of asgrids entry points, each measured in a fresh interpreter.
+Results are appended as JSON lines to --output.
+
+    python tests/bench_import.py --repeat 5
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+
+STATEMENTS = {
+    'package': "import asgrids",
+    'udp_agents': "from asgrids import NetworkLoad, NetworkAllocator, AsyncUdp",
+    'tcp_agents': "from asgrids import NetworkLoad, AsyncCommunication",
+    'simulation': "from asgrids import SmartGridSimulation",
+}
+
+
+def import_time(statement):
+    code = "from time import perf_counter\nt = perf_counter()\n{}\nprint(perf_counter() - t)".format(statement)
+    return float(subprocess.check_output([sys.executable, '-c', code]).split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asgrids import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=str, default='bench_import.jsonl')
+    args = parser.parse_args()
+
+    with open(args.output, 'a') as output:
+        for name, statement in STATEMENTS.items():
+            times = sorted(import_time(statement) for _ in range(args.repeat))
+            result = {'benchmark': 'import_{}'.format(name), 'value': times[len(times) // 2], 'unit': 's',
+                      'python': platform.python_version()}
+            print("{benchmark}: {value:.4f} {unit}".format(**result))
+            output.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())